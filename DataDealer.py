@@ -1,62 +1,216 @@
+import base64
+import csv
+import io
+import json
+import os
+import re
+import threading
+import time
+from collections import namedtuple
 import psycopg2
-import pandas as pd
-from config import config
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
+from config import config, settings
 from datetime import datetime
-import yahoo_fin.stock_info as si
-import numpy as np
+from quotes import get_prices
+from metrics import CountingCursor, log, span
+
+# numpy, pandas and analytics (built on both) are imported by the functions
+# that use them, so a process that only reads rows starts without them
 
 # Function to fetch latest stock prices for a list of tickers, skipping 'CASH'
 def get_latest_stock_prices(tickers: list) -> dict:
-    stock_data = {}
+    """Fetch latest prices through the quote cache; see quotes.get_prices."""
+    with span('quote_fetch') as stage:
+        stage.rows = len(tickers)
+        return get_prices(tickers)
+
+
+# Every row belongs to an account (portfolio); callers that do not pass
+# one work on the default account, which holds all pre-account data.
+DEFAULT_ACCOUNT = 'default'
+
+ACCOUNT_PATTERN = re.compile(r'[A-Za-z0-9_.-]{1,50}')
+
+
+def check_account(account_id) -> str:
+    """Return account_id if it is a valid account key, otherwise raise ValueError."""
+    if not isinstance(account_id, str) or not ACCOUNT_PATTERN.fullmatch(account_id):
+        raise ValueError("account must be 1-50 letters, digits, '_', '.' or '-'.")
+    return account_id
+
+
+# Connection pool shared by every function in this module. Connection
+# parameters are read from database.ini once, when the pool is created.
+# Pool sizes come from the optional [pool] section of database.ini.
+POOL_DEFAULTS = {
+    'minconn': 1,
+    'maxconn': 10,
+    'checkout_timeout': 30.0,  # seconds to wait for a free connection
+    'ping_on_checkout': False,  # run SELECT 1 before handing out a connection
+}
+
+_pool = None
+_pool_settings = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+_pool_stats = {
+    'checkouts': 0,
+    'waits': 0,
+    'wait_seconds': 0.0,
+    'timeouts': 0,
+    'discarded': 0,
+}
+
+
+def _get_pool():
+    """Create the process-wide connection pool on first use."""
+    global _pool, _pool_settings, _pool_slots
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                params = config()
+                pool_settings = settings('pool', POOL_DEFAULTS)
+                log('Creating PostgreSQL connection pool...')
+                pool = psycopg2.pool.ThreadedConnectionPool(
+                    pool_settings['minconn'], pool_settings['maxconn'], cursor_factory=CountingCursor, **params)
+                _apply_schema(pool)
+                # ThreadedConnectionPool raises instead of blocking when it is
+                # exhausted, so callers queue on a semaphore sized to maxconn
+                _pool_slots = threading.BoundedSemaphore(pool_settings['maxconn'])
+                _pool_settings = pool_settings
+                _pool = pool
+    return _pool
+
+
+# Tables and indexes next to Positions (trade ledger, ...)
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+
+def _apply_schema(pool):
+    """Create missing tables and indexes from schema.sql."""
+    connection = pool.getconn()
+    try:
+        with connection.cursor() as crsr:
+            # Serialize concurrent workers starting at the same time
+            crsr.execute("SELECT pg_advisory_xact_lock(hashtext('positions_schema'));")
+            with open(SCHEMA_FILE) as schema:
+                crsr.execute(schema.read())
+        connection.commit()
+    except (Exception, psycopg2.DatabaseError):
+        connection.rollback()
+        raise
+    finally:
+        pool.putconn(connection)
+
 
-    for ticker in tickers:
-        if ticker == 'CASH':
-            continue  # Skip 'CASH' ticker entirely
+def _is_healthy(connection) -> bool:
+    """Check a pooled connection before it is handed out."""
+    if connection.closed:
+        return False
+    if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        return False
+    if _pool_settings['ping_on_checkout']:
         try:
-            # Fetch the latest stock price
-            price = si.get_live_price(ticker)
-            
-            # Convert np.float64 to native Python float if necessary
-            if isinstance(price, np.float64):
-                price = float(price)
-            
-            # Round to 2 decimal places
-            rounded_price = round(price, 2)
+            with connection.cursor() as crsr:
+                crsr.execute("SELECT 1;")
+            connection.rollback()
+        except psycopg2.Error:
+            return False
+    return True
 
-            stock_data[ticker] = rounded_price
-        except Exception as error:
-            print(f"Error fetching stock data for {ticker}: {error}")
-            stock_data[ticker] = None  # Set None if there's an error
 
-    return stock_data
+def _count(stat, amount=1):
+    with _pool_lock:
+        _pool_stats[stat] += amount
 
 
 # Function to connect to the database
 def connect_db():
-    """Connect to the PostgreSQL database and return the connection object."""
-    connection = None
+    """Check out a connection from the shared pool.
+
+    Every connection returned by this function must be handed back with
+    release_db(). Errors opening the pool or checking out a connection
+    (for example psycopg2.pool.PoolError on a checkout timeout) are raised.
+    """
     try:
-        # Get connection parameters from the config
-        params = config()
-        print('Connecting to the PostgreSQL database...')
-        connection = psycopg2.connect(**params)
+        pool = _get_pool()
+
+        # Wait for a free slot if every connection is in use
+        if not _pool_slots.acquire(blocking=False):
+            _count('waits')
+            started = time.monotonic()
+            acquired = _pool_slots.acquire(timeout=_pool_settings['checkout_timeout'])
+            _count('wait_seconds', time.monotonic() - started)
+            if not acquired:
+                _count('timeouts')
+                raise psycopg2.pool.PoolError('Timed out waiting for a database connection.')
+
+        try:
+            connection = pool.getconn()
+            while not _is_healthy(connection):
+                # Drop the broken connection and open a fresh one in its place
+                _count('discarded')
+                pool.putconn(connection, close=True)
+                connection = pool.getconn()
+        except Exception:
+            _pool_slots.release()
+            raise
+
+        _count('checkouts')
         return connection
     except (Exception, psycopg2.DatabaseError) as error:
         print(f"Error: {error}")
-        return None
+        raise
+
+
+def release_db(connection):
+    """Return a connection obtained from connect_db() to the pool."""
+    if connection is None or _pool is None:
+        return
+    close = bool(connection.closed)
+    if not close and connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        # Never hand out a connection with an open or failed transaction
+        try:
+            connection.rollback()
+        except psycopg2.Error:
+            close = True
+    _pool.putconn(connection, close=close)
+    _pool_slots.release()
+
+
+def get_pool_stats() -> dict:
+    """Return connection pool counters for monitoring."""
+    with _pool_lock:
+        stats = dict(_pool_stats)
+    stats['minconn'] = POOL_DEFAULTS['minconn'] if _pool_settings is None else _pool_settings['minconn']
+    stats['maxconn'] = POOL_DEFAULTS['maxconn'] if _pool_settings is None else _pool_settings['maxconn']
+    if _pool is not None:
+        in_use = len(_pool._used)
+        idle = len(_pool._pool)
+    else:
+        in_use = idle = 0
+    stats['in_use'] = in_use
+    stats['idle'] = idle
+    stats['size'] = in_use + idle
+    return stats
 
 # Function to fetch data from the Positions table
-def fetch_data():
-    """Fetch data from the Positions table."""
+@span('fetch_data')
+def fetch_data(account_id: str = DEFAULT_ACCOUNT):
+    """Fetch data of one account from the Positions table."""
+    import pandas as pd
+
     connection = connect_db()
 
     try:
         # Create a cursor
         crsr = connection.cursor()
 
-        # SQL query to fetch all data from Positions table
-        select_query = "SELECT * FROM Positions;"
-        crsr.execute(select_query)
+        # SQL query to fetch all data of the account from Positions table
+        select_query = "SELECT * FROM Positions WHERE account_id = %s;"
+        crsr.execute(select_query, (account_id,))
 
         # Fetch all rows and get column names
         rows = crsr.fetchall()
@@ -72,235 +226,563 @@ def fetch_data():
         raise
     finally:
         if connection is not None:
-            connection.close()
-            print('Database connection terminated.')
+            release_db(connection)
 
 
-def insert_data(row):
-    """Insert a single row into the Positions table if the symbol does not already exist."""
-    connection = connect_db()
+# Columns served by GET /api/home
+API_COLUMNS = ('allocation', 'symbol', 'quantity', 'open_date', 'avg_cost', 'value', 'current_price', 'change')
 
-    try:
-        # Create a cursor
-        crsr = connection.cursor()
+Position = namedtuple('Position', API_COLUMNS)
 
-        # Check if the symbol already exists
-        check_query = "SELECT 1 FROM Positions WHERE symbol = %s;"
-        crsr.execute(check_query, (row['symbol'],))
-        exists = crsr.fetchone()
 
-        if exists:
-            raise ValueError(f"Symbol {row['symbol']} already exists in the database.")
-        
-
-        # Get today's date in 'YYYY-MM-DD' format
-        today_date = datetime.today().strftime('%Y-%m-%d')
-
-        # Set default values for fields not provided in the row
-        allocation = row.get('allocation', 0)
-        avg_cost = row.get('avg_cost', 0)
-        value = row.get('value', 0)
-        quantity = row.get('quantity', 0)
-        current_price = row.get('price', 0)  # Use 'price' from the row data
-        change = row.get('change', 0)
-
-        # SQL query to insert a single row into the Positions table
-        insert_query = """
-            INSERT INTO Positions (allocation, symbol, quantity, open_date, avg_cost, value, current_price, change)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s);
-        """
-
-        if row['symbol'] == 'CASH':
-            # Execute the insert query with the row data
-            crsr.execute(insert_query, (
-                allocation, 
-                row['symbol'], 
-                quantity, 
-                today_date,  # Use today's date as open_date
-                row['price'], 
-                row['quantity'], 
-                current_price,  # Use the 'price' field from the row
-                change
-            ))
-        else:
-            # Execute the insert query with the row data
-            crsr.execute(insert_query, (
-                allocation, 
-                row['symbol'], 
-                row['quantity'], 
-                today_date,  # Use today's date as open_date
-                row['price'], 
-                value, 
-                current_price,  # Use the 'price' field from the row
-                change
-            ))
+@span('fetch_rows')
+def fetch_rows(account_id: str = DEFAULT_ACCOUNT) -> list:
+    """Fetch the API columns of one account's positions as Position namedtuples.
 
+    Lighter than fetch_data() for read-only callers: no DataFrame is built
+    and only the columns the API serves are selected.
+    """
+    connection = connect_db()
 
+    try:
+        # Create a cursor
+        crsr = connection.cursor()
 
-        # Commit the transaction
-        connection.commit()
-        
-        print('Row inserted successfully in Positions table.')
+        select_query = f"SELECT {', '.join(API_COLUMNS)} FROM Positions WHERE account_id = %s;"
+        crsr.execute(select_query, (account_id,))
+        return [Position._make(row) for row in crsr.fetchall()]
 
     except (Exception, psycopg2.DatabaseError) as error:
-        print(f"Error inserting data: {error}")
+        print(f"Error fetching data: {error}")
         raise
     finally:
         if connection is not None:
-            connection.close()
-            print('Database connection terminated.')
+            release_db(connection)
 
 
-# Function to update stock prices in the Positions table
-def update_current_stock_prices():
+def _encode_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
 
-    """Fetch latest stock prices and update the Positions table."""
-    # Fetch data from the database
-    df = fetch_data()
 
-    # Extract distinct symbols from the DataFrame
-    symbols = df['symbol'].unique().tolist()
+def _decode_cursor(cursor: str):
+    try:
+        sort_value, symbol = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return sort_value, symbol
+    except (ValueError, TypeError) as error:
+        raise ValueError("Invalid cursor.") from error
+
+
+@span('fetch_page')
+def fetch_page(limit: int = None, cursor: str = None, sort: str = 'symbol', descending: bool = False,
+               symbols: list = None, fields: list = None, account_id: str = DEFAULT_ACCOUNT):
+    """Fetch one page of an account's positions with sorting, filtering and projection done in SQL.
+
+    Pages are keyset-paginated on (sort column, symbol), so a page costs
+    the same however deep it is. Returns (rows as dicts, next_cursor);
+    next_cursor is None on the last page.
+    """
+    if sort not in API_COLUMNS:
+        raise ValueError(f"sort must be one of {', '.join(API_COLUMNS)}.")
+    fields = list(fields or API_COLUMNS)
+    for field in fields:
+        if field not in API_COLUMNS:
+            raise ValueError(f"Unknown field {field}.")
+
+    # The cursor needs the sort column and symbol even if they are not requested
+    columns = list(dict.fromkeys(fields + [sort, 'symbol']))
+    conditions = ["account_id = %s"]
+    params = [account_id]
+    if symbols:
+        conditions.append("symbol = ANY(%s)")
+        params.append(list(symbols))
+
+    # NULL sort values come last in either direction
+    direction = 'DESC' if descending else 'ASC'
+    compare = '<' if descending else '>'
+    if cursor is not None:
+        sort_value, last_symbol = _decode_cursor(cursor)
+        if sort == 'symbol':
+            conditions.append(f"symbol {compare} %s")
+            params.append(last_symbol)
+        elif sort_value is None:
+            conditions.append(f"{sort} IS NULL AND symbol {compare} %s")
+            params.append(last_symbol)
+        else:
+            conditions.append(f"({sort} IS NULL OR ({sort}, symbol) {compare} (%s, %s))")
+            params.extend([sort_value, last_symbol])
+
+    select_query = f"SELECT {', '.join(columns)} FROM Positions WHERE " + " AND ".join(conditions)
+    if sort == 'symbol':
+        select_query += f" ORDER BY symbol {direction}"
+    else:
+        select_query += f" ORDER BY {sort} IS NULL, {sort} {direction}, symbol {direction}"
+    if limit is not None:
+        # One extra row tells whether there is a next page
+        select_query += " LIMIT %s"
+        params.append(limit + 1)
+
+    connection = connect_db()
+
+    try:
+        # Create a cursor
+        crsr = connection.cursor()
+        crsr.execute(select_query + ";", params)
+        rows = crsr.fetchall()
 
-    # Get latest stock prices for the symbols
-    stock_prices = get_latest_stock_prices(symbols)
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"Error fetching data: {error}")
+        raise
+    finally:
+        if connection is not None:
+            release_db(connection)
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        last = dict(zip(columns, rows[-1]))
+        next_cursor = _encode_cursor([last[sort], last['symbol']])
+
+    field_positions = [columns.index(field) for field in fields]
+    data = [{field: row[position] for field, position in zip(fields, field_positions)} for row in rows]
+    return data, next_cursor
+
+
+# Numeric Positions columns that bulk_update_positions() may write
+BULK_COLUMNS = ('current_price', 'value', 'allocation', 'change', 'avg_cost', 'quantity')
+
+# Above copy_threshold rows bulk updates go through COPY into a temporary
+# table instead of an UPDATE ... FROM (VALUES ...) statement.
+BULK_DEFAULTS = {
+    'copy_threshold': 5000,
+}
+
+_bulk_settings = None
+
+
+@span('bulk_update')
+def bulk_update_positions(crsr, columns: list, rows: list) -> int:
+    """Update many Positions rows in one round trip.
+
+    rows are tuples of (account_id, symbol, value for each of columns). The caller owns
+    the transaction. Returns the number of rows updated.
+
+    CASH's value is never written: only trades change it, with arithmetic
+    in SQL, and a value computed from an earlier read would undo a trade
+    that committed in between. The rows are locked first in the order
+    trades lock them, positions by symbol and CASH last, so an update
+    cannot deadlock with a trade.
+    """
+    global _bulk_settings
+    if not rows:
+        return 0
+    for column in columns:
+        if column not in BULK_COLUMNS:
+            raise ValueError(f"Column {column} cannot be bulk updated.")
+    if _bulk_settings is None:
+        _bulk_settings = settings('bulk', BULK_DEFAULTS)
+
+    set_clause = ', '.join(f"{column} = CASE WHEN p.symbol = 'CASH' THEN p.value ELSE v.value END"
+                           if column == 'value' else f'{column} = v.{column}' for column in columns)
+    lock_query = """
+        SELECT 1 FROM Positions AS p
+        JOIN {source} AS v (account_id, symbol) ON p.account_id = v.account_id AND p.symbol = v.symbol
+        ORDER BY p.symbol = 'CASH', p.account_id, p.symbol
+        FOR UPDATE OF p;
+    """
+
+    if len(rows) >= _bulk_settings['copy_threshold']:
+        # Stream the rows into a temporary table and merge them in one UPDATE
+        column_types = ', '.join(f'{column} double precision' for column in columns)
+        crsr.execute(f"CREATE TEMP TABLE positions_bulk (account_id text, symbol text, {column_types}) ON COMMIT DROP;")
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            # An unquoted empty field is NULL in COPY's csv format
+            writer.writerow(['' if value is None else value for value in row])
+        buffer.seek(0)
+        crsr.copy_expert(f"COPY positions_bulk (account_id, symbol, {', '.join(columns)}) FROM STDIN WITH (FORMAT csv);",
+                         buffer)
+        crsr.execute(lock_query.format(source='(SELECT account_id, symbol FROM positions_bulk)'))
+        crsr.execute(f"""
+            UPDATE Positions AS p
+            SET {set_clause}
+            FROM positions_bulk AS v
+            WHERE p.account_id = v.account_id AND p.symbol = v.symbol;
+        """)
+        updated = crsr.rowcount
+        crsr.execute("DROP TABLE positions_bulk;")
+        return updated
+
+    psycopg2.extras.execute_values(crsr, lock_query.format(source='(VALUES %s)'), [row[:2] for row in rows],
+                                   page_size=len(rows))
+    template = '(%s, %s' + ', %s::double precision' * len(columns) + ')'
+    update_query = f"""
+        UPDATE Positions AS p
+        SET {set_clause}
+        FROM (VALUES %s) AS v (account_id, symbol, {', '.join(columns)})
+        WHERE p.account_id = v.account_id AND p.symbol = v.symbol;
+    """
+    psycopg2.extras.execute_values(crsr, update_query, rows, template=template, page_size=len(rows))
+    return crsr.rowcount
+
+
+def _insert_position(crsr, account_id: str, row):
+    """Insert a single row into the Positions table if the account does not hold the symbol yet."""
+    # Check if the symbol already exists
+    check_query = "SELECT 1 FROM Positions WHERE account_id = %s AND symbol = %s;"
+    crsr.execute(check_query, (account_id, row['symbol']))
+    exists = crsr.fetchone()
+
+    if exists:
+        raise ValueError(f"Symbol {row['symbol']} already exists in the database.")
     
+
+    # Get today's date in 'YYYY-MM-DD' format
+    today_date = datetime.today().strftime('%Y-%m-%d')
+
+    # Set default values for fields not provided in the row
+    allocation = row.get('allocation', 0)
+    avg_cost = row.get('avg_cost', 0)
+    value = row.get('value', 0)
+    quantity = row.get('quantity', 0)
+    current_price = row.get('price', 0)  # Use 'price' from the row data
+    change = row.get('change', 0)
+
+    # SQL query to insert a single row into the Positions table
+    insert_query = """
+        INSERT INTO Positions (account_id, allocation, symbol, quantity, open_date, avg_cost, value, current_price, change)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
+    """
+
+    if row['symbol'] == 'CASH':
+        # Execute the insert query with the row data
+        crsr.execute(insert_query, (
+            account_id,
+            allocation, 
+            row['symbol'], 
+            quantity, 
+            today_date,  # Use today's date as open_date
+            row['price'], 
+            row['quantity'], 
+            current_price,  # Use the 'price' field from the row
+            change
+        ))
+    else:
+        # Execute the insert query with the row data
+        crsr.execute(insert_query, (
+            account_id,
+            allocation, 
+            row['symbol'], 
+            row['quantity'], 
+            today_date,  # Use today's date as open_date
+            row['price'], 
+            value, 
+            current_price,  # Use the 'price' field from the row
+            change
+        ))
+
+    _record_trade(crsr, account_id, 'Entry', row['symbol'], row['quantity'], row['price'])
+
+
+@span('insert_data')
+def insert_data(row, account_id: str = DEFAULT_ACCOUNT):
+    """Insert a single row into the Positions table if the account does not hold the symbol yet."""
     connection = connect_db()
 
     try:
         # Create a cursor
         crsr = connection.cursor()
 
-        # Update prices in the Positions table
-        for symbol, price in stock_prices.items():
-            if price is None:
-                continue  # Skip if the price could not be fetched
-            update_query = """
-                UPDATE Positions
-                SET current_price = %s
-                WHERE symbol = %s;
-            """
-            crsr.execute(update_query, (price, symbol))
+        _insert_position(crsr, account_id, row)
 
         # Commit the transaction
         connection.commit()
-        print('Stock prices updated successfully in Positions table.')
+        
+        log('Row inserted successfully in Positions table.')
 
     except (Exception, psycopg2.DatabaseError) as error:
-        print(f"Error updating stock prices: {error}")
+        print(f"Error inserting data: {error}")
+        raise
     finally:
         if connection is not None:
-            connection.close()
-            print('Database connection terminated.')
+            release_db(connection)
+
+
+def _record_trade(crsr, account_id: str, action: str, symbol: str, quantity, price):
+    """Append an executed trade to the trades ledger."""
+    insert_query = """
+        INSERT INTO trades (account_id, symbol, action, quantity, price)
+        VALUES (%s, %s, %s, %s, %s);
+    """
+    crsr.execute(insert_query, (account_id, symbol, action, quantity, price))
+
+
+# Trade helpers. Each one runs on the caller's cursor and transaction, locks
+# only the traded symbol's row of the account and returns the amount the
+# account's CASH changes by.
+# Symbol rows are always locked before the CASH row, and CASH is adjusted
+# with arithmetic in SQL, so concurrent trades cannot deadlock or overwrite
+# each other's cash updates. refresh_positions keeps to the same rules: it
+# locks its rows by symbol with CASH last and never writes CASH's value.
+# Every executed trade is also appended to the trades ledger.
+
+def _adjust_cash(crsr, account_id: str, amount):
+    """Add amount to the account's CASH value and return the new value."""
+    update_cash_query = """
+        UPDATE Positions
+        SET value = value + %s::numeric
+        WHERE account_id = %s AND symbol = 'CASH'
+        RETURNING value;
+    """
+    crsr.execute(update_cash_query, (amount, account_id))
+    cash_row = crsr.fetchone()
+    if cash_row is None:
+        raise ValueError("CASH position not found in the database.")
+    return cash_row[0]
+
+
+def _exit_position(crsr, account_id: str, symbol: str, sell_price: float, quantity_to_decrease: int):
+    """Delete the position and return the cash it frees."""
+    delete_query = """
+        DELETE FROM Positions
+        WHERE account_id = %s AND symbol = %s
+        RETURNING symbol;
+    """
+    crsr.execute(delete_query, (account_id, symbol))
+    if crsr.fetchone() is None:
+        raise ValueError(f"Symbol {symbol} does not exist in the database.")
+    _record_trade(crsr, account_id, 'Exit', symbol, quantity_to_decrease, sell_price)
+    return quantity_to_decrease * sell_price
+
+
+def _add_to_position(crsr, account_id: str, symbol: str, buy_price: float, quantity_to_increase: int):
+    """Increase the position, update its average price and return the (negative) cash change.
+
+    Returns the new average price and quantity as well.
+    """
+    select_query = "SELECT avg_cost, quantity FROM Positions WHERE account_id = %s AND symbol = %s FOR UPDATE;"
+    crsr.execute(select_query, (account_id, symbol))
+    current_data = crsr.fetchone()
+    if current_data is None:
+        raise ValueError(f"Symbol '{symbol}' not found in the database.")
+
+    # Convert database types to regular Python types
+    current_avg_price = float(current_data[0])
+    current_quantity = int(current_data[1])
+
+    # Calculate the new average price
+    total_value = (current_avg_price * current_quantity) + (buy_price * quantity_to_increase)
+    total_quantity = current_quantity + quantity_to_increase
+    new_avg_price = total_value / total_quantity if total_quantity != 0 else 0
+
+    update_query = """
+        UPDATE Positions
+        SET avg_cost = %s,
+            quantity = %s
+        WHERE account_id = %s AND symbol = %s;
+    """
+    crsr.execute(update_query, (round(new_avg_price, 2), total_quantity, account_id, symbol))
+    _record_trade(crsr, account_id, 'Add', symbol, quantity_to_increase, buy_price)
+    return -(quantity_to_increase * buy_price), new_avg_price, total_quantity
+
+
+def _trim_position(crsr, account_id: str, symbol: str, sell_price: float, quantity_to_decrease: int):
+    """Decrease the position and return the cash it frees and the new quantity.
+
+    Returns (None, current quantity) without changing anything when the
+    position is smaller than quantity_to_decrease.
+    """
+    update_query = """
+        UPDATE Positions
+        SET quantity = quantity - %s
+        WHERE account_id = %s AND symbol = %s AND quantity >= %s
+        RETURNING quantity;
+    """
+    crsr.execute(update_query, (quantity_to_decrease, account_id, symbol, quantity_to_decrease))
+    updated = crsr.fetchone()
+    if updated is not None:
+        _record_trade(crsr, account_id, 'Trim', symbol, quantity_to_decrease, sell_price)
+        return quantity_to_decrease * sell_price, int(updated[0])
+
+    # Nothing updated: find out whether the symbol is missing or too small
+    crsr.execute("SELECT quantity FROM Positions WHERE account_id = %s AND symbol = %s;", (account_id, symbol))
+    current_data = crsr.fetchone()
+    if current_data is None:
+        raise ValueError(f"Symbol '{symbol}' not found in the database.")
+    return None, int(current_data[0])
 
 
 # Exit from position
-def delete_data_by_symbol(symbol: str, sell_price:float, quantity_to_decrease: int):
+@span('delete_data_by_symbol')
+def delete_data_by_symbol(symbol: str, sell_price:float, quantity_to_decrease: int, account_id: str = DEFAULT_ACCOUNT):
 
-    """Delete a row from the Positions table based on the symbol."""
+    """Delete a row from the Positions table based on the symbol and credit the sale to CASH."""
     connection = connect_db()
-    # Fetch data from the database
-    df = fetch_data()
+
     try:
         # Create a cursor
         crsr = connection.cursor()
-        cash_row = df[df['symbol'] == 'CASH']
-        current_cash_value = cash_row.iloc[0]['value']
-        # Get the current cash value from df
-
-        # Calculate the adjustment amount
-        amount = quantity_to_decrease * sell_price
-
-        # Update the cash value
-        updated_cash_value = current_cash_value + amount
-
-        # Update the cash position in the database
-        update_cash_query = """
-            UPDATE Positions
-            SET value = %s
-            WHERE symbol = 'CASH';
-        """
-        crsr.execute(update_cash_query, (updated_cash_value,))
-        # Check if the symbol exists
-        check_query = "SELECT 1 FROM Positions WHERE symbol = %s;"
-        crsr.execute(check_query, (symbol,))
-        exists = crsr.fetchone()
-
-        if not exists:
-            raise ValueError(f"Symbol {symbol} does not exist in the database.")
-
-        # SQL query to delete a row based on the symbol
-        delete_query = """
-            DELETE FROM Positions
-            WHERE symbol = %s;
-        """
-        # Execute the delete query with the symbol
-        crsr.execute(delete_query, (symbol,))
-
-        print(f'CASH position updated. New cash value: {updated_cash_value}.')
+
+        amount = _exit_position(crsr, account_id, symbol, sell_price, quantity_to_decrease)
+        updated_cash_value = _adjust_cash(crsr, account_id, amount)
+        log(f'CASH position updated. New cash value: {updated_cash_value}.')
 
         # Commit the transaction
         connection.commit()
-        print(f'Row with symbol {symbol} deleted successfully from Positions table.')
+        log(f'Row with symbol {symbol} deleted successfully from Positions table.')
 
     except (Exception, psycopg2.DatabaseError) as error:
         print(f"Error deleting data: {error}")
         raise
     finally:
         if connection is not None:
-            connection.close()
-            print('Database connection terminated.')
-
+            release_db(connection)
+
+
+# Columns written back by refresh_positions
+REFRESH_COLUMNS = ['current_price', 'value', 'allocation', 'change']
+
+# Snapshots for historical charts, from the optional [history] section.
+# A refresh appends one when something changed and the previous snapshot
+# is at least min_interval seconds old.
+HISTORY_DEFAULTS = {
+    'snapshots': True,
+    'min_interval': 60.0,
+}
+
+_history_settings = None
+_last_snapshot = {}
+
+
+def snapshot_due(account_id: str = DEFAULT_ACCOUNT) -> bool:
+    """Return True (and start a new interval) if a history snapshot of the account should be taken now."""
+    global _history_settings
+    if _history_settings is None:
+        _history_settings = settings('history', HISTORY_DEFAULTS)
+    if not _history_settings['snapshots']:
+        return False
+    now = time.monotonic()
+    last = _last_snapshot.get(account_id)
+    if last is not None and now - last < _history_settings['min_interval']:
+        return False
+    _last_snapshot[account_id] = now
+    return True
+
+
+@span('snapshot')
+def _append_snapshot(crsr, df) -> bool:
+    """Append price, value and allocation of every position to position_snapshots.
+
+    Only accounts whose previous snapshot is older than min_interval are included.
+    """
+    due = [account_id for account_id in df['account_id'].unique().tolist() if snapshot_due(account_id)]
+    if not due:
+        return False
+
+    insert_query = """
+        INSERT INTO position_snapshots (taken_at, account_id, symbol, price, value, allocation)
+        VALUES %s;
+    """
+    snapshot = df.loc[df['account_id'].isin(due), ['account_id', 'symbol', 'current_price', 'value', 'allocation']]
+    rows = list(snapshot.itertuples(index=False, name=None))
+    psycopg2.extras.execute_values(
+        crsr, insert_query, rows, template='(now(), %s, %s, %s, %s, %s)', page_size=max(len(rows), 1))
+    return True
+
+# Rows written and skipped as unchanged by refresh_positions
+_refresh_stats = {
+    'refreshes': 0,
+    'rows_written': 0,
+    'rows_skipped': 0,
+    'last_written': 0,
+    'last_skipped': 0,
+}
+_refresh_stats_lock = threading.Lock()
+
+
+def record_refresh(written: int, skipped: int):
+    with _refresh_stats_lock:
+        _refresh_stats['refreshes'] += 1
+        _refresh_stats['rows_written'] += written
+        _refresh_stats['rows_skipped'] += skipped
+        _refresh_stats['last_written'] = written
+        _refresh_stats['last_skipped'] = skipped
+
+
+def get_refresh_stats() -> dict:
+    """Return how many rows refreshes wrote and skipped as unchanged."""
+    with _refresh_stats_lock:
+        return dict(_refresh_stats)
+
+
+@span('refresh_positions')
+def refresh_positions(account_id: str = None):
+    """Refresh prices, values, allocations and changes of all positions in one pass.
+
+    Positions is read once, everything is computed in memory and written back
+    with a single batched UPDATE inside one transaction. All accounts are
+    refreshed together, so a symbol held by many accounts is priced once;
+    pass account_id to refresh only that account. Returns the refreshed
+    frame, so callers do not need to read the table again.
+    """
+    import pandas as pd
+    from analytics import changed_rows, compute_position_metrics
 
-# Käy laskemassa kunkin position arvon nykyisellä hinnalla ja asettaa value kentän
-def calculate_and_update_values():
-
-    df = fetch_data()
     connection = connect_db()
 
     try:
         # Create a cursor
         crsr = connection.cursor()
 
-        # Loop through each row in the DataFrame and calculate value
-        for index, row in df.iterrows():
-            symbol = row['symbol']
-            quantity = row['quantity']
-            current_price = row['current_price']
-
-            if symbol == 'CASH':
-               continue
+        with span('refresh_read'):
+            if account_id is None:
+                crsr.execute("SELECT * FROM Positions;")
             else:
-                # Calculate value as quantity * current_price
-                if current_price is not None and quantity is not None:
-                    value = quantity * current_price
-                else:
-                    value = 0  # Set value to 0 if current_price or quantity is None
-
-            # Update the value in the Positions table
-            update_query = """
-                UPDATE Positions
-                SET value = %s
-                WHERE symbol = %s;
-            """
-            crsr.execute(update_query, (round(value, 2), symbol))
+                crsr.execute("SELECT * FROM Positions WHERE account_id = %s;", (account_id,))
+            rows = crsr.fetchall()
+            columns = [desc[0] for desc in crsr.description]
+            df = pd.DataFrame(rows, columns=columns)
+
+        # Get latest stock prices for the distinct symbols of all accounts and recompute everything
+        symbols = df['symbol'].unique().tolist()
+        stock_prices = get_latest_stock_prices(symbols)
+        with span('refresh_compute') as stage:
+            refreshed = compute_position_metrics(df, stock_prices)
+            stage.rows = len(refreshed)
+
+            # Write back only the rows whose rounded values changed, in one statement
+            dirty = changed_rows(df, refreshed, REFRESH_COLUMNS)
+        rows = list(refreshed.loc[dirty, ['account_id', 'symbol'] + REFRESH_COLUMNS].itertuples(index=False, name=None))
+        bulk_update_positions(crsr, REFRESH_COLUMNS, rows)
+        record_refresh(len(rows), len(refreshed) - len(rows))
+        if rows:
+            _append_snapshot(crsr, refreshed)
 
         # Commit the transaction
         connection.commit()
-        print('Values updated successfully in Positions table.')
+        log(f'Positions refreshed successfully in Positions table '
+            f'({len(rows)} rows written, {len(refreshed) - len(rows)} unchanged).')
+        return refreshed
 
     except (Exception, psycopg2.DatabaseError) as error:
-        print(f"Error updating values: {error}")
+        print(f"Error refreshing positions: {error}")
+        raise
     finally:
         if connection is not None:
-            connection.close()
-            print('Database connection terminated.')
+            release_db(connection)
 
 
+@span('rebuild_positions_from_ledger')
+def rebuild_positions_from_ledger(apply: bool = True, account_id: str = DEFAULT_ACCOUNT):
+    """Rebuild an account's positions by replaying its trades from the ledger.
 
-def calculate_and_update_allocations():
-    """Calculate the allocation for each position and update the Positions table."""
-    # Fetch data from the database
-    df = fetch_data()
+    Quantities, average costs, open dates and CASH come from the ledger;
+    current prices are kept and value, allocation and change are
+    recomputed from them. With apply=False nothing is written, which is
+    useful for audits. Returns the rebuilt frame.
+    """
+    import pandas as pd
+    from analytics import compute_position_metrics, replay_trades
 
     connection = connect_db()
 
@@ -308,47 +790,70 @@ def calculate_and_update_allocations():
         # Create a cursor
         crsr = connection.cursor()
 
-        # Calculate the total sum of the value column
-        total_value = df['value'].sum()
-        
-        if total_value == 0:
-            print("Total value is zero. Allocation calculation will be skipped.")
-            return
-
-        # Loop through each row in the DataFrame and calculate allocation
-        for index, row in df.iterrows():
-            symbol = row['symbol']
-            value = row['value']
-
-            if value is not None and total_value > 0:
-                # Calculate the allocation
-                allocation = (value / total_value)*100
-
-                # Update the allocation in the Positions table
-                update_query = """
-                    UPDATE Positions
-                    SET allocation = %s
-                    WHERE symbol = %s;
-                """
-                crsr.execute(update_query, (round(allocation, 2), symbol))
-
-        # Commit the transaction
-        connection.commit()
-        print('Allocations updated successfully in Positions table.')
+        if apply:
+            # Hold off trades and refreshes while the table is replaced
+            crsr.execute("LOCK TABLE Positions IN EXCLUSIVE MODE;")
+
+        crsr.execute("""
+            SELECT symbol, action, quantity, price, executed_at
+            FROM trades
+            WHERE account_id = %s
+            ORDER BY executed_at, id;
+        """, (account_id,))
+        trades = pd.DataFrame(crsr.fetchall(), columns=['symbol', 'action', 'quantity', 'price', 'executed_at'])
+        rebuilt = replay_trades(trades)
+
+        crsr.execute("SELECT symbol, current_price FROM Positions WHERE account_id = %s;", (account_id,))
+        current_prices = dict(crsr.fetchall())
+
+        # Entries start at their entry price, like insert_data; known prices are kept
+        df = pd.DataFrame({
+            'account_id': account_id,
+            'allocation': 0.0,
+            'symbol': rebuilt['symbol'],
+            'quantity': rebuilt['quantity'],
+            'open_date': [pd.Timestamp(executed_at).date() for executed_at in rebuilt['open_date']],
+            'avg_cost': rebuilt['avg_cost'],
+            'value': rebuilt['value'],
+            'current_price': [current_prices.get(symbol, avg_cost)
+                              for symbol, avg_cost in zip(rebuilt['symbol'], rebuilt['avg_cost'])],
+            'change': 0.0,
+        })
+        df = compute_position_metrics(df, {})
+
+        if apply:
+            crsr.execute("DELETE FROM Positions WHERE account_id = %s;", (account_id,))
+            insert_query = f"INSERT INTO Positions ({', '.join(df.columns)}) VALUES %s;"
+            psycopg2.extras.execute_values(
+                crsr, insert_query, list(df.itertuples(index=False, name=None)), page_size=max(len(df), 1))
+            connection.commit()
+            log(f'Positions of {account_id} rebuilt from {len(trades)} trades ({len(df)} positions).')
+        return df
 
     except (Exception, psycopg2.DatabaseError) as error:
-        print(f"Error updating allocations: {error}")
+        print(f"Error rebuilding positions: {error}")
+        raise
     finally:
         if connection is not None:
-            connection.close()
-            print('Database connection terminated.')
+            release_db(connection)
+
 
+# Snapshot columns that can be charted
+HISTORY_FIELDS = ('price', 'value', 'allocation')
 
 
-def calculate_and_update_changes():
-    """Calculate the change for each position and update the Positions table."""
-    # Fetch data from the database
-    df = fetch_data()
+@span('fetch_history')
+def fetch_history(field: str, start, end, symbol: str = None, account_id: str = DEFAULT_ACCOUNT):
+    """Fetch a snapshot series of an account between start and end as (epoch milliseconds, values) arrays.
+
+    Without a symbol the series is the total portfolio value.
+    """
+    import numpy as np
+
+    if field not in HISTORY_FIELDS:
+        raise ValueError(f"field must be one of {', '.join(HISTORY_FIELDS)}.")
+    if symbol is None and field != 'value':
+        raise ValueError("symbol is required unless field is value.")
 
     connection = connect_db()
 
@@ -356,176 +861,218 @@ def calculate_and_update_changes():
         # Create a cursor
         crsr = connection.cursor()
 
-        # Loop through each row in the DataFrame and calculate change
-        for index, row in df.iterrows():
-            symbol = row['symbol']
-            current_price = row['current_price']
-            avg_cost = row['avg_cost']
-
-            if current_price is not None and avg_cost is not None and current_price != 0:
-                # Calculate the change
-                change = ((current_price - avg_cost) / current_price*100)
-
-                # Update the change in the Positions table
-                update_query = """
-                    UPDATE Positions
-                    SET change = %s
-                    WHERE symbol = %s;
-                """
-                crsr.execute(update_query, (round(change, 2), symbol))
+        if symbol is None:
+            select_query = """
+                SELECT floor(extract(epoch FROM taken_at) * 1000), round(sum(value)::numeric, 2)
+                FROM position_snapshots
+                WHERE taken_at >= %s AND taken_at < %s AND account_id = %s
+                GROUP BY taken_at
+                ORDER BY taken_at;
+            """
+            crsr.execute(select_query, (start, end, account_id))
+        else:
+            select_query = f"""
+                SELECT floor(extract(epoch FROM taken_at) * 1000), {field}
+                FROM position_snapshots
+                WHERE taken_at >= %s AND taken_at < %s AND account_id = %s AND symbol = %s AND {field} IS NOT NULL
+                ORDER BY taken_at;
+            """
+            crsr.execute(select_query, (start, end, account_id, symbol))
 
-        # Commit the transaction
-        connection.commit()
-        print('Changes updated successfully in Positions table.')
+        rows = crsr.fetchall()
+        times = np.array([row[0] for row in rows], dtype=float)
+        values = np.array([row[1] for row in rows], dtype=float)
+        return times, values
 
     except (Exception, psycopg2.DatabaseError) as error:
-        print(f"Error updating changes: {error}")
+        print(f"Error fetching history: {error}")
+        raise
     finally:
         if connection is not None:
-            connection.close()
-            print('Database connection terminated.')
+            release_db(connection)
 
 
 # Addaa positioon
-def update_average_price_and_quantity(symbol: str, buy_price: float, quantity_to_increase: int):
+@span('update_average_price_and_quantity')
+def update_average_price_and_quantity(symbol: str, buy_price: float, quantity_to_increase: int,
+                                      account_id: str = DEFAULT_ACCOUNT):
     """Calculate and update the new average price and quantity for a given position in the database."""
-    # Fetch data from the database
-    df = fetch_data() 
     connection = connect_db()
 
     try:
         # Create a cursor
         crsr = connection.cursor()
 
-        # Check if the symbol exists in the database
-        if symbol not in df['symbol'].values:
-           raise ValueError(f"Symbol '{symbol}' not found in the database.")
-
-        # Fetch the current average price and quantity for the given symbol
-        current_data = df[df['symbol'] == symbol].iloc[0]
-        current_avg_price = current_data['avg_cost']
-        current_quantity = current_data['quantity']
-
-        # Convert numpy types to regular Python types
-        current_avg_price = float(current_avg_price)
-        current_quantity = int(current_quantity)
-
-        # Calculate the new average price
-        total_value = (current_avg_price * current_quantity) + (buy_price * quantity_to_increase)
-        total_quantity = current_quantity + quantity_to_increase
-        new_avg_price = total_value / total_quantity if total_quantity != 0 else 0
-
-        # Update the average price and quantity in the Positions table
-        update_query = """
-            UPDATE Positions
-            SET avg_cost = %s,
-                quantity = %s
-            WHERE symbol = %s;
-        """
-        crsr.execute(update_query, (round(new_avg_price, 2), total_quantity, symbol))
-       
-        cash_row = df[df['symbol'] == 'CASH']
-        current_cash_value = cash_row.iloc[0]['value']
-        # Get the current cash value from df
-
-        # Calculate the adjustment amount
-        amount = quantity_to_increase * buy_price
-
-        # Update the cash value
-        updated_cash_value = current_cash_value - amount
-
-        # Update the cash position in the database
-        update_cash_query = """
-            UPDATE Positions
-            SET value = %s
-            WHERE symbol = 'CASH';
-        """
-        crsr.execute(update_cash_query, (updated_cash_value,))
-        print(f'CASH position updated. New cash value: {updated_cash_value}.')
-        
+        amount, new_avg_price, total_quantity = _add_to_position(crsr, account_id, symbol, buy_price,
+                                                                 quantity_to_increase)
+        updated_cash_value = _adjust_cash(crsr, account_id, amount)
+        log(f'CASH position updated. New cash value: {updated_cash_value}.')
+
         # Commit the transaction
         connection.commit()
-        print(f'Average price for {symbol} updated to {new_avg_price:.2f}. Quantity updated to {total_quantity}.')
+        log(f'Average price for {symbol} updated to {new_avg_price:.2f}. Quantity updated to {total_quantity}.')
 
     except (Exception, psycopg2.DatabaseError) as error:
         print(f"Error updating average price and quantity: {error}")
         raise
     finally:
         if connection is not None:
-            connection.close()
-            print('Database connection terminated.')
+            release_db(connection)
 
 
 # Trimmaa positiota
-def decrease_quantity(symbol: str, sell_price:float, quantity_to_decrease: int):
+@span('decrease_quantity')
+def decrease_quantity(symbol: str, sell_price:float, quantity_to_decrease: int, account_id: str = DEFAULT_ACCOUNT):
 
-    df = fetch_data()
     connection = connect_db()
 
     try:
         # Create a cursor
         crsr = connection.cursor()
 
-        # Check if the symbol exists in the database
-        if symbol not in df['symbol'].values:
-            raise ValueError(f"Symbol '{symbol}' not found in the database.")
-
-        # Fetch the current quantity for the given symbol
-        current_data = df[df['symbol'] == symbol].iloc[0]
-        current_quantity = current_data['quantity']
-
-        # Convert numpy types to regular Python types
-        current_quantity = int(current_quantity)
+        amount, new_quantity = _trim_position(crsr, account_id, symbol, sell_price, quantity_to_decrease)
 
         # Ensure that the quantity to decrease does not exceed the current quantity
-        if quantity_to_decrease > current_quantity:
-            print(f"Quantity to decrease ({quantity_to_decrease}) exceeds current quantity ({current_quantity}) for symbol '{symbol}'.")
+        if amount is None:
+            print(f"Quantity to decrease ({quantity_to_decrease}) exceeds current quantity ({new_quantity}) for symbol '{symbol}'.")
             return
 
-        # Calculate the new quantity
-        new_quantity = current_quantity - quantity_to_decrease
-
-        # Update the quantity in the Positions table
-        update_query = """
-            UPDATE Positions
-            SET quantity = %s
-            WHERE symbol = %s;
-        """
-        crsr.execute(update_query, (new_quantity, symbol))
+        updated_cash_value = _adjust_cash(crsr, account_id, amount)
+        log(f'CASH position updated. New cash value: {updated_cash_value}.')
 
+        # Commit the transaction
+        connection.commit()
+        log(f'Quantity for {symbol} decreased by {quantity_to_decrease}. New quantity is {new_quantity}.')
 
-        cash_row = df[df['symbol'] == 'CASH']
-        current_cash_value = cash_row.iloc[0]['value']
-        # Get the current cash value from df
-
-        # Calculate the adjustment amount
-        amount = quantity_to_decrease * sell_price
-
-        # Update the cash value
-        updated_cash_value = current_cash_value + amount
-
-        # Update the cash position in the database
-        update_cash_query = """
-            UPDATE Positions
-            SET value = %s
-            WHERE symbol = 'CASH';
-        """
-        crsr.execute(update_cash_query, (updated_cash_value,))
-        print(f'CASH position updated. New cash value: {updated_cash_value}.')
-
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"Error decreasing quantity: {error}")
+        raise
+    finally:
+        if connection is not None:
+            release_db(connection)
+
+
+# Trades accepted by POST /api/positions and POST /api/positions/batch
+TRADE_OPTIONS = ('Entry', 'Exit', 'Add', 'Trim')
+
+
+def validate_trade(trade) -> str:
+    """Return what is wrong with a trade, or None if it can be executed."""
+    if not isinstance(trade, dict):
+        return "Trade must be an object."
+    if trade.get('selectedOption') not in TRADE_OPTIONS:
+        return f"selectedOption must be one of {', '.join(TRADE_OPTIONS)}."
+    symbol = trade.get('symbol')
+    if not isinstance(symbol, str) or not symbol:
+        return "symbol is required."
+    for field in ('price', 'quantity'):
+        value = trade.get(field)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return f"{field} must be a number."
+        if value < 0 or (field == 'quantity' and value == 0):
+            return f"{field} must be positive."
+    # Positions.quantity holds whole shares; only a CASH Entry's quantity is an amount of money
+    quantity = trade['quantity']
+    if symbol != 'CASH' and not (isinstance(quantity, int) or quantity.is_integer()):
+        return "quantity must be a whole number of shares."
+    return None
+
+
+def execute_trade(data, account_id: str = DEFAULT_ACCOUNT):
+    """Execute one trade posted to /api/positions according to its selectedOption."""
+    message = validate_trade(data)
+    if message:
+        raise ValueError(message)
+    selected_option = data.get('selectedOption')
+    log(selected_option)
+
+    if selected_option == 'Entry':
+        insert_data(data, account_id)
+    elif selected_option == 'Exit':
+        delete_data_by_symbol(data.get('symbol'), data.get('price'),data.get('quantity'), account_id)
+    elif selected_option == 'Add':
+        update_average_price_and_quantity(data.get('symbol'), data.get('price'),data.get('quantity'), account_id)
+    elif selected_option == 'Trim':
+        decrease_quantity(data.get("symbol"),data.get('price'),data.get('quantity'), account_id)
+
+
+class TradeBatchError(ValueError):
+    """A trade in a batch could not be executed; the whole batch was rolled back."""
+
+    def __init__(self, index: int, message: str):
+        super().__init__(f"Trade {index}: {message}")
+        self.index = index
+        self.reason = message
+
+
+@span('execute_trades')
+def execute_trades(trades: list, account_id: str = DEFAULT_ACCOUNT) -> list:
+    """Execute a list of validated trades of one account in order inside one transaction.
+
+    Cash changes are summed and applied to CASH with a single update at the
+    end. Any failing trade (including a Trim larger than the position)
+    rolls back the whole batch with TradeBatchError. Returns one result
+    per trade.
+    """
+    connection = connect_db()
 
+    try:
+        # Create a cursor
+        crsr = connection.cursor()
 
+        # Lock every traded symbol in a fixed order so concurrent batches cannot deadlock
+        symbols = sorted({trade['symbol'] for trade in trades if trade['symbol'] != 'CASH'})
+        crsr.execute("""
+            SELECT symbol FROM Positions
+            WHERE account_id = %s AND symbol = ANY(%s)
+            ORDER BY symbol
+            FOR UPDATE;
+        """, (account_id, symbols))
+
+        results = []
+        cash_change = 0
+        for index, trade in enumerate(trades):
+            option = trade['selectedOption']
+            symbol = trade['symbol']
+            price = trade['price']
+            quantity = trade['quantity']
+            result = {'index': index, 'selectedOption': option, 'symbol': symbol, 'status': 'success'}
+
+            try:
+                if option == 'Entry':
+                    _insert_position(crsr, account_id, trade)
+                    amount = 0
+                elif option == 'Exit':
+                    amount = _exit_position(crsr, account_id, symbol, price, quantity)
+                elif option == 'Add':
+                    amount, new_avg_price, total_quantity = _add_to_position(crsr, account_id, symbol, price, quantity)
+                    result['avg_cost'] = round(new_avg_price, 2)
+                    result['quantity'] = total_quantity
+                else:
+                    amount, new_quantity = _trim_position(crsr, account_id, symbol, price, quantity)
+                    if amount is None:
+                        raise ValueError(f"Quantity to decrease ({quantity}) exceeds current quantity "
+                                         f"({new_quantity}) for symbol '{symbol}'.")
+                    result['quantity'] = new_quantity
+            except ValueError as error:
+                raise TradeBatchError(index, str(error)) from error
+
+            result['cash_change'] = amount
+            cash_change += amount
+            results.append(result)
+
+        if cash_change:
+            updated_cash_value = _adjust_cash(crsr, account_id, cash_change)
+            log(f'CASH position updated. New cash value: {updated_cash_value}.')
 
         # Commit the transaction
         connection.commit()
-        print(f'Quantity for {symbol} decreased by {quantity_to_decrease}. New quantity is {new_quantity}.')
+        log(f'{len(trades)} trades executed successfully.')
+        return results
 
     except (Exception, psycopg2.DatabaseError) as error:
-        print(f"Error decreasing quantity: {error}")
+        print(f"Error executing trades: {error}")
         raise
     finally:
         if connection is not None:
-            connection.close()
-            print('Database connection terminated.')
-
-
+            release_db(connection)
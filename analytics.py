@@ -0,0 +1,285 @@
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+
+# Pure portfolio calculations on a Positions frame. Nothing in this module
+# talks to the database; every function takes a frame (or columns of one)
+# and returns new values without modifying its input.
+
+
+def to_float(column) -> pd.Series:
+    """Convert a column of Decimals, numpy scalars or None to float64 with NaN for missing values."""
+    return pd.to_numeric(pd.Series(column), errors='coerce').astype(float)
+
+
+def to_decimal(value) -> Decimal:
+    """The Decimal a NUMERIC column holds for a value: floats go through their shortest repr, as psycopg2 sends them."""
+    if isinstance(value, Decimal):
+        return value
+    if isinstance(value, (int, np.integer)):
+        return Decimal(int(value))
+    return Decimal(repr(float(value)))
+
+
+def round2(values, exact=None) -> np.ndarray:
+    """Round to 2 decimals exactly like Python's round(x, 2), but for a whole array.
+
+    np.round scales by 100 first, which can flip results that sit within a
+    rounding error of a half cent. Those few values are rounded with
+    Python's round() instead; everything else is handled by np.round.
+
+    The positions themselves are NUMERIC columns, computed with Decimals
+    and rounded half to even, and a float result near a half cent may lie
+    on the wrong side of it. exact, when given, takes the indexes of those
+    rows and returns their unrounded Decimal results, which are rounded
+    with round() in their place.
+    """
+    values = np.asarray(values, dtype=float)
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    distance = np.abs(scaled - np.floor(scaled) - 0.5)
+    tolerance = 4 * np.spacing(np.abs(scaled))
+    if exact is not None:
+        # Float inputs only approximate the Decimals, so allow for their error too
+        tolerance = np.maximum(16 * tolerance, 1e-9)
+    near_half = np.isfinite(values) & (distance <= tolerance)
+    if near_half.any():
+        if exact is None:
+            rounded[near_half] = [round(value, 2) for value in values[near_half].tolist()]
+        else:
+            rounded[near_half] = [float(round(value, 2)) for value in exact(np.flatnonzero(near_half))]
+    return rounded
+
+
+def _objects(column) -> np.ndarray:
+    # The original values of a column, before any conversion to float
+    return pd.Series(column).to_numpy(dtype=object)
+
+
+def apply_prices(symbols, current_prices, stock_prices: dict) -> pd.Series:
+    """Return current prices with fetched prices applied; symbols without a fetched price keep theirs."""
+    symbols = pd.Series(symbols)
+    fetched = to_float(symbols.map(stock_prices))
+    fetched.index = symbols.index
+    current_prices = to_float(current_prices)
+    current_prices.index = symbols.index
+    return fetched.where(fetched.notna(), current_prices)
+
+
+def compute_values(symbols, quantities, current_prices, values) -> pd.Series:
+    """value = quantity * current_price for every position except CASH.
+
+    Positions with a missing price or quantity get 0, CASH keeps its value.
+    """
+    symbols = pd.Series(symbols)
+    exact_quantities, exact_prices = _objects(quantities), _objects(current_prices)
+    quantities = to_float(quantities).to_numpy()
+    current_prices = to_float(current_prices).to_numpy()
+    values = to_float(values).to_numpy()
+
+    def exact(rows):
+        return [to_decimal(exact_quantities[row]) * to_decimal(exact_prices[row]) for row in rows]
+
+    known = ~np.isnan(quantities) & ~np.isnan(current_prices)
+    computed = np.where(known, round2(quantities * current_prices, exact), 0.0)
+    is_cash = (symbols == 'CASH').to_numpy()
+    return pd.Series(np.where(is_cash, values, computed), index=symbols.index)
+
+
+def compute_allocations(values, allocations, accounts=None) -> pd.Series:
+    """allocation = value / total value * 100.
+
+    With accounts, each row is divided by the total of its own account.
+    When a total is not positive those allocations are left unchanged, as
+    are rows without a value.
+    """
+    exact_values = _objects(values)
+    values = to_float(values)
+    allocations = to_float(allocations)
+    allocations.index = values.index
+    if accounts is None:
+        total_value = pd.Series(values.sum(), index=values.index)
+        groups = np.zeros(len(values), dtype=int)
+    else:
+        accounts = pd.Series(accounts)
+        accounts.index = values.index
+        total_value = values.groupby(accounts).transform('sum')
+        groups = accounts.factorize()[0]
+    positive = (total_value > 0).to_numpy()
+    if not positive.any():
+        return allocations
+
+    known = values.notna().to_numpy()
+    exact_totals = {}
+
+    def exact(rows):
+        results = []
+        for row in rows:
+            group = groups[row]
+            if group not in exact_totals:
+                members = np.flatnonzero(known & (groups == group))
+                exact_totals[group] = sum((to_decimal(exact_values[member]) for member in members), Decimal(0))
+            results.append(to_decimal(exact_values[row]) / exact_totals[group] * 100)
+        return results
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        computed = pd.Series(round2(values.to_numpy() / total_value.to_numpy()*100, exact), index=values.index)
+    return computed.where(values.notna() & positive, allocations)
+
+
+def compute_changes(current_prices, avg_costs, changes) -> pd.Series:
+    """change = (current_price - avg_cost) / current_price * 100.
+
+    Rows with a missing or zero price, or a missing avg_cost, keep their change.
+    """
+    exact_prices, exact_costs = _objects(current_prices), _objects(avg_costs)
+    current_prices = to_float(current_prices)
+    avg_costs = to_float(avg_costs)
+    changes = to_float(changes)
+    avg_costs.index = changes.index = current_prices.index
+
+    def exact(rows):
+        return [(to_decimal(exact_prices[row]) - to_decimal(exact_costs[row])) / to_decimal(exact_prices[row]) * 100
+                for row in rows]
+
+    valid = current_prices.notna() & avg_costs.notna() & (current_prices != 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        computed = round2((current_prices.to_numpy() - avg_costs.to_numpy()) / current_prices.to_numpy()*100, exact)
+    return pd.Series(computed, index=current_prices.index).where(valid, changes)
+
+
+def changed_mask(before, after) -> np.ndarray:
+    """True for rows whose value rounded to 2 decimals differs; two missing values count as equal."""
+    before = round2(to_float(before).to_numpy())
+    after = round2(to_float(after).to_numpy())
+    both_missing = np.isnan(before) & np.isnan(after)
+    return ~both_missing & (before != after)
+
+
+def changed_rows(before: pd.DataFrame, after: pd.DataFrame, columns: list) -> np.ndarray:
+    """True for rows where any of the given columns changed between two frames of the same rows."""
+    mask = np.zeros(len(before), dtype=bool)
+    for column in columns:
+        mask |= changed_mask(before[column], after[column])
+    return mask
+
+
+def _to_objects(column: pd.Series) -> pd.Series:
+    # Plain Python floats, with None instead of NaN so the rows serialize to JSON null
+    return column.astype(object).where(column.notna(), None)
+
+
+def compute_position_metrics(df: pd.DataFrame, stock_prices: dict) -> pd.DataFrame:
+    """Apply new prices to a Positions frame and recompute value, allocation and change.
+
+    Allocations are per account when the frame has an account_id column.
+    Gives the same result as the row-by-row price, value, allocation and
+    change updates it replaced, run one after another. Returns a new frame.
+    """
+    result = df.copy()
+    current_prices = apply_prices(df['symbol'], df['current_price'], stock_prices)
+    values = compute_values(df['symbol'], df['quantity'], current_prices, df['value'])
+    accounts = df['account_id'] if 'account_id' in df.columns else None
+    allocations = compute_allocations(values, df['allocation'], accounts)
+    changes = compute_changes(current_prices, df['avg_cost'], df['change'])
+
+    result['current_price'] = _to_objects(current_prices)
+    result['value'] = _to_objects(values)
+    result['allocation'] = _to_objects(allocations)
+    result['change'] = _to_objects(changes)
+    return result
+
+
+def replay_trades(trades: pd.DataFrame) -> pd.DataFrame:
+    """Rebuild holdings from a trades ledger with group-by operations instead of a row loop.
+
+    trades has columns symbol, action, quantity, price and executed_at and
+    is sorted in execution order. Follows the trade rules of the API:
+    Entry opens a position at its price, Add moves avg_cost to the
+    weighted average, Trim lowers quantity without changing avg_cost and
+    Exit closes the position. For CASH, Entry sets the cash amount
+    (quantity) and every later Exit/Trim adds and Add subtracts
+    quantity * price.
+
+    Returns one row per open position with symbol, quantity, avg_cost,
+    value (CASH only) and open_date. avg_cost is rounded once at the end,
+    while the live API rounds it after every Add, so the two can differ
+    by a cent.
+    """
+    trades = trades.reset_index(drop=True)
+    symbols = trades['symbol']
+    action = trades['action']
+    quantity = to_float(trades['quantity'])
+    price = to_float(trades['price'])
+
+    # Only the latest lot (trades since the last Entry) of each symbol matters
+    lot = (action == 'Entry').groupby(symbols).cumsum()
+    current = (lot > 0) & (lot == lot.groupby(symbols).transform('max'))
+    closed = (current & (action == 'Exit')).groupby(symbols).transform('any')
+    current &= ~closed
+
+    # Cash moves of every trade, then CASH = last CASH entry + later moves
+    cash_delta = np.where(action.isin(['Exit', 'Trim']), quantity * price,
+                          np.where(action == 'Add', -quantity * price, 0.0))
+    cash_delta[(symbols == 'CASH').to_numpy()] = 0.0
+    cash_entries = np.flatnonzero(((symbols == 'CASH') & (action == 'Entry') & current).to_numpy())
+    cash_rows = []
+    if len(cash_entries):
+        entry = cash_entries[-1]
+        cash_rows.append({
+            'symbol': 'CASH',
+            'quantity': quantity.iloc[entry],
+            'avg_cost': price.iloc[entry],
+            'value': round(quantity.iloc[entry] + cash_delta[entry + 1:].sum(), 2),
+            'open_date': trades['executed_at'].iloc[entry],
+        })
+
+    lots = pd.DataFrame({
+        'symbol': symbols,
+        'action': action,
+        'quantity': quantity,
+        'price': price,
+        'executed_at': trades['executed_at'],
+    })[current & (symbols != 'CASH')]
+    if lots.empty:
+        return pd.DataFrame(cash_rows, columns=['symbol', 'quantity', 'avg_cost', 'value', 'open_date'])
+
+    group = lots['symbol']
+    is_buy = lots['action'].isin(['Entry', 'Add'])
+    is_trim = lots['action'] == 'Trim'
+    signed = np.where(is_buy, lots['quantity'], np.where(is_trim, -lots['quantity'], 0.0))
+    quantity_after = pd.Series(signed, index=lots.index).groupby(group).cumsum()
+    quantity_before = quantity_after - signed
+
+    # avg_cost only changes on buys, so it is the average right after the last
+    # buy. Trims shrink the cost basis in proportion; a Trim down to zero
+    # wipes it, so only buys after the last such Trim count.
+    order = lots.groupby('symbol').cumcount()
+    last_buy = order.where(is_buy).groupby(group).transform('max')
+    wiped = (is_trim & (quantity_after == 0)).groupby(group).cumsum()
+    wiped_at_last_buy = wiped.where(order == last_buy).groupby(group).transform('max')
+    basis = (order <= last_buy) & (wiped == wiped_at_last_buy)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = np.where(is_trim & (quantity_after > 0), quantity_after / quantity_before, 1.0)
+    factor = pd.Series(factor, index=lots.index).where(basis, 1.0)
+    scale = factor.groupby(group).cumprod()
+    scale_at_last_buy = scale.where(order == last_buy).groupby(group).transform('max')
+    cost = (lots['quantity'] * lots['price'] * scale_at_last_buy / scale).where(basis & is_buy, 0.0)
+
+    summary = pd.DataFrame({
+        'cost': cost.groupby(group).sum(),
+        'quantity_at_last_buy': quantity_after.where(order == last_buy).groupby(group).max(),
+        'quantity': quantity_after.groupby(group).last(),
+        'open_date': lots['executed_at'].groupby(group).first(),
+    })
+    positions = pd.DataFrame({
+        'symbol': summary.index,
+        'quantity': summary['quantity'].to_numpy(),
+        'avg_cost': round2((summary['cost'] / summary['quantity_at_last_buy']).to_numpy()),
+        'value': np.nan,
+        'open_date': summary['open_date'].to_numpy(),
+    })
+    if cash_rows:
+        positions = pd.concat([pd.DataFrame(cash_rows), positions], ignore_index=True)
+    return positions
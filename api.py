@@ -0,0 +1,163 @@
+from datetime import datetime, timedelta, timezone
+from metrics import render
+from quotes import get_cache_stats
+from scheduler import get_scheduler_stats
+from streaming import get_stream_stats
+from export import parse_time
+from DataDealer import DEFAULT_ACCOUNT, check_account, get_pool_stats, get_refresh_stats, validate_trade
+
+# Request parsing and response bodies shared by server.py (Flask) and
+# async_server.py (Quart). Everything here takes the query arguments
+# (request.args) and parsed JSON bodies and returns plain values, raising
+# ValueError for bad input, so each app only keeps its thin sync or async
+# route wrappers and turns ValueError into a 400.
+
+# Most rows a single page of GET /api/home may return
+MAX_PAGE_SIZE = 1000
+
+# Query parameters that switch GET /api/home to a paginated SQL query
+PAGE_PARAMETERS = ('limit', 'cursor', 'sort', 'symbol', 'fields')
+
+
+def get_account(args, data=None) -> str:
+    """Account a request works on: ?account=, else the "account" field of the JSON body, else the default one."""
+    account_id = args.get('account')
+    if account_id is None and isinstance(data, dict):
+        account_id = data.get('account')
+    return check_account(account_id or DEFAULT_ACCOUNT)
+
+
+def _split(value: str) -> list:
+    return [item for item in (value or '').split(',') if item]
+
+
+def _whole_number(args, name: str, default: int) -> int:
+    # Not type=int: a value that does not parse would silently become the default
+    value = args.get(name)
+    if value is None:
+        return default
+    if not value.isdigit():
+        raise ValueError(f"{name} must be a whole number.")
+    return int(value)
+
+
+def _number(args, name: str) -> float:
+    value = args.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number.") from None
+
+
+def _time(args, name: str) -> datetime:
+    value = args.get(name)
+    if value is None:
+        return None
+    try:
+        return parse_time(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 timestamp.") from None
+
+
+def wants_page(args) -> bool:
+    return any(parameter in args for parameter in PAGE_PARAMETERS)
+
+
+def page_query(args) -> dict:
+    """Keyword arguments of fetch_page for GET /api/home?limit=&cursor=&sort=&symbol=&fields=."""
+    # Not type=int: that turns ?limit=abc into no limit at all
+    limit = args.get('limit')
+    if limit is not None and not (limit.isdigit() and 1 <= int(limit) <= MAX_PAGE_SIZE):
+        raise ValueError(f"limit must be an integer between 1 and {MAX_PAGE_SIZE}.")
+    sort = args.get('sort', 'symbol')
+    return {'limit': None if limit is None else int(limit), 'cursor': args.get('cursor'),
+            'sort': sort.lstrip('-'), 'descending': sort.startswith('-'),
+            'symbols': _split(args.get('symbol')), 'fields': _split(args.get('fields'))}
+
+
+def batch_trades(data) -> list:
+    """Trades of a POST /api/positions/batch body: a list, or an object with a "trades" list."""
+    trades = data.get('trades') if isinstance(data, dict) else data
+    if not isinstance(trades, list) or not trades:
+        raise ValueError('Expected a non-empty list of trades')
+    return trades
+
+
+def invalid_trades(trades: list) -> dict:
+    """400 body listing every trade that fails validation, or None if all of them pass."""
+    errors = [{'index': index, 'status': 'error', 'message': message}
+              for index, message in enumerate(validate_trade(trade) for trade in trades) if message]
+    if not errors:
+        return None
+    return {'status': 'error', 'message': 'Invalid trades, nothing was executed', 'results': errors}
+
+
+def batch_error(error, count: int) -> dict:
+    """400 body for a TradeBatchError: the failing trade and every other one rolled back."""
+    results = [{'index': index, 'status': 'error' if index == error.index else 'rolled_back'}
+               for index in range(count)]
+    results[error.index]['message'] = error.reason
+    return {'status': 'error', 'message': str(error), 'results': results}
+
+
+def history_query(args) -> dict:
+    """Parameters of GET /api/history?symbol=&field=&method=&points=&start=&end=."""
+    method = args.get('method', 'lttb')
+    points = _whole_number(args, 'points', 500)
+    end = _time(args, 'end') or datetime.now(timezone.utc)
+    start = _time(args, 'start') or end - timedelta(days=30)
+    if method not in ('lttb', 'ohlc') or points < 3:
+        raise ValueError('method must be lttb or ohlc and points at least 3')
+    return {'symbol': args.get('symbol'), 'field': args.get('field', 'value'), 'method': method, 'points': points,
+            'start': start, 'end': end}
+
+
+def history_body(times, values, query: dict) -> dict:
+    """Downsample a fetched history as the query asks and build the response body."""
+    # numpy is only needed here; importing it lazily keeps it out of startup
+    from timeseries import lttb, ohlc
+
+    if query['method'] == 'lttb':
+        times, values = lttb(times, values, query['points'])
+        data = [{'t': t, 'v': v} for t, v in zip(times.tolist(), values.tolist())]
+    else:
+        columns = ohlc(times, values, query['points'])
+        data = [{'t': t, 'open': o, 'high': h, 'low': l, 'close': c}
+                for t, o, h, l, c in zip(*(column.tolist() for column in columns))]
+    return {'status': 'success', 'symbol': query['symbol'], 'field': query['field'], 'method': query['method'],
+            'data': data}
+
+
+def risk_query(args) -> dict:
+    """Keyword arguments of portfolio_risk for GET /api/risk?lookback=&confidence=&benchmark=."""
+    return {'lookback': _whole_number(args, 'lookback', None), 'confidence': _number(args, 'confidence'),
+            'benchmark': args.get('benchmark')}
+
+
+def export_request(args) -> dict:
+    """Keyword arguments of export_stream for GET /api/export?dataset=&format=&symbol=&start=&end=."""
+    return {'dataset': args.get('dataset', 'positions'), 'export_format': args.get('format', 'csv'),
+            'symbol': args.get('symbol'), 'start': _time(args, 'start'), 'end': _time(args, 'end')}
+
+
+def export_filename(export: dict) -> str:
+    extension = 'arrows' if export['export_format'] == 'arrow' else export['export_format']
+    return f"{export['dataset']}.{extension}"
+
+
+def stats_body(**extra) -> dict:
+    """GET /api/stats body: connection pool, quote cache, refresh and stream counters, plus extra sections."""
+    return {'status': 'success', 'pool': get_pool_stats(), **extra, 'quotes': get_cache_stats(),
+            'refresh': {**get_scheduler_stats(), **get_refresh_stats()}, 'stream': get_stream_stats()}
+
+
+def metrics_text() -> str:
+    """GET /metrics body: stage and request histograms, SQL counters and the /api/stats numbers."""
+    gauges = {f'portfolio_pool_{key}': value for key, value in get_pool_stats().items()}
+    gauges.update({f'portfolio_quotes_{key}': value for key, value in get_cache_stats().items()})
+    gauges.update({f'portfolio_refresh_{key}': value
+                   for key, value in {**get_scheduler_stats(), **get_refresh_stats()}.items()})
+    gauges.update({f'portfolio_stream_{key}': value for key, value in get_stream_stats().items()})
+    return render(gauges)
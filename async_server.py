@@ -0,0 +1,334 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+import asyncpg
+import pandas as pd
+from quart import Quart, Response, g, request, jsonify
+from config import config, settings
+from analytics import compute_position_metrics, changed_rows
+from quotes import get_prices_async
+from scheduler import refresh_settings, start_scheduler, request_refresh
+from serialization import json_response
+from metrics import REQUEST_SECONDS, log
+from streaming import get_hub
+from export import FORMATS, export_stream
+from DataDealer import (API_COLUMNS, POOL_DEFAULTS, REFRESH_COLUMNS, execute_trade, execute_trades, fetch_history,
+                        fetch_page, record_refresh, rebuild_positions_from_ledger, snapshot_due, TradeBatchError)
+import api
+
+# Async serving mode: the same JSON API as server.py on Quart, with an
+# asyncpg pool for the /api/home read and refresh path. Trades keep using
+# the row-locked psycopg2 implementation in DataDealer, run on worker
+# threads so they never block the event loop, as do the other blocking
+# routes (rebuild, history, risk, simulation and exports). Request parsing
+# and response bodies come from api.py, shared with server.py.
+#
+#   hypercorn --workers 4 --bind 0.0.0.0:8080 async_server:app
+
+app = Quart(__name__)
+
+REFRESH = refresh_settings()
+
+# libpq keywords in database.ini and their asyncpg names
+ASYNCPG_PARAMETERS = {'host': 'host', 'port': 'port', 'user': 'user', 'password': 'password',
+                      'dbname': 'database', 'database': 'database'}
+
+_pool = None
+
+
+@app.before_serving
+async def create_pool():
+    global _pool
+    params = {ASYNCPG_PARAMETERS[key]: value for key, value in config().items() if key in ASYNCPG_PARAMETERS}
+    pool_settings = settings('pool', POOL_DEFAULTS)
+    _pool = await asyncpg.create_pool(min_size=pool_settings['minconn'], max_size=pool_settings['maxconn'],
+                                      **params)
+    if not REFRESH['sync_refresh'] and REFRESH['run_in_server']:
+        start_scheduler()
+
+
+@app.after_serving
+async def close_pool():
+    if _pool is not None:
+        await _pool.close()
+
+
+@app.before_request
+async def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+async def record_request(response):
+    # Only latency: SQL round trips per request are counted by server.py,
+    # asyncpg queries do not go through the psycopg2 CountingCursor
+    if 'request_started' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, request.method,
+                                request.endpoint or 'unknown', response.status_code)
+    return response
+
+
+@app.after_request
+async def allow_cross_origin(response):
+    # Same open CORS policy as flask_cors in server.py
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+    return response
+
+
+def get_account(data=None) -> str:
+    return api.get_account(request.args, data)
+
+
+async def refresh_positions_async(account_id: str):
+    """Async counterpart of DataDealer.refresh_positions(account_id) on the asyncpg pool."""
+    async with _pool.acquire() as connection:
+        async with connection.transaction():
+            statement = await connection.prepare("SELECT * FROM Positions WHERE account_id = $1;")
+            columns = [attribute.name for attribute in statement.get_attributes()]
+            df = pd.DataFrame([tuple(record) for record in await statement.fetch(account_id)], columns=columns)
+
+            stock_prices = await get_prices_async(df['symbol'].unique().tolist())
+            refreshed = compute_position_metrics(df, stock_prices)
+
+            # Write back only changed rows, as arrays in one statement. As in
+            # bulk_update_positions the rows are locked by symbol with CASH
+            # last, and CASH's value is left to trades
+            dirty = refreshed.loc[changed_rows(df, refreshed, REFRESH_COLUMNS)]
+            if len(dirty):
+                await connection.execute("""
+                    SELECT 1 FROM Positions
+                    WHERE account_id = $1 AND symbol = ANY($2::text[])
+                    ORDER BY symbol = 'CASH', symbol
+                    FOR UPDATE;
+                """, account_id, dirty['symbol'].tolist())
+                await connection.execute("""
+                    UPDATE Positions AS p
+                    SET current_price = v.current_price,
+                        value = CASE WHEN p.symbol = 'CASH' THEN p.value ELSE v.value END,
+                        allocation = v.allocation,
+                        change = v.change
+                    FROM unnest($2::text[], $3::float8[], $4::float8[], $5::float8[], $6::float8[])
+                        AS v (symbol, current_price, value, allocation, change)
+                    WHERE p.account_id = $1 AND p.symbol = v.symbol;
+                """, account_id, *(dirty[column].tolist() for column in ['symbol'] + REFRESH_COLUMNS))
+                if snapshot_due(account_id):
+                    await connection.execute("""
+                        INSERT INTO position_snapshots (taken_at, account_id, symbol, price, value, allocation)
+                        SELECT now(), $1, * FROM unnest($2::text[], $3::float8[], $4::float8[], $5::float8[]);
+                    """, account_id,
+                        *(refreshed[column].tolist() for column in ['symbol', 'current_price', 'value', 'allocation']))
+            record_refresh(len(dirty), len(refreshed) - len(dirty))
+            return refreshed
+
+
+async def fetch_rows_async(account_id: str) -> list:
+    """Read the API columns of an account's positions without pandas."""
+    async with _pool.acquire() as connection:
+        records = await connection.fetch(f"SELECT {', '.join(API_COLUMNS)} FROM Positions WHERE account_id = $1;",
+                                         account_id)
+    return [dict(record) for record in records]
+
+
+# GET route to fetch all positions
+@app.route("/api/home", methods=['GET'])
+async def get_positions_data():
+    try:
+        account_id = get_account()
+        if api.wants_page(request.args):
+            query = api.page_query(request.args)
+            if REFRESH['sync_refresh']:
+                await refresh_positions_async(account_id)
+            data, next_cursor = await asyncio.to_thread(fetch_page, **query, account_id=account_id)
+            return json_response({'status': 'success', 'data': data, 'next_cursor': next_cursor},
+                                 req=request, response_class=Response)
+
+        if REFRESH['sync_refresh']:
+            await refresh_positions_async(account_id)
+        # Stored Decimals serialize as strings, as on the Flask app
+        data = await fetch_rows_async(account_id)
+        return json_response({'status': 'success', 'data': data}, req=request, response_class=Response)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+# POST route to execute a trade
+@app.route("/api/positions", methods=['POST'])
+async def add_position():
+    try:
+        data = await request.get_json()
+        log('Received Data:', data)  # Log incoming data for debugging
+        await asyncio.to_thread(execute_trade, data, get_account(data))
+
+        # Recompute value and allocation for the new holdings right away
+        request_refresh()
+        return jsonify({'status': 'success', 'message': 'Data inserted successfully'})
+
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': 'An unexpected error occurred'}), 500
+
+
+# POST route to execute many trades at once, all or nothing
+@app.route("/api/positions/batch", methods=['POST'])
+async def add_positions_batch():
+    try:
+        data = await request.get_json()
+        trades = api.batch_trades(data)
+        account_id = get_account(data)
+
+        errors = api.invalid_trades(trades)
+        if errors:
+            return jsonify(errors), 400
+
+        results = await asyncio.to_thread(execute_trades, trades, account_id)
+        request_refresh()
+        return jsonify({'status': 'success', 'results': results})
+
+    except TradeBatchError as e:
+        return jsonify(api.batch_error(e, len(trades))), 400
+
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': 'An unexpected error occurred'}), 500
+
+
+# POST route to rebuild Positions from the trades ledger ({"dry_run": true} only returns the result)
+@app.route("/api/positions/rebuild", methods=['POST'])
+async def rebuild_positions():
+    try:
+        data = await request.get_json(silent=True) or {}
+        dry_run = bool(data.get('dry_run', False))
+        df = await asyncio.to_thread(rebuild_positions_from_ledger, apply=not dry_run, account_id=get_account(data))
+        if not dry_run:
+            request_refresh()
+        return jsonify({'status': 'success', 'dry_run': dry_run, 'data': df.to_dict(orient='records')})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+# GET route for downsampled snapshot history of a symbol (or the whole portfolio)
+@app.route("/api/history", methods=['GET'])
+async def get_history():
+    try:
+        query = api.history_query(request.args)
+        times, values = await asyncio.to_thread(fetch_history, query['field'], query['start'], query['end'],
+                                                query['symbol'], get_account())
+        return json_response(api.history_body(times, values, query), req=request, response_class=Response)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+# GET route for volatility, beta, correlations, drawdown and VaR of the current holdings
+@app.route("/api/risk", methods=['GET'])
+async def get_risk():
+    from risk import portfolio_risk
+
+    try:
+        report = await asyncio.to_thread(portfolio_risk, get_account(), **api.risk_query(request.args))
+        return json_response({'status': 'success', **report}, req=request, response_class=Response)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+# POST route evaluating hypothetical trades, target allocations or scenario sweeps without writing anything
+@app.route("/api/simulate", methods=['POST'])
+async def simulate_positions():
+    from simulator import simulate
+
+    try:
+        data = await request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'status': 'error', 'message': 'Expected a JSON object'}), 400
+        result = await asyncio.to_thread(simulate, data, get_account(data))
+        return json_response({'status': 'success', **result}, req=request, response_class=Response)
+    except TradeBatchError as e:
+        return jsonify({'status': 'error', 'message': str(e), 'index': e.index}), 400
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+async def iterate_in_thread(chunks):
+    """Yield the chunks of a blocking generator, advanced on a worker thread of its own.
+
+    Every step runs on the same thread, so the generator's database
+    connection and metrics span stay on one thread from start to end.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='export')
+    done = object()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(executor, next, chunks, done)
+            if chunk is done:
+                break
+            yield chunk
+    finally:
+        # Also when the client goes away: close the generator to release its connection
+        executor.submit(chunks.close)
+        executor.shutdown(wait=False)
+
+
+# GET route streaming a dataset (positions, history or trades) as CSV, Arrow or Parquet
+@app.route("/api/export", methods=['GET'])
+async def export_data():
+    try:
+        export = api.export_request(request.args)
+        chunks = export_stream(account_id=get_account(), **export)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    response = Response(iterate_in_thread(chunks), mimetype=FORMATS[export['export_format']],
+                        headers={'Content-Disposition': f'attachment; filename={api.export_filename(export)}'})
+    # Large exports take longer than Quart's default response timeout
+    response.timeout = None
+    return response
+
+
+# GET route streaming live position updates as server-sent events, awaited on
+# the event loop so an open stream does not hold a thread
+@app.route("/api/stream", methods=['GET'])
+async def stream_positions():
+    try:
+        subscription = get_hub().subscribe(get_account(), asynchronous=True)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+    response = Response(subscription.events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # A stream stays open for as long as the client watches
+    response.timeout = None
+    return response
+
+
+# GET route for runtime counters
+@app.route("/api/stats", methods=['GET'])
+async def get_stats():
+    pool = {'size': _pool.get_size(), 'idle': _pool.get_idle_size(),
+            'minconn': _pool.get_min_size(), 'maxconn': _pool.get_max_size()}
+    return jsonify(api.stats_body(async_pool=pool))
+
+
+# GET route for Prometheus, as in server.py
+@app.route("/metrics", methods=['GET'])
+async def get_metrics():
+    return Response(api.metrics_text(), mimetype='text/plain; version=0.0.4')
+
+
+if __name__ == "__main__":
+    app.run(port=8080)
@@ -0,0 +1,121 @@
+"""Benchmark analytics.py against the original iterrows calculations.
+
+Usage: python benchmarks/bench_analytics.py [rows ...]   (default 10000 100000 1000000)
+
+The iterrows versions below repeat the loops that calculate_and_update_values,
+calculate_and_update_allocations and calculate_and_update_changes used to run,
+without the database writes. Numeric columns hold Decimals, as psycopg2
+reads them from the NUMERIC columns of Positions. Results of both versions
+are compared for exact equality before timings are printed.
+"""
+import os
+import sys
+import time
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from analytics import compute_values, compute_allocations, compute_changes  # noqa: E402
+
+
+def decimals(rng, low: float, high: float, rows: int) -> list:
+    return [Decimal(cents) / 100 for cents in rng.integers(int(low * 100), int(high * 100), rows).tolist()]
+
+
+def make_positions(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    prices = np.array(decimals(rng, 1, 500, rows), dtype=object)
+    prices[rng.random(rows) < 0.01] = None  # some quotes could not be fetched
+    prices[rng.random(rows) < 0.01] = Decimal(0)
+    df = pd.DataFrame({
+        'symbol': [f'S{i}' for i in range(rows)],
+        'quantity': rng.integers(1, 1000, rows).tolist(),
+        'avg_cost': decimals(rng, 1, 500, rows),
+        'current_price': prices,
+        'value': decimals(rng, 0, 100000, rows),
+        'allocation': Decimal(0),
+        'change': Decimal(0),
+    })
+    df.loc[0, ['symbol', 'current_price', 'value']] = ['CASH', Decimal(0), Decimal(25000)]
+    return df
+
+
+def legacy_values(df):
+    values = {}
+    for index, row in df.iterrows():
+        symbol = row['symbol']
+        quantity = row['quantity']
+        current_price = row['current_price']
+        if symbol == 'CASH':
+            continue
+        if current_price is not None and quantity is not None:
+            value = quantity * current_price
+        else:
+            value = 0
+        values[symbol] = round(value, 2)
+    return values
+
+
+def legacy_allocations(df):
+    allocations = {}
+    total_value = df['value'].sum()
+    if total_value == 0:
+        return allocations
+    for index, row in df.iterrows():
+        value = row['value']
+        if value is not None and total_value > 0:
+            allocations[row['symbol']] = round((value / total_value)*100, 2)
+    return allocations
+
+
+def legacy_changes(df):
+    changes = {}
+    for index, row in df.iterrows():
+        current_price = row['current_price']
+        avg_cost = row['avg_cost']
+        if current_price is not None and avg_cost is not None and current_price != 0:
+            changes[row['symbol']] = round((current_price - avg_cost) / current_price*100, 2)
+    return changes
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def check(expected: dict, actual: pd.Series, symbols: pd.Series, name: str):
+    actual = dict(zip(symbols.tolist(), actual.tolist()))
+    mismatches = [symbol for symbol, value in expected.items() if float(value) != actual[symbol]]
+    if mismatches:
+        raise AssertionError(f"{name}: {len(mismatches)} mismatches, e.g. {mismatches[:5]}")
+
+
+def run(rows: int):
+    df = make_positions(rows)
+    symbols = df['symbol']
+
+    expected_values, t_values = timed(legacy_values, df)
+    values, v_values = timed(compute_values, symbols, df['quantity'], df['current_price'], df['value'])
+    check(expected_values, values, symbols, 'value')
+
+    expected_allocations, t_allocations = timed(legacy_allocations, df)
+    allocations, v_allocations = timed(compute_allocations, df['value'], df['allocation'])
+    check(expected_allocations, allocations, symbols, 'allocation')
+
+    expected_changes, t_changes = timed(legacy_changes, df)
+    changes, v_changes = timed(compute_changes, df['current_price'], df['avg_cost'], df['change'])
+    check(expected_changes, changes, symbols, 'change')
+
+    for name, legacy, vectorized in [('value', t_values, v_values),
+                                     ('allocation', t_allocations, v_allocations),
+                                     ('change', t_changes, v_changes)]:
+        print(f"{rows:>9} {name:<11} iterrows {legacy:9.4f}s  vectorized {vectorized:9.4f}s  "
+              f"speedup {legacy / vectorized:8.1f}x")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for size in sizes:
+        run(size)
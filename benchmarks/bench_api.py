@@ -0,0 +1,297 @@
+"""Load-test the API against a local database with a stub quote provider.
+
+Usage: python benchmarks/bench_api.py --reset [options]
+       python benchmarks/bench_api.py --compare BASE.json [NEW.json]
+
+For every --symbols size the Positions table of the database configured
+in database.ini is dropped and re-seeded with that many synthetic
+positions (plus CASH). Use a scratch database: --reset is required to
+confirm. yahoo_fin.stock_info is replaced by a local stub before the app
+is imported, so no request leaves the machine. Its latency and error
+rate are configurable.
+
+Each scenario sends --requests requests through the Flask test client
+from --concurrency threads:
+
+  home        GET /api/home, rows kept fresh in the background
+  home_page   GET /api/home?limit=100&sort=-value
+  home_sync   GET /api/home with sync_refresh (quote fetch + refresh per request)
+  entry, add, trim, exit
+              POST /api/positions with that selectedOption
+
+Reported per scenario: p50/p95/p99 latency, throughput, errors and SQL
+round trips per request. Results are written to
+benchmarks/results/<commit>.json; --compare prints the change between two
+result files. Set cache_ttl = 0 under [quotes] to make every home_sync
+request wait for the stub.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import types
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+sys.path.insert(0, ROOT)
+
+SCENARIOS = ('home', 'home_page', 'home_sync', 'entry', 'add', 'trim', 'exit')
+
+# Seeded positions hold enough shares that trims never run out
+SEED_QUANTITY = 100_000
+
+
+class StubQuotes:
+    """Stand-in for yahoo_fin.stock_info with a fixed latency and error rate.
+
+    Prices are stable per ticker (derived from its crc32) with a small
+    random move on every call, so refreshes have rows to write.
+    """
+
+    def __init__(self, latency: float, jitter: float, error_rate: float, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def get_live_price(self, ticker: str) -> float:
+        with self._lock:
+            self.calls += 1
+            delay = max(self.latency + self._random.uniform(-self.jitter, self.jitter), 0.0)
+            fail = self._random.random() < self.error_rate
+            move = self._random.uniform(-0.01, 0.01)
+            if fail:
+                self.errors += 1
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError(f'stub quote error for {ticker}')
+        return (10 + zlib.crc32(ticker.encode()) % 490) * (1 + move)
+
+
+def install_stub_quotes(stub: StubQuotes):
+    """Make `import yahoo_fin.stock_info` return the stub."""
+    package = types.ModuleType('yahoo_fin')
+    module = types.ModuleType('yahoo_fin.stock_info')
+    module.get_live_price = stub.get_live_price
+    package.stock_info = module
+    sys.modules['yahoo_fin'] = package
+    sys.modules['yahoo_fin.stock_info'] = module
+
+
+def seed_positions(count: int):
+    """Replace Positions with count synthetic symbols plus CASH and reset the ledger."""
+    import io
+    import psycopg2
+    from config import config
+    from DataDealer import SCHEMA_FILE
+    from migrate import MIGRATIONS_FILE
+
+    connection = psycopg2.connect(**config())
+    try:
+        with connection.cursor() as crsr:
+            crsr.execute("DROP TABLE IF EXISTS Positions;")
+            crsr.execute("DROP TABLE IF EXISTS trades;")
+            crsr.execute("DROP TABLE IF EXISTS position_snapshots;")
+            crsr.execute("""
+                CREATE TABLE Positions (
+                    allocation numeric,
+                    symbol varchar(20) PRIMARY KEY,
+                    quantity integer,
+                    open_date date,
+                    avg_cost numeric,
+                    value numeric,
+                    current_price numeric,
+                    change numeric
+                );
+            """)
+            buffer = io.StringIO()
+            buffer.write('0\tCASH\t0\t2024-01-02\t1\t1000000000\t0\t0\n')
+            for index in range(count):
+                avg_cost = 10 + zlib.crc32(f'S{index}'.encode()) % 490
+                buffer.write(f'0\tS{index}\t{SEED_QUANTITY}\t2024-01-02\t{avg_cost}\t0\t0\t0\n')
+            buffer.seek(0)
+            crsr.copy_expert("COPY Positions FROM STDIN;", buffer)
+            # Migrate the old-style table, then recreate the ledger and
+            # snapshot tables, bootstrapped from the new rows
+            for path in (MIGRATIONS_FILE, SCHEMA_FILE):
+                with open(path) as sql:
+                    crsr.execute(sql.read())
+            crsr.execute("ANALYZE Positions;")
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def make_request(scenario: str, index: int, symbols: int):
+    """Return (method, url, json body) of request number index of a scenario."""
+    if scenario == 'home' or scenario == 'home_sync':
+        return 'GET', '/api/home', None
+    if scenario == 'home_page':
+        return 'GET', '/api/home?limit=100&sort=-value', None
+    if scenario == 'entry':
+        trade = {'symbol': f'N{index}', 'price': 25.5, 'quantity': 10}
+    elif scenario == 'exit':
+        trade = {'symbol': f'S{index % symbols}', 'price': 30.25, 'quantity': SEED_QUANTITY}
+    else:
+        trade = {'symbol': f'S{index % symbols}', 'price': 30.25, 'quantity': 1}
+    trade['selectedOption'] = scenario.capitalize()
+    return 'POST', '/api/positions', trade
+
+
+def run_scenario(app, scenario: str, symbols: int, requests: int, concurrency: int) -> dict:
+    from metrics import thread_sql_counts
+
+    counter = itertools.count()
+    latencies = []
+    queries = []
+    statuses = []
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        while True:
+            index = next(counter)
+            if index >= requests:
+                return
+            method, url, body = make_request(scenario, index, symbols)
+            before = thread_sql_counts()[0]
+            started = time.perf_counter()
+            response = client.open(url, method=method, json=body)
+            elapsed = time.perf_counter() - started
+            response.close()
+            with lock:
+                latencies.append(elapsed)
+                queries.append(thread_sql_counts()[0] - before)
+                statuses.append(response.status_code)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    wall = time.perf_counter() - started
+
+    latencies_ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        'scenario': scenario,
+        'symbols': symbols,
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'errors': sum(status >= 400 for status in statuses),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'mean_ms': round(float(latencies_ms.mean()), 3),
+        'throughput_rps': round(len(latencies) / wall, 2),
+        'sql_queries_per_request': round(float(np.mean(queries)), 2),
+    }
+
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return f'{commit}-dirty' if dirty else commit
+
+
+def print_result(result: dict):
+    print(f"{result['symbols']:>7} {result['scenario']:<10} {result['requests']:>6} req  "
+          f"p50 {result['p50_ms']:9.2f}ms  p95 {result['p95_ms']:9.2f}ms  p99 {result['p99_ms']:9.2f}ms  "
+          f"{result['throughput_rps']:9.1f} req/s  {result['sql_queries_per_request']:6.2f} sql/req  "
+          f"{result['errors']} errors")
+
+
+def compare(base_file: str, new_file: str):
+    with open(base_file) as base, open(new_file) as new:
+        base_results = {(row['symbols'], row['scenario']): row for row in json.load(base)['results']}
+        new_data = json.load(new)
+    for row in new_data['results']:
+        old = base_results.get((row['symbols'], row['scenario']))
+        if old is None:
+            continue
+        print(f"{row['symbols']:>7} {row['scenario']:<10} "
+              f"p50 {old['p50_ms']:9.2f} -> {row['p50_ms']:9.2f}ms  "
+              f"p95 {old['p95_ms']:9.2f} -> {row['p95_ms']:9.2f}ms  "
+              f"throughput x{row['throughput_rps'] / old['throughput_rps']:5.2f}  "
+              f"sql/req {old['sql_queries_per_request']:.2f} -> {row['sql_queries_per_request']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reset', action='store_true',
+                        help='drop and re-seed Positions in the configured (scratch) database')
+    parser.add_argument('--symbols', type=int, nargs='+', default=[10, 1000],
+                        help='Positions sizes to seed, e.g. 10 1000 100000')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads')
+    parser.add_argument('--latency', type=float, default=50.0, help='stub quote latency in ms')
+    parser.add_argument('--jitter', type=float, default=10.0, help='stub quote latency jitter in ms')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of stub quote calls that fail')
+    parser.add_argument('--seed', type=int, default=1, help='random seed of the stub')
+    parser.add_argument('--verbose', action='store_true', help="keep the app's informational prints")
+    parser.add_argument('--output', help='result file (default benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', nargs='+', metavar='FILE',
+                        help='compare two result files (or one with the latest of this commit)')
+    args = parser.parse_args()
+
+    if args.compare:
+        new_file = args.compare[1] if len(args.compare) > 1 else os.path.join(RESULTS_DIR, f'{git_commit()}.json')
+        compare(args.compare[0], new_file)
+        return
+    if not args.reset:
+        parser.error('--reset is required: the benchmark replaces the Positions table of the configured database')
+
+    stub = StubQuotes(args.latency / 1000, args.jitter / 1000, args.error_rate, args.seed)
+    install_stub_quotes(stub)
+
+    import server
+    from metrics import metrics_settings
+
+    # Keep the scheduler and per-trade prints out of the measurements
+    server.REFRESH['run_in_server'] = False
+    metrics_settings()['verbose'] = args.verbose
+
+    results = []
+    for symbols in args.symbols:
+        seed_positions(symbols)
+        for scenario in args.scenarios:
+            server.REFRESH['sync_refresh'] = scenario == 'home_sync'
+            requests = min(args.requests, symbols) if scenario == 'exit' else args.requests
+            result = run_scenario(server.app, scenario, symbols, requests, args.concurrency)
+            print_result(result)
+            results.append(result)
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{git_commit()}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as result_file:
+        json.dump({
+            'commit': git_commit(),
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'settings': {key: value for key, value in vars(args).items() if key not in ('reset', 'compare', 'output', 'verbose')},
+            'stub': {'calls': stub.calls, 'errors': stub.errors},
+            'results': results,
+        }, result_file, indent=2)
+    print(f'Results written to {output}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Benchmark the DataFrame read path against the namedtuple read path of GET /api/home.
+
+Usage: python benchmarks/bench_fetch.py [rows ...]   (default 10000 100000 1000000)
+
+Rows shaped like psycopg2 returns them (Decimal numerics, date objects)
+are turned into the JSON response body both ways:
+
+  dataframe   pd.DataFrame(rows) -> to_dict(orient='records') -> jsonify
+  rows        Position namedtuples -> _asdict() -> serialization.dumps
+
+With --db the rows are read from the Positions table configured in
+database.ini instead, through fetch_data() and fetch_rows().
+"""
+import os
+import sys
+import time
+from datetime import date
+from decimal import Decimal
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from DataDealer import API_COLUMNS, Position, fetch_data, fetch_rows  # noqa: E402
+from serialization import dumps  # noqa: E402
+from server import app  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+
+def make_rows(count: int) -> list:
+    return [(Decimal('1.25'), f'S{i}', 10 + i % 500, date(2024, 1, 1), Decimal('50.10'),
+             Decimal('5010.00'), Decimal('55.75'), Decimal('10.13')) for i in range(count)]
+
+
+# The original read path encoded with Flask's default provider
+default_provider = DefaultJSONProvider(app)
+
+
+def dataframe_path(rows) -> bytes:
+    df = pd.DataFrame(rows, columns=list(API_COLUMNS))
+    data = df.to_dict(orient='records')
+    return default_provider.response({'status': 'success', 'data': data}).get_data()
+
+
+def rows_path(rows) -> bytes:
+    positions = [Position._make(row) for row in rows]
+    return dumps({'status': 'success', 'data': [position._asdict() for position in positions]}) + b'\n'
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def run(count: int):
+    rows = make_rows(count)
+    with app.app_context():
+        expected, t_frame = timed(dataframe_path, rows)
+        actual, t_rows = timed(rows_path, rows)
+    assert expected.strip() == actual.strip(), 'response bodies differ'
+    print(f"{count:>9} rows  dataframe {t_frame:8.3f}s  rows {t_rows:8.3f}s  speedup {t_frame / t_rows:5.1f}x")
+
+
+def run_db():
+    with app.app_context():
+        started = time.perf_counter()
+        default_provider.response({'status': 'success', 'data': fetch_data().to_dict(orient='records')}).get_data()
+        t_frame = time.perf_counter() - started
+        started = time.perf_counter()
+        dumps({'status': 'success', 'data': [row._asdict() for row in fetch_rows()]})
+        t_rows = time.perf_counter() - started
+    print(f"database  fetch_data {t_frame:8.3f}s  fetch_rows {t_rows:8.3f}s  speedup {t_frame / t_rows:5.1f}x")
+
+
+if __name__ == "__main__":
+    if '--db' in sys.argv:
+        run_db()
+    else:
+        sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+        for size in sizes:
+            run(size)
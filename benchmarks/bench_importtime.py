@@ -0,0 +1,103 @@
+"""Measure the cold-start import time of the API and guard against regressions.
+
+Usage: python benchmarks/bench_importtime.py [options]
+
+Imports --module (server by default) in fresh interpreters under
+python -X importtime and reports the median total import time and the
+slowest modules. The interpreters run in the current directory, so
+database.ini is found there. Exits with status 1 when a --forbid module
+(pandas, numpy, yahoo_fin and pyarrow by default) was imported at
+startup, or when the median exceeds --budget-ms. With --request the child
+process also serves GET /api/home once through the Flask test client,
+which needs the database, and the forbidden modules must still not be
+loaded afterwards: the slim read path must not need them.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FORBIDDEN = ('pandas', 'numpy', 'yahoo_fin', 'pyarrow')
+
+# Run in the child: import the module, optionally serve one request, then
+# report which forbidden modules got loaded
+CHILD = """
+import json, sys
+import {module} as app_module
+loaded = {{'startup': [name for name in {forbid!r} if name in sys.modules]}}
+if {request!r}:
+    app_module.REFRESH['run_in_server'] = False
+    app_module.REFRESH['sync_refresh'] = False
+    status = app_module.app.test_client().get('/api/home').status_code
+    loaded['request'] = [name for name in {forbid!r} if name in sys.modules]
+    loaded['status'] = status
+print(json.dumps(loaded))
+"""
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Map module name to (self, cumulative) microseconds from -X importtime output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def run_once(module: str, forbid: tuple, request: bool) -> tuple:
+    code = CHILD.format(module=module, forbid=forbid, request=request)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True,
+                            text=True, env=dict(os.environ, PYTHONPATH=os.pathsep.join(
+                                filter(None, [ROOT, os.environ.get('PYTHONPATH')]))))
+    if result.returncode != 0:
+        sys.exit(f'Importing {module} failed:\n{result.stderr[-2000:]}')
+    return parse_importtime(result.stderr), json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='server', help='module to import (default server)')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters to time')
+    parser.add_argument('--top', type=int, default=15, help='slowest modules to list')
+    parser.add_argument('--budget-ms', type=float, help='fail when the median import time exceeds this')
+    parser.add_argument('--forbid', nargs='*', default=list(FORBIDDEN),
+                        help='modules that must not be imported at startup')
+    parser.add_argument('--request', action='store_true', help='also serve GET /api/home once (needs the database)')
+    args = parser.parse_args()
+
+    totals = []
+    for _ in range(args.runs):
+        modules, loaded = run_once(args.module, tuple(args.forbid), args.request)
+        totals.append(modules[args.module][1] / 1000)
+
+    median = statistics.median(totals)
+    print(f'import {args.module}: median {median:.1f}ms, min {min(totals):.1f}ms, max {max(totals):.1f}ms '
+          f'over {args.runs} runs')
+    print('Slowest modules (cumulative, last run):')
+    for name, (self_us, cumulative_us) in sorted(modules.items(), key=lambda item: -item[1][1])[:args.top]:
+        print(f'  {cumulative_us / 1000:9.1f}ms  {self_us / 1000:7.1f}ms self  {name}')
+
+    failures = []
+    if loaded['startup']:
+        failures.append(f"imported at startup: {', '.join(loaded['startup'])}")
+    if args.request:
+        if loaded['status'] != 200:
+            failures.append(f"GET /api/home answered {loaded['status']}")
+        if loaded['request']:
+            failures.append(f"imported by GET /api/home: {', '.join(loaded['request'])}")
+    if args.budget_ms is not None and median > args.budget_ms:
+        failures.append(f'median {median:.1f}ms exceeds the budget of {args.budget_ms:.1f}ms')
+
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
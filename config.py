@@ -1,11 +1,18 @@
 from configparser import ConfigParser
+from functools import lru_cache
 
 
-def config(filename="database.ini", section="postgresql"):
-    # create a parser
+@lru_cache(maxsize=None)
+def _read_config(filename):
+    # parse the file once per process; later calls reuse the parsed result
     parser = ConfigParser()
-    # read config file
     parser.read(filename)
+    return parser
+
+
+def config(filename="database.ini", section="postgresql"):
+    # create a parser
+    parser = _read_config(filename)
     db = {}
     if parser.has_section(section):
         params = parser.items(section)
@@ -14,4 +21,24 @@ def config(filename="database.ini", section="postgresql"):
     else:
         raise Exception(
             'Section {0} is not found in the {1} file.'.format(section, filename))
-    return db
\ No newline at end of file
+    return db
+
+
+def settings(section, defaults, filename="database.ini"):
+    # optional section: values from the file override the given defaults,
+    # converted to the type of the default value
+    parser = _read_config(filename)
+    values = dict(defaults)
+    if parser.has_section(section):
+        for key, default in defaults.items():
+            if not parser.has_option(section, key):
+                continue
+            if isinstance(default, bool):
+                values[key] = parser.getboolean(section, key)
+            elif isinstance(default, int):
+                values[key] = parser.getint(section, key)
+            elif isinstance(default, float):
+                values[key] = parser.getfloat(section, key)
+            else:
+                values[key] = parser.get(section, key)
+    return values
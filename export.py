@@ -0,0 +1,292 @@
+import argparse
+import csv
+import io
+import sys
+from contextlib import nullcontext, redirect_stdout
+from datetime import datetime, timezone
+import psycopg2
+from config import settings
+from metrics import log, span
+from DataDealer import DEFAULT_ACCOUNT, check_account, connect_db, release_db
+
+# Bulk export of positions, snapshot history and the trades ledger as CSV,
+# Arrow IPC or Parquet. Rows are read from a server-side (named) cursor
+# chunk_size rows at a time and every chunk is encoded and handed on before
+# the next one is fetched, so memory use does not grow with the table.
+#
+#   python export.py history --format parquet --account default --output history.parquet
+#
+# pyarrow is optional; without it only CSV is available. It is imported on
+# the first Arrow or Parquet export rather than when the server starts.
+
+EXPORT_DEFAULTS = {
+    'chunk_size': 10000,
+}
+
+# Columns of each dataset as (SQL expression, name, Arrow type). Numeric
+# columns are read as double precision, so no Decimal objects are built.
+DATASETS = {
+    'positions': {
+        'table': 'Positions',
+        'time_column': None,
+        'order': 'symbol',
+        'columns': [
+            ('symbol', 'symbol', 'string'),
+            ('quantity::float8', 'quantity', 'float64'),
+            ('open_date', 'open_date', 'date32'),
+            ('avg_cost::float8', 'avg_cost', 'float64'),
+            ('current_price::float8', 'current_price', 'float64'),
+            ('value::float8', 'value', 'float64'),
+            ('allocation::float8', 'allocation', 'float64'),
+            ('change::float8', 'change', 'float64'),
+        ],
+    },
+    'history': {
+        'table': 'position_snapshots',
+        'time_column': 'taken_at',
+        'order': 'taken_at, symbol',
+        'columns': [
+            ('taken_at', 'taken_at', 'timestamp'),
+            ('symbol', 'symbol', 'string'),
+            ('price', 'price', 'float64'),
+            ('value', 'value', 'float64'),
+            ('allocation::float8', 'allocation', 'float64'),
+        ],
+    },
+    'trades': {
+        'table': 'trades',
+        'time_column': 'executed_at',
+        'order': 'executed_at, id',
+        'columns': [
+            ('id', 'id', 'int64'),
+            ('executed_at', 'executed_at', 'timestamp'),
+            ('symbol', 'symbol', 'string'),
+            ('action', 'action', 'string'),
+            ('quantity::float8', 'quantity', 'float64'),
+            ('price::float8', 'price', 'float64'),
+        ],
+    },
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def export_query(dataset: str, account_id: str = DEFAULT_ACCOUNT, symbol: str = None, start=None, end=None):
+    """Return (SQL, parameters) selecting a dataset of one account, optionally filtered by symbol and time."""
+    if dataset not in DATASETS:
+        raise ValueError(f"dataset must be one of {', '.join(DATASETS)}.")
+    spec = DATASETS[dataset]
+    conditions = ["account_id = %s"]
+    params = [check_account(account_id)]
+    if symbol:
+        conditions.append("symbol = %s")
+        params.append(symbol)
+    if (start is not None or end is not None) and spec['time_column'] is None:
+        raise ValueError(f"{dataset} cannot be filtered by time.")
+    if start is not None:
+        conditions.append(f"{spec['time_column']} >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append(f"{spec['time_column']} < %s")
+        params.append(end)
+    columns = ', '.join(f'{expression} AS {name}' for expression, name, _ in spec['columns'])
+    query = f"SELECT {columns} FROM {spec['table']} WHERE {' AND '.join(conditions)} ORDER BY {spec['order']}"
+    return query, params
+
+
+def _pyarrow():
+    """Import pyarrow with its IPC and Parquet modules; ValueError when it is not installed."""
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("Arrow and Parquet exports require pyarrow.") from None
+    return pyarrow
+
+
+def _arrow_schema(pa, dataset: str):
+    types = {
+        'string': pa.string(),
+        'float64': pa.float64(),
+        'int64': pa.int64(),
+        'date32': pa.date32(),
+        'timestamp': pa.timestamp('us', tz='UTC'),
+    }
+    return pa.schema([(name, types[kind]) for _, name, kind in DATASETS[dataset]['columns']])
+
+
+class _ChunkSink:
+    """Write-only file object that collects what pyarrow writes until it is drained."""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _fetch_chunks(dataset: str, account_id: str, symbol: str, start, end):
+    """Yield lists of row tuples from a named cursor, chunk_size rows at a time."""
+    query, params = export_query(dataset, account_id, symbol, start, end)
+    chunk_size = settings('export', EXPORT_DEFAULTS)['chunk_size']
+    connection = connect_db()
+
+    try:
+        # A named cursor keeps the result on the server; only one chunk is in memory
+        crsr = connection.cursor(name=f'export_{dataset}')
+        crsr.itersize = chunk_size
+        crsr.execute(query, params)
+        while True:
+            rows = crsr.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+        crsr.close()
+        connection.commit()
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"Error exporting {dataset}: {error}")
+        raise
+    finally:
+        if connection is not None:
+            release_db(connection)
+
+
+def export_stream(dataset: str, export_format: str = 'csv', account_id: str = DEFAULT_ACCOUNT, symbol: str = None,
+                  start=None, end=None):
+    """Yield an export as encoded byte chunks, one per fetched chunk of rows.
+
+    Arguments are validated before the first chunk is produced, so errors
+    surface as ValueError before any output is written.
+    """
+    if export_format not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}.")
+    if export_format != 'csv':
+        _pyarrow()
+    export_query(dataset, account_id, symbol, start, end)
+    return _encode(dataset, export_format, account_id, symbol, start, end)
+
+
+def _encode(dataset: str, export_format: str, account_id: str, symbol: str, start, end):
+    names = [name for _, name, _ in DATASETS[dataset]['columns']]
+    with span(f'export_{dataset}'):
+        chunks = _fetch_chunks(dataset, account_id, symbol, start, end)
+
+        if export_format == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(names)
+            for rows in chunks:
+                writer.writerows(rows)
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue().encode()
+            return
+
+        pa = _pyarrow()
+        schema = _arrow_schema(pa, dataset)
+        sink = _ChunkSink()
+        if export_format == 'arrow':
+            writer = pa.ipc.new_stream(sink, schema)
+        else:
+            writer = pa.parquet.ParquetWriter(sink, schema, compression='zstd')
+        try:
+            for rows in chunks:
+                # One record batch (Arrow) or row group (Parquet) per chunk
+                batch = pa.RecordBatch.from_arrays(
+                    [pa.array([row[index] for row in rows], type=field.type) for index, field in enumerate(schema)],
+                    schema=schema)
+                if export_format == 'arrow':
+                    writer.write_batch(batch)
+                else:
+                    writer.write_table(pa.Table.from_batches([batch]))
+                yield sink.drain()
+        finally:
+            writer.close()
+        yield sink.drain()
+
+
+def copy_csv(dataset: str, output, account_id: str = DEFAULT_ACCOUNT, symbol: str = None, start=None, end=None):
+    """Write a dataset as CSV to a binary file with COPY ... TO STDOUT, formatted by the server."""
+    query, params = export_query(dataset, account_id, symbol, start, end)
+    connection = connect_db()
+
+    try:
+        crsr = connection.cursor()
+        copy_query = crsr.mogrify(query, params).decode()
+        crsr.copy_expert(f"COPY ({copy_query}) TO STDOUT WITH (FORMAT csv, HEADER);", output)
+        connection.commit()
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        print(f"Error exporting {dataset}: {error}")
+        raise
+    finally:
+        if connection is not None:
+            release_db(connection)
+
+
+def parse_time(value: str) -> datetime:
+    """Parse an ISO 8601 timestamp; one without a timezone is taken as UTC."""
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export positions, snapshot history or trades.')
+    parser.add_argument('dataset', choices=list(DATASETS))
+    parser.add_argument('--format', choices=list(FORMATS), default='csv')
+    parser.add_argument('--account', default=DEFAULT_ACCOUNT)
+    parser.add_argument('--symbol')
+    parser.add_argument('--start', type=parse_time, help='ISO timestamp (history and trades)')
+    parser.add_argument('--end', type=parse_time, help='ISO timestamp (history and trades)')
+    parser.add_argument('--output', help='file to write (default: standard output)')
+    args = parser.parse_args()
+
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    # With the data on standard output, messages printed along the way
+    # (opening the pool, errors) go to standard error instead
+    messages = nullcontext() if args.output else redirect_stdout(sys.stderr)
+    try:
+        with messages:
+            if args.format == 'csv':
+                copy_csv(args.dataset, output, args.account, args.symbol, args.start, args.end)
+            else:
+                for chunk in export_stream(args.dataset, args.format, args.account, args.symbol, args.start,
+                                           args.end):
+                    output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+    if args.output:
+        log(f'{args.dataset} exported to {args.output}.')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+# Production WSGI settings for server.py:
+#
+#   gunicorn server:app
+#
+# Workers never run the background refresh here: every one of them would
+# fetch quotes and write snapshots on its own. on_starting turns it off for
+# all of them, so run `python scheduler.py` once next to the workers.
+import multiprocessing
+
+bind = "0.0.0.0:8080"
+workers = min(2 * multiprocessing.cpu_count() + 1, 8)
+# Threads let a worker serve other requests while one waits on quotes or the database.
+# An open GET /api/stream holds a thread for as long as the client watches, so
+# [stream] max_sync_clients (2 by default) must stay below this; serve many
+# viewers from async_server.py under hypercorn instead.
+threads = 4
+timeout = 60
+
+
+def on_starting(server):
+    # Runs in the master before any worker is forked; the workers inherit
+    # the changed settings, whatever database.ini says
+    from scheduler import refresh_settings
+
+    refresh = refresh_settings()
+    if refresh['run_in_server']:
+        refresh['run_in_server'] = False
+        server.log.info("Background refresh is off in the workers; run `python scheduler.py` next to them.")
@@ -21,16 +21,59 @@ function App() {
   const allocations = positions.map((position: Position) => position.allocation);
 
   useEffect(() => {
-    fetch('http://localhost:8080/api/home')
-      .then((response) => response.json())
-      .then((data) => {
-        setPositions(data.data);
-        console.log('Fetched data:', data.data);
-      })
-      .catch((error) => {
-        console.error('Error fetching data:', error);
-        setMessage('Error loading data');
+    const loadPositions = () =>
+      fetch('http://localhost:8080/api/home')
+        .then((response) => response.json())
+        .then((data) => {
+          setPositions(data.data);
+          setMessage('');
+          console.log('Fetched data:', data.data);
+        })
+        .catch((error) => {
+          console.error('Error fetching data:', error);
+          setMessage('Error loading data');
+        });
+
+    // Load the positions right away; the stream then only keeps them up to date
+    loadPositions();
+
+    // The stream sends every row first, then only the rows that changed
+    const source = new EventSource('http://localhost:8080/api/stream');
+    let poll: ReturnType<typeof setInterval> | undefined;
+
+    source.addEventListener('snapshot', (event) => {
+      const data = JSON.parse((event as MessageEvent).data);
+      setPositions(data.data);
+      setMessage('');
+    });
+
+    source.addEventListener('update', (event) => {
+      const update: { rows: Position[]; removed: string[] } = JSON.parse((event as MessageEvent).data);
+      setPositions((current) => {
+        const changed = new Map(update.rows.map((row) => [row.symbol, row]));
+        const merged = current
+          .filter((position) => !update.removed.includes(position.symbol))
+          .map((position) => changed.get(position.symbol) ?? position);
+        const known = new Set(current.map((position) => position.symbol));
+        return merged.concat(update.rows.filter((row) => !known.has(row.symbol)));
       });
+    });
+
+    source.onerror = (error) => {
+      // EventSource reconnects by itself. A stream that gave up, for example
+      // a 503 when the server has no stream slot left, is replaced by polling
+      if (source.readyState === EventSource.CLOSED && poll === undefined) {
+        console.error('Stream closed, polling instead:', error);
+        poll = setInterval(loadPositions, 15000);
+      }
+    };
+
+    return () => {
+      source.close();
+      if (poll !== undefined) {
+        clearInterval(poll);
+      }
+    };
   }, []);
 
   const handleFormSubmit = (formData: any) => {
@@ -0,0 +1,238 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2.extensions
+from config import settings
+
+# In-process instrumentation: timing spans around pipeline stages, SQL
+# round-trip and row counters fed by CountingCursor, request histograms,
+# and a Prometheus text rendering of all of it for GET /metrics.
+#
+# Settings come from the optional [metrics] section of database.ini:
+# verbose = false silences the informational prints (errors are always
+# printed) and log_spans = true prints one JSON line per finished span.
+METRICS_DEFAULTS = {
+    'verbose': True,
+    'log_spans': False,
+}
+
+# Seconds; the same spread as the Prometheus client defaults
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# SQL statements per request
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_settings = None
+
+
+def metrics_settings() -> dict:
+    global _settings
+    if _settings is None:
+        _settings = settings('metrics', METRICS_DEFAULTS)
+    return _settings
+
+
+def log(*args):
+    """print() for informational messages; silenced by verbose = false."""
+    if metrics_settings()['verbose']:
+        print(*args)
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+                     for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, as Prometheus expects it."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Bucket counts (the last one is +Inf), sum
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {label_values: (list(counts), total) for label_values, (counts, total) in self._series.items()}
+        bounds = [str(bucket) for bucket in self.buckets] + ['+Inf']
+        for label_values, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       _format_labels(self.labels + ('le',), label_values + (bound,)), cumulative)
+            labels = _format_labels(self.labels, label_values)
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, cumulative
+
+
+STAGE_SECONDS = Histogram('portfolio_stage_duration_seconds',
+                          'Time spent in each stage of the refresh pipeline and trade handling.', ('stage',))
+STAGE_QUERIES = Counter('portfolio_stage_sql_queries_total', 'SQL round trips made inside each stage.', ('stage',))
+STAGE_ROWS = Counter('portfolio_stage_rows_total', 'Rows read or written (tickers for quote fetches) by each stage.',
+                     ('stage',))
+STAGE_ERRORS = Counter('portfolio_stage_errors_total', 'Stages that ended with an exception.', ('stage',))
+SQL_QUERIES = Counter('portfolio_sql_queries_total', 'SQL round trips made through the connection pool.')
+SQL_ROWS = Counter('portfolio_sql_rows_total', 'Rows returned or affected by SQL statements.')
+REQUEST_SECONDS = Histogram('portfolio_http_request_duration_seconds', 'HTTP request latency.',
+                            ('method', 'endpoint', 'status'))
+REQUEST_QUERIES = Histogram('portfolio_http_request_sql_queries', 'SQL round trips per HTTP request.',
+                            ('endpoint',), QUERY_BUCKETS)
+
+_METRICS = [STAGE_SECONDS, STAGE_QUERIES, STAGE_ROWS, STAGE_ERRORS, SQL_QUERIES, SQL_ROWS,
+            REQUEST_SECONDS, REQUEST_QUERIES]
+
+# Running SQL totals of the current thread; spans and requests diff them
+_local = threading.local()
+
+
+def thread_sql_counts() -> tuple:
+    """Return (SQL round trips, rows) made by the current thread so far."""
+    return getattr(_local, 'queries', 0), getattr(_local, 'rows', 0)
+
+
+def _count_query(rowcount):
+    rows = max(rowcount, 0)
+    _local.queries = getattr(_local, 'queries', 0) + 1
+    _local.rows = getattr(_local, 'rows', 0) + rows
+    SQL_QUERIES.inc()
+    SQL_ROWS.inc(rows)
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Cursor that counts every round trip and the rows it returned or affected."""
+
+    def execute(self, query, vars=None):
+        try:
+            return super().execute(query, vars)
+        finally:
+            _count_query(self.rowcount)
+
+    def executemany(self, query, vars_list):
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _count_query(self.rowcount)
+
+    def copy_expert(self, sql, file, size=8192):
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            _count_query(self.rowcount)
+
+
+class Span:
+    """Timing of one stage; rows defaults to the SQL rows counted inside it."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.seconds = 0.0
+        self.queries = 0
+        self.rows = None
+
+
+@contextmanager
+def span(stage: str):
+    """Time a block (or, as a decorator, a function) and record it under stage.
+
+    Records duration, SQL round trips and rows made by the current thread
+    inside the block. Set rows on the yielded Span to count something
+    other than SQL rows, e.g. tickers of a quote fetch.
+    """
+    current = Span(stage)
+    queries, rows = thread_sql_counts()
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield current
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        current.seconds = time.perf_counter() - started
+        end_queries, end_rows = thread_sql_counts()
+        current.queries = end_queries - queries
+        if current.rows is None:
+            current.rows = end_rows - rows
+        STAGE_SECONDS.observe(current.seconds, stage)
+        STAGE_QUERIES.inc(current.queries, stage)
+        STAGE_ROWS.inc(current.rows, stage)
+        if failed:
+            STAGE_ERRORS.inc(1, stage)
+        if metrics_settings()['log_spans']:
+            print(json.dumps({'span': stage, 'seconds': round(current.seconds, 6), 'queries': current.queries,
+                              'rows': current.rows, 'error': failed}))
+
+
+def begin_request():
+    """Start timing a request on the current thread; pass the result to end_request()."""
+    return time.perf_counter(), thread_sql_counts()[0]
+
+
+def end_request(started, method: str, endpoint: str, status: int) -> tuple:
+    """Record a finished request. Returns (seconds, SQL round trips)."""
+    start_time, queries = started
+    seconds = time.perf_counter() - start_time
+    queries = thread_sql_counts()[0] - queries
+    REQUEST_SECONDS.observe(seconds, method, endpoint, status)
+    REQUEST_QUERIES.observe(queries, endpoint)
+    return seconds, queries
+
+
+def render(gauges: dict = None) -> str:
+    """Render every metric, plus the given name -> value gauges, in the Prometheus text format."""
+    lines = []
+    for metric in _METRICS:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, value in metric.samples():
+            lines.append(f'{name}{labels} {value}')
+    for name, value in (gauges or {}).items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
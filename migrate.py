@@ -0,0 +1,43 @@
+import os
+import psycopg2
+from config import config
+from metrics import log
+from DataDealer import SCHEMA_FILE
+
+# Upgrades an existing database for this version: the one-off changes in
+# migrations.sql, then schema.sql. Servers only apply schema.sql when they
+# start, which never alters or drops existing tables, keys or indexes.
+#
+#   python migrate.py
+
+MIGRATIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations.sql')
+
+
+def migrate():
+    """Apply migrations.sql and schema.sql in one transaction."""
+    # A direct connection: creating the pool applies schema.sql, which
+    # refuses to run on a database that still needs these migrations
+    connection = psycopg2.connect(**config())
+
+    try:
+        with connection.cursor() as crsr:
+            # Same lock as the schema applied on startup
+            crsr.execute("SELECT pg_advisory_xact_lock(hashtext('positions_schema'));")
+            for path in (MIGRATIONS_FILE, SCHEMA_FILE):
+                with open(path) as sql:
+                    crsr.execute(sql.read())
+        connection.commit()
+        for notice in connection.notices:
+            log(notice.strip())
+        log('Database migrated.')
+
+    except (Exception, psycopg2.DatabaseError) as error:
+        connection.rollback()
+        print(f"Error migrating the database: {error}")
+        raise
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,39 @@
+-- One-off upgrades of an existing database: they alter or drop what is
+-- already there, so they are not applied on startup like schema.sql. Run
+-- them once with `python migrate.py` before starting servers of a new
+-- version; every statement is a no-op when it has nothing left to do.
+
+-- Several portfolios (accounts) share the tables; every row carries its
+-- account_id. Rows from before accounts existed belong to 'default'.
+ALTER TABLE Positions ADD COLUMN IF NOT EXISTS account_id varchar(50) NOT NULL DEFAULT 'default';
+ALTER TABLE IF EXISTS trades ADD COLUMN IF NOT EXISTS account_id varchar(50) NOT NULL DEFAULT 'default';
+ALTER TABLE IF EXISTS position_snapshots ADD COLUMN IF NOT EXISTS account_id varchar(50) NOT NULL DEFAULT 'default';
+
+-- A symbol is unique per account, not globally: drop a unique index or
+-- primary key on symbol alone; schema.sql creates the one on
+-- (account_id, symbol) instead. Other indexes on symbol are kept. A
+-- foreign key that references the old key makes this fail with an error
+-- naming it; drop or repoint it first.
+DO $$
+DECLARE
+    symbol_index record;
+BEGIN
+    FOR symbol_index IN
+        SELECT i.indexrelid::regclass AS index_name, c.conname
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        LEFT JOIN pg_constraint c ON c.conindid = i.indexrelid AND c.conrelid = i.indrelid
+        WHERE i.indrelid = 'positions'::regclass AND i.indisunique AND i.indnatts = 1 AND a.attname = 'symbol'
+    LOOP
+        IF symbol_index.conname IS NOT NULL THEN
+            RAISE NOTICE 'Dropping constraint % on Positions (symbol)', symbol_index.conname;
+            EXECUTE format('ALTER TABLE Positions DROP CONSTRAINT %I', symbol_index.conname);
+        ELSE
+            RAISE NOTICE 'Dropping unique index % on Positions (symbol)', symbol_index.index_name;
+            EXECUTE format('DROP INDEX %s', symbol_index.index_name);
+        END IF;
+    END LOOP;
+END $$;
+
+-- Replaced by trades_account_symbol_executed_at_idx
+DROP INDEX IF EXISTS trades_symbol_executed_at_idx;
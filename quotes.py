@@ -0,0 +1,402 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+import urllib.parse
+import urllib.request
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from config import settings
+from metrics import log
+
+# Settings for live price fetching, overridable in the [quotes] section of
+# database.ini. Setting provider_url switches to an HTTP quote server
+# (for example a local stub) instead of Yahoo Finance.
+QUOTE_DEFAULTS = {
+    'max_workers': 8,  # concurrent quote requests per batch
+    'max_threads': 32,  # provider calls running at once in the process, timed-out ones included
+    'ticker_timeout': 5.0,  # seconds allowed for one symbol
+    'total_timeout': 10.0,  # seconds allowed for the whole batch
+    'provider_url': '',
+    'cache_ttl': 15.0,  # seconds a cached price counts as fresh, 0 disables the cache
+    'stale_ttl': 300.0,  # further seconds a stale price is served while it is refreshed
+    'cache_size': 1000,  # most tickers kept in the cache
+}
+
+
+def yahoo_provider(ticker: str):
+    """Fetch the live price of one ticker from Yahoo Finance.
+
+    yahoo_fin sets no network timeout, so a hung request only ends when the
+    connection does; fetch_prices abandons it after ticker_timeout, and
+    max_threads bounds how many such calls can pile up.
+    """
+    # yahoo_fin pulls in requests_html and friends; only load it once a price is needed
+    import yahoo_fin.stock_info as si
+
+    return si.get_live_price(ticker)
+
+
+class HttpQuoteProvider:
+    """Fetch live prices from an HTTP quote server.
+
+    GET <base_url>/<ticker> must answer with a JSON object like
+    {"price": 123.45}.
+    """
+
+    def __init__(self, base_url: str, timeout: float = 5.0):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def __call__(self, ticker: str):
+        url = f"{self.base_url}/{urllib.parse.quote(ticker)}"
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            return json.load(response)['price']
+
+
+class QuoteCache:
+    """Size-bounded cache of the last fetched price per ticker.
+
+    Entries younger than ttl are fresh. Entries younger than ttl + stale_ttl
+    are stale: they are still served, but should be refreshed. Any entry
+    is good enough as a fallback when a live quote times out.
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float, max_size: int):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # ticker -> (price, fetched_at)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'evictions': 0, 'refreshes': 0}
+
+    def store(self, ticker: str, price: float):
+        with self._lock:
+            self._entries[ticker] = (price, time.monotonic())
+            self._entries.move_to_end(ticker)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def last_known(self, ticker: str):
+        with self._lock:
+            entry = self._entries.get(ticker)
+        return None if entry is None else entry[0]
+
+    def lookup(self, tickers: list):
+        """Split tickers into fresh prices, stale prices and tickers that must be fetched."""
+        fresh, stale, missing = {}, {}, []
+        now = time.monotonic()
+        with self._lock:
+            for ticker in tickers:
+                entry = self._entries.get(ticker)
+                age = None if entry is None else now - entry[1]
+                if age is not None and age < self.ttl:
+                    fresh[ticker] = entry[0]
+                    self._entries.move_to_end(ticker)
+                    self._stats['hits'] += 1
+                elif age is not None and age < self.ttl + self.stale_ttl:
+                    stale[ticker] = entry[0]
+                    self._entries.move_to_end(ticker)
+                    self._stats['stale_hits'] += 1
+                else:
+                    missing.append(ticker)
+                    self._stats['misses'] += 1
+        return fresh, stale, missing
+
+    def count_refresh(self):
+        with self._lock:
+            self._stats['refreshes'] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        stats['max_size'] = self.max_size
+        stats['ttl'] = self.ttl
+        stats['stale_ttl'] = self.stale_ttl
+        return stats
+
+
+_settings = None
+_provider = None
+_cache = None
+_cache_lock = threading.Lock()
+
+# Tickers with a background refresh in flight
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+# Provider calls whose threads are still running, abandoned ones included
+_threads_running = 0
+_threads_skipped = 0
+_threads_lock = threading.Lock()
+
+
+def _get_settings() -> dict:
+    global _settings
+    if _settings is None:
+        _settings = settings('quotes', QUOTE_DEFAULTS)
+    return _settings
+
+
+def _get_cache() -> QuoteCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                quote_settings = _get_settings()
+                _cache = QuoteCache(quote_settings['cache_ttl'], quote_settings['stale_ttl'], quote_settings['cache_size'])
+    return _cache
+
+
+def set_provider(provider):
+    """Replace the quote provider, a callable taking a ticker and returning its price."""
+    global _provider
+    _provider = provider
+
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        quote_settings = _get_settings()
+        if quote_settings['provider_url']:
+            _provider = HttpQuoteProvider(quote_settings['provider_url'], quote_settings['ticker_timeout'])
+        else:
+            _provider = yahoo_provider
+    return _provider
+
+
+def _fetch_one(provider, ticker: str):
+    price = provider(ticker)
+
+    # Convert np.float64 to native Python float if necessary
+    if type(price) is not float:
+        price = float(price)
+
+    # Round to 2 decimal places; late answers still refresh the fallback price
+    rounded_price = round(price, 2)
+    _get_cache().store(ticker, rounded_price)
+    return rounded_price
+
+
+def _start_fetch(provider, ticker: str):
+    """Run one provider call on its own daemon thread and return its future.
+
+    A blocking provider call cannot be interrupted, so a call that outlives
+    its timeout is abandoned rather than waited for: its thread finishes in
+    the background (still refreshing the cache) without taking a worker
+    away from later tickers or batches, as it would in a shared pool.
+    Returns None without calling the provider while max_threads calls are
+    still running, so a provider that hangs cannot pile up threads.
+    """
+    global _threads_running
+    with _threads_lock:
+        if _threads_running >= _get_settings()['max_threads']:
+            return None
+        _threads_running += 1
+    future = Future()
+
+    def run():
+        global _threads_running
+        try:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(_fetch_one(provider, ticker))
+            except BaseException as error:
+                future.set_exception(error)
+        finally:
+            with _threads_lock:
+                _threads_running -= 1
+
+    threading.Thread(target=run, name='quotes', daemon=True).start()
+    return future
+
+
+def _skipped(ticker: str):
+    global _threads_skipped
+    with _threads_lock:
+        _threads_skipped += 1
+    log(f"Too many quote calls still running, using last known price for {ticker}.")
+    return _get_cache().last_known(ticker)
+
+
+def fetch_prices(tickers: list, provider=None, ticker_timeout: float = None, total_timeout: float = None) -> dict:
+    """Fetch latest prices for a list of tickers concurrently, skipping 'CASH'.
+
+    Tickers whose provider call fails get None. Tickers that take longer
+    than ticker_timeout, or are still pending when total_timeout runs out,
+    fall back to their last known price (None if there is none). At most
+    max_workers calls run at once; an abandoned call frees its place for
+    the next ticker straight away. While max_threads calls are running in
+    the process, tickers wait for this batch's own calls to finish, or fall
+    back to their last known price when the batch has none running.
+    """
+    quote_settings = _get_settings()
+    provider = provider or get_provider()
+    ticker_timeout = quote_settings['ticker_timeout'] if ticker_timeout is None else ticker_timeout
+    total_timeout = quote_settings['total_timeout'] if total_timeout is None else total_timeout
+
+    tickers = [ticker for ticker in dict.fromkeys(tickers) if ticker != 'CASH']
+    queued = deque(tickers)
+    started = {}  # ticker -> when its call started
+    futures = {}  # running future -> ticker
+
+    stock_data = {}
+    deadline = time.monotonic() + total_timeout
+    while queued or futures:
+        while queued and len(futures) < quote_settings['max_workers']:
+            future = _start_fetch(provider, queued[0])
+            if future is None:
+                if futures:
+                    break  # wait for one of this batch's calls to finish
+                ticker = queued.popleft()
+                stock_data[ticker] = _skipped(ticker)
+                continue
+            ticker = queued.popleft()
+            started[ticker] = time.monotonic()
+            futures[future] = ticker
+
+        now = time.monotonic()
+        if now >= deadline:
+            break
+
+        # Wake up at the next per-ticker or overall deadline
+        next_deadline = deadline
+        for ticker in futures.values():
+            next_deadline = min(next_deadline, started[ticker] + ticker_timeout)
+        done, _ = wait(futures, timeout=max(next_deadline - now, 0), return_when=FIRST_COMPLETED)
+
+        for future in done:
+            ticker = futures.pop(future)
+            try:
+                stock_data[ticker] = future.result()
+            except Exception as error:
+                print(f"Error fetching stock data for {ticker}: {error}")
+                stock_data[ticker] = None  # Set None if there's an error
+
+        # Give up on tickers that have been running too long
+        now = time.monotonic()
+        for future, ticker in list(futures.items()):
+            if now - started[ticker] >= ticker_timeout:
+                del futures[future]
+                log(f"Timed out fetching stock data for {ticker}, using last known price.")
+                stock_data[ticker] = _get_cache().last_known(ticker)
+
+    for ticker in tickers:
+        if ticker not in stock_data:
+            log(f"Timed out fetching stock data for {ticker}, using last known price.")
+            stock_data[ticker] = _get_cache().last_known(ticker)
+
+    # Keep the order of the requested tickers
+    return {ticker: stock_data[ticker] for ticker in tickers}
+
+
+def _refresh_in_background(tickers: list):
+    """Fetch stale tickers on a background thread, at most one refresh per ticker at a time."""
+    with _refreshing_lock:
+        tickers = [ticker for ticker in tickers if ticker not in _refreshing]
+        _refreshing.update(tickers)
+    if not tickers:
+        return
+
+    def refresh():
+        try:
+            _get_cache().count_refresh()
+            fetch_prices(tickers)
+        finally:
+            with _refreshing_lock:
+                _refreshing.difference_update(tickers)
+
+    threading.Thread(target=refresh, name='quotes-refresh', daemon=True).start()
+
+
+def get_prices(tickers: list) -> dict:
+    """Return latest prices for a list of tickers through the quote cache, skipping 'CASH'.
+
+    Fresh cached prices are returned as they are. Stale prices are returned
+    immediately while a background refresh runs. Only tickers missing from
+    the cache (or too old to serve) are fetched before returning.
+    """
+    tickers = [ticker for ticker in dict.fromkeys(tickers) if ticker != 'CASH']
+    if _get_settings()['cache_ttl'] <= 0:
+        return fetch_prices(tickers)
+
+    fresh, stale, missing = _get_cache().lookup(tickers)
+    if stale:
+        _refresh_in_background(list(stale))
+    fetched = fetch_prices(missing) if missing else {}
+
+    stock_data = {**fresh, **stale, **fetched}
+    return {ticker: stock_data[ticker] for ticker in tickers}
+
+
+async def fetch_prices_async(tickers: list, provider=None, ticker_timeout: float = None,
+                             total_timeout: float = None) -> dict:
+    """Async counterpart of fetch_prices, with the same timeouts and fallbacks.
+
+    Each ticker is awaited on its own task; provider calls still run on
+    threads of their own because the providers are blocking.
+    """
+    quote_settings = _get_settings()
+    provider = provider or get_provider()
+    ticker_timeout = quote_settings['ticker_timeout'] if ticker_timeout is None else ticker_timeout
+    total_timeout = quote_settings['total_timeout'] if total_timeout is None else total_timeout
+
+    tickers = [ticker for ticker in dict.fromkeys(tickers) if ticker != 'CASH']
+    # The per-ticker timeout starts when one of max_workers slots is free, as in fetch_prices
+    slots = asyncio.Semaphore(quote_settings['max_workers'])
+
+    async def fetch(ticker):
+        async with slots:
+            future = _start_fetch(provider, ticker)
+            if future is None:
+                return _skipped(ticker)
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(future), ticker_timeout)
+            except asyncio.TimeoutError:
+                log(f"Timed out fetching stock data for {ticker}, using last known price.")
+                return _get_cache().last_known(ticker)
+            except Exception as error:
+                print(f"Error fetching stock data for {ticker}: {error}")
+                return None  # Set None if there's an error
+
+    tasks = {ticker: asyncio.ensure_future(fetch(ticker)) for ticker in tickers}
+    if not tasks:
+        return {}
+    done, pending = await asyncio.wait(tasks.values(), timeout=total_timeout)
+
+    stock_data = {}
+    for ticker, task in tasks.items():
+        if task in done:
+            stock_data[ticker] = task.result()
+        else:
+            task.cancel()
+            log(f"Timed out fetching stock data for {ticker}, using last known price.")
+            stock_data[ticker] = _get_cache().last_known(ticker)
+    return stock_data
+
+
+async def get_prices_async(tickers: list) -> dict:
+    """Async counterpart of get_prices, going through the same quote cache."""
+    tickers = [ticker for ticker in dict.fromkeys(tickers) if ticker != 'CASH']
+    if _get_settings()['cache_ttl'] <= 0:
+        return await fetch_prices_async(tickers)
+
+    fresh, stale, missing = _get_cache().lookup(tickers)
+    if stale:
+        _refresh_in_background(list(stale))
+    fetched = await fetch_prices_async(missing) if missing else {}
+
+    stock_data = {**fresh, **stale, **fetched}
+    return {ticker: stock_data[ticker] for ticker in tickers}
+
+
+def get_cache_stats() -> dict:
+    """Return quote cache and provider thread counters for monitoring."""
+    stats = _get_cache().stats()
+    with _threads_lock:
+        stats['threads_running'] = _threads_running
+        stats['threads_skipped'] = _threads_skipped
+    return stats
@@ -0,0 +1,400 @@
+import argparse
+import json
+import math
+import os
+import threading
+import urllib.parse
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+import numpy as np
+from config import settings
+from metrics import log, span
+from DataDealer import DEFAULT_ACCOUNT, fetch_rows
+
+# Risk analytics for GET /api/risk: volatility, beta against a benchmark,
+# correlations, maximum drawdown and historical value at risk, per position
+# and for the whole portfolio.
+#
+# Daily bars are kept per symbol in a local cache of .npy files that are
+# memory-mapped on read. A JSON file next to each one records the date
+# range already fetched, so only missing days are requested from the
+# history provider. Metrics are computed with numpy over the whole
+# days x holdings matrix at once.
+#
+# Settings come from the optional [risk] section of database.ini. Set
+# history_provider = stub to work offline with synthetic prices.
+RISK_DEFAULTS = {
+    'cache_dir': 'price_cache',
+    'history_provider': 'yahoo',  # yahoo or stub
+    'benchmark': 'SPY',
+    'lookback': 252,  # trading days of returns
+    'confidence': 0.95,  # of the one-day historical VaR
+    'min_observations': 20,  # fewer common days than this is an error
+    'max_workers': 8,  # concurrent history requests
+}
+
+TRADING_DAYS = 252
+
+# One daily bar; prices are NaN where the provider has none
+BAR_DTYPE = np.dtype([
+    ('day', 'datetime64[D]'),
+    ('open', 'f8'),
+    ('high', 'f8'),
+    ('low', 'f8'),
+    ('close', 'f8'),
+    ('adjclose', 'f8'),
+    ('volume', 'f8'),
+])
+
+
+def yahoo_history_provider(symbol: str, start: date, end: date) -> np.ndarray:
+    """Fetch daily bars of one symbol from Yahoo Finance for start..end (inclusive)."""
+    import yahoo_fin.stock_info as si
+
+    frame = si.get_data(symbol, start_date=start, end_date=end + timedelta(days=1), interval='1d')
+    bars = np.empty(len(frame), dtype=BAR_DTYPE)
+    bars['day'] = frame.index.values.astype('datetime64[D]')
+    for field in BAR_DTYPE.names[1:]:
+        bars[field] = frame[field].to_numpy(dtype=float)
+    return bars
+
+
+class StubHistoryProvider:
+    """Deterministic synthetic daily bars for offline use.
+
+    Every symbol follows the benchmark with a beta and an idiosyncratic
+    noise derived from its crc32, on weekdays from 2000-01-03. A day's price
+    does not depend on the requested range, so incremental fetches agree
+    with full ones.
+    """
+
+    EPOCH = np.datetime64('2000-01-03', 'D')
+
+    def __init__(self, benchmark: str = RISK_DEFAULTS['benchmark'], seed: int = 7):
+        self.benchmark = benchmark
+        self.seed = seed
+        self.calls = 0
+
+    def _market(self, count: int) -> np.ndarray:
+        return np.random.default_rng(self.seed).normal(0.0003, 0.011, count)
+
+    def __call__(self, symbol: str, start: date, end: date) -> np.ndarray:
+        self.calls += 1
+        days = np.arange(self.EPOCH, np.datetime64(end, 'D') + 1)
+        days = days[np.is_busday(days)]
+        returns = self._market(len(days))
+        crc = zlib.crc32(symbol.encode())
+        if symbol != self.benchmark:
+            beta = 0.5 + (crc % 1000) / 1000
+            noise = np.random.default_rng([self.seed, crc]).normal(0, 0.005 + (crc % 7) * 0.003, len(days))
+            returns = beta * returns + noise
+        closes = (10 + crc % 490) * np.cumprod(1 + returns)
+        keep = days >= np.datetime64(start, 'D')
+        bars = np.empty(int(keep.sum()), dtype=BAR_DTYPE)
+        bars['day'] = days[keep]
+        closes = closes[keep]
+        bars['open'] = bars['close'] = bars['adjclose'] = closes
+        bars['high'] = closes * 1.01
+        bars['low'] = closes * 0.99
+        bars['volume'] = 1e6
+        return bars
+
+
+class PriceHistoryCache:
+    """Daily bars per symbol in <directory>/<symbol>.npy, fetched incrementally.
+
+    <symbol>.json holds the first and last day already fetched. Only days
+    before today count as fetched, since today's bar is not final yet.
+    Files are replaced atomically, so readers never see a partial write.
+    """
+
+    def __init__(self, directory: str, provider, max_workers: int = 8):
+        self.directory = directory
+        self.provider = provider
+        self.max_workers = max_workers
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'fetches': 0, 'fetched_bars': 0, 'errors': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, symbol: str, extension: str) -> str:
+        return os.path.join(self.directory, urllib.parse.quote(symbol, safe='') + extension)
+
+    def _symbol_lock(self, symbol: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(symbol, threading.Lock())
+
+    def _coverage(self, symbol: str):
+        try:
+            with open(self._path(symbol, '.json')) as coverage_file:
+                coverage = json.load(coverage_file)
+            return date.fromisoformat(coverage['start']), date.fromisoformat(coverage['end'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _load(self, symbol: str) -> np.ndarray:
+        try:
+            return np.load(self._path(symbol, '.npy'), mmap_mode='r')
+        except (OSError, ValueError):
+            return np.empty(0, dtype=BAR_DTYPE)
+
+    def _missing(self, coverage, start: date, end: date) -> list:
+        """Date ranges of start..end not fetched yet."""
+        if coverage is None or coverage[0] > end or coverage[1] < start:
+            return [(start, end)]
+        ranges = []
+        if start < coverage[0]:
+            ranges.append((start, coverage[0] - timedelta(days=1)))
+        if end > coverage[1]:
+            ranges.append((coverage[1] + timedelta(days=1), end))
+        return ranges
+
+    def _update(self, symbol: str, start: date, end: date, today: date):
+        with self._symbol_lock(symbol):
+            coverage = self._coverage(symbol)
+            missing = self._missing(coverage, start, end)
+            if not missing:
+                with self._lock:
+                    self._stats['hits'] += 1
+                return
+            fetched = [self.provider(symbol, first, last) for first, last in missing]
+            bars = self._load(symbol)
+            for (first, last), new_bars in zip(missing, fetched):
+                new_bars = np.asarray(new_bars, dtype=BAR_DTYPE)
+                inside = (new_bars['day'] >= np.datetime64(first, 'D')) & (new_bars['day'] <= np.datetime64(last, 'D'))
+                outside = (bars['day'] < np.datetime64(first, 'D')) | (bars['day'] > np.datetime64(last, 'D'))
+                bars = np.concatenate([bars[outside], new_bars[inside]])
+            bars = np.sort(bars, order='day')
+
+            # Only days before today are complete
+            covered_end = min(end, today - timedelta(days=1))
+            if coverage is not None and coverage[0] <= end and coverage[1] >= start:
+                coverage = (min(coverage[0], start), max(coverage[1], covered_end))
+            else:
+                coverage = (start, covered_end)
+            self._write(symbol, bars, coverage)
+            with self._lock:
+                self._stats['fetches'] += len(missing)
+                self._stats['fetched_bars'] += sum(len(new_bars) for new_bars in fetched)
+
+    def _write(self, symbol: str, bars: np.ndarray, coverage):
+        path = self._path(symbol, '.npy')
+        with open(path + '.tmp', 'wb') as bars_file:
+            np.save(bars_file, bars)
+        os.replace(path + '.tmp', path)
+        path = self._path(symbol, '.json')
+        with open(path + '.tmp', 'w') as coverage_file:
+            json.dump({'start': coverage[0].isoformat(), 'end': coverage[1].isoformat()}, coverage_file)
+        os.replace(path + '.tmp', path)
+
+    def bars(self, symbols: list, start: date, end: date, today: date = None) -> tuple:
+        """Return ({symbol: bars of start..end}, {symbol: error}), fetching missing days first."""
+        today = today or datetime.now(timezone.utc).date()
+        errors = {}
+
+        def update(symbol):
+            try:
+                self._update(symbol, start, end, today)
+            except Exception as error:
+                print(f"Error fetching price history of {symbol}: {error}")
+                with self._lock:
+                    self._stats['errors'] += 1
+                errors[symbol] = str(error)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='history') as executor:
+            list(executor.map(update, symbols))
+
+        result = {}
+        for symbol in symbols:
+            bars = self._load(symbol)
+            days = bars['day']
+            result[symbol] = bars[np.searchsorted(days, np.datetime64(start, 'D')):
+                                  np.searchsorted(days, np.datetime64(end, 'D'), side='right')]
+        return result, errors
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+
+def align_closes(bars: dict, symbols: list) -> tuple:
+    """Return (days, closes) with one column per symbol on the days every symbol has a price.
+
+    Adjusted closes are used where available. A missing day inside a
+    symbol's history carries its last price forward.
+    """
+    days = np.unique(np.concatenate([bars[symbol]['day'] for symbol in symbols]))
+    closes = np.full((len(days), len(symbols)), np.nan)
+    for column, symbol in enumerate(symbols):
+        symbol_bars = bars[symbol]
+        prices = np.where(np.isfinite(symbol_bars['adjclose']), symbol_bars['adjclose'], symbol_bars['close'])
+        closes[np.searchsorted(days, symbol_bars['day']), column] = prices
+
+    # Forward fill every column at once
+    rows = np.where(np.isfinite(closes), np.arange(len(days))[:, None], 0)
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    closes = closes[rows, np.arange(len(symbols))]
+
+    complete = np.isfinite(closes).all(axis=1)
+    return days[complete], closes[complete]
+
+
+def max_drawdown(levels: np.ndarray) -> np.ndarray:
+    """Largest peak-to-trough fall of each column of levels, as a negative fraction."""
+    return (levels / np.maximum.accumulate(levels, axis=0) - 1).min(axis=0)
+
+
+def compute_risk(closes: np.ndarray, benchmark: np.ndarray, values: np.ndarray, total: float,
+                 confidence: float) -> dict:
+    """Risk metrics of holdings from aligned daily closes.
+
+    closes has one column per holding and benchmark the closes of the
+    benchmark on the same days. values are the current market values of the
+    holdings and total the value of the whole portfolio including cash,
+    which is assumed not to move. Volatility is annualized; VaR is the
+    one-day historical loss not exceeded with the given confidence.
+    """
+    returns = closes[1:] / closes[:-1] - 1
+    benchmark_returns = benchmark[1:] / benchmark[:-1] - 1
+    weights = values / total if total else np.zeros_like(values)
+    portfolio_returns = returns @ weights
+
+    centered = returns - returns.mean(axis=0)
+    benchmark_centered = benchmark_returns - benchmark_returns.mean()
+    benchmark_variance = benchmark_centered @ benchmark_centered
+    betas = centered.T @ benchmark_centered / benchmark_variance if benchmark_variance else np.full(len(values), np.nan)
+    portfolio_centered = portfolio_returns - portfolio_returns.mean()
+    portfolio_beta = portfolio_centered @ benchmark_centered / benchmark_variance if benchmark_variance else np.nan
+
+    tail = 1 - confidence
+    position_var = -np.quantile(returns, tail, axis=0)
+    portfolio_var = -np.quantile(portfolio_returns, tail)
+    growth = np.cumprod(np.r_[1.0, 1 + portfolio_returns])
+
+    return {
+        'weight': weights,
+        'volatility': returns.std(axis=0, ddof=1) * math.sqrt(TRADING_DAYS),
+        'beta': betas,
+        'max_drawdown': max_drawdown(closes),
+        'var': position_var,
+        'var_amount': position_var * values,
+        'correlation': np.atleast_2d(np.corrcoef(returns, rowvar=False)),
+        'portfolio': {
+            'volatility': float(portfolio_returns.std(ddof=1) * math.sqrt(TRADING_DAYS)),
+            'beta': float(portfolio_beta),
+            'max_drawdown': float(max_drawdown(growth)),
+            'var': float(portfolio_var),
+            'var_amount': float(portfolio_var * total),
+        },
+    }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def set_history_provider(provider):
+    """Replace the history provider, a callable (symbol, start, end) -> BAR_DTYPE array."""
+    get_history_cache().provider = provider
+
+
+def get_history_cache() -> PriceHistoryCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                risk_settings = settings('risk', RISK_DEFAULTS)
+                if risk_settings['history_provider'] == 'stub':
+                    provider = StubHistoryProvider(risk_settings['benchmark'])
+                elif risk_settings['history_provider'] == 'yahoo':
+                    provider = yahoo_history_provider
+                else:
+                    raise ValueError(f"Unknown history_provider {risk_settings['history_provider']!r}.")
+                _cache = PriceHistoryCache(risk_settings['cache_dir'], provider, risk_settings['max_workers'])
+    return _cache
+
+
+def _finite(value):
+    return value if math.isfinite(value) else None
+
+
+@span('risk')
+def portfolio_risk(account_id: str = DEFAULT_ACCOUNT, lookback: int = None, confidence: float = None,
+                   benchmark: str = None, today: date = None) -> dict:
+    """Risk report of an account's current holdings over the last lookback trading days."""
+    risk_settings = settings('risk', RISK_DEFAULTS)
+    lookback = lookback or risk_settings['lookback']
+    confidence = confidence or risk_settings['confidence']
+    benchmark = benchmark or risk_settings['benchmark']
+    if not risk_settings['min_observations'] <= lookback <= 10 * TRADING_DAYS:
+        raise ValueError(f"lookback must be between {risk_settings['min_observations']} and {10 * TRADING_DAYS}.")
+    if not 0.5 <= confidence < 1:
+        raise ValueError("confidence must be at least 0.5 and below 1.")
+
+    rows = fetch_rows(account_id)
+    holdings = [row for row in rows if row.symbol != 'CASH' and row.quantity]
+    total = sum(float(row.value or 0) for row in rows)
+
+    # Complete days only, so a warm cache fetches nothing. Ask for enough
+    # calendar days to cover lookback trading days plus holidays.
+    today = today or datetime.now(timezone.utc).date()
+    end = today - timedelta(days=1)
+    start = end - timedelta(days=math.ceil((lookback + 1) * 7 / 5) + 10)
+    symbols = sorted({row.symbol for row in holdings} | {benchmark})
+    bars, errors = get_history_cache().bars(symbols, start, end, today)
+    if benchmark in errors or not len(bars[benchmark]):
+        raise ValueError(f"No price history for benchmark {benchmark}.")
+
+    missing = sorted(symbol for symbol in symbols if symbol in errors or not len(bars[symbol]))
+    held = [row for row in holdings if row.symbol not in missing]
+    columns = [row.symbol for row in held]
+    days, closes = align_closes(bars, columns + [benchmark])
+    days, closes = days[-(lookback + 1):], closes[-(lookback + 1):]
+    if len(days) <= risk_settings['min_observations']:
+        raise ValueError(f"Only {len(days)} days of common price history, need more than "
+                         f"{risk_settings['min_observations']}.")
+
+    values = np.array([float(row.value or 0) for row in held])
+    metrics = compute_risk(closes[:, :-1], closes[:, -1], values, total, confidence)
+    log(f'Risk of {account_id}: {len(held)} holdings over {len(days) - 1} days.')
+
+    positions = [
+        {'symbol': symbol, **{key: _finite(float(metrics[key][index]))
+                              for key in ('weight', 'volatility', 'beta', 'max_drawdown', 'var', 'var_amount')}}
+        for index, symbol in enumerate(columns)
+    ]
+    return {
+        'account': account_id,
+        'benchmark': benchmark,
+        'confidence': confidence,
+        'start': days[0].item(),
+        'end': days[-1].item(),
+        'observations': len(days) - 1,
+        'portfolio': {key: _finite(value) for key, value in metrics['portfolio'].items()},
+        'positions': positions,
+        'correlation': {
+            'symbols': columns,
+            'matrix': [[_finite(value) for value in row] for row in metrics['correlation'].tolist()] if columns else [],
+        },
+        'missing': missing,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print the risk report of an account.')
+    parser.add_argument('--account', default=DEFAULT_ACCOUNT)
+    parser.add_argument('--lookback', type=int)
+    parser.add_argument('--confidence', type=float)
+    parser.add_argument('--benchmark')
+    parser.add_argument('--stub', action='store_true', help='use synthetic prices instead of Yahoo Finance')
+    args = parser.parse_args()
+
+    if args.stub:
+        set_history_provider(StubHistoryProvider(args.benchmark or settings('risk', RISK_DEFAULTS)['benchmark']))
+    report = portfolio_risk(args.account, args.lookback, args.confidence, args.benchmark)
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
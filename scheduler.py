@@ -0,0 +1,135 @@
+import threading
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from config import settings
+from DataDealer import refresh_positions
+
+# Settings for the background price refresh, overridable in the [refresh]
+# section of database.ini.
+REFRESH_DEFAULTS = {
+    'sync_refresh': False,  # True: refresh on every GET /api/home like before
+    'run_in_server': True,  # False: refresh only from a separate `python scheduler.py` worker
+    'interval': 60.0,  # seconds between refreshes while the market is open
+    'off_hours_interval': 900.0,  # seconds between refreshes while it is closed
+    'market_timezone': 'America/New_York',
+    'market_open': '09:30',
+    'market_close': '16:00',
+}
+
+_settings = None
+
+
+def refresh_settings() -> dict:
+    global _settings
+    if _settings is None:
+        _settings = settings('refresh', REFRESH_DEFAULTS)
+    return _settings
+
+
+def is_market_open(now: datetime = None) -> bool:
+    """Return True on weekdays between market_open and market_close in the market timezone."""
+    refresh = refresh_settings()
+    now = now or datetime.now(ZoneInfo(refresh['market_timezone']))
+    if now.tzinfo is not None:
+        now = now.astimezone(ZoneInfo(refresh['market_timezone']))
+    if now.weekday() >= 5:
+        return False
+    current = now.strftime('%H:%M')
+    return refresh['market_open'] <= current < refresh['market_close']
+
+
+class RefreshScheduler:
+    """Runs refresh_positions() periodically on a background thread."""
+
+    def __init__(self, refresh=refresh_positions):
+        self.refresh = refresh
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._stats = {'runs': 0, 'errors': 0, 'last_run': None, 'last_duration': None, 'last_error': None}
+        self._lock = threading.Lock()
+
+    def interval(self) -> float:
+        refresh = refresh_settings()
+        return refresh['interval'] if is_market_open() else refresh['off_hours_interval']
+
+    def run_once(self):
+        started = time.monotonic()
+        try:
+            self.refresh()
+            error = None
+        except Exception as exc:
+            error = str(exc)
+            print(f"Error in background refresh: {exc}")
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['last_run'] = datetime.now().isoformat(timespec='seconds')
+            self._stats['last_duration'] = round(time.monotonic() - started, 3)
+            self._stats['last_error'] = error
+            if error is not None:
+                self._stats['errors'] += 1
+
+    def run_forever(self):
+        while not self._stopped.is_set():
+            self._wakeup.clear()
+            self.run_once()
+            # Sleep until the next interval, or until a refresh is requested
+            self._wakeup.wait(self.interval())
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run_forever, name='price-refresh', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def request_refresh(self):
+        """Run the next refresh now instead of waiting for the interval."""
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['running'] = self._thread is not None and self._thread.is_alive()
+        stats['market_open'] = is_market_open()
+        return stats
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def start_scheduler() -> RefreshScheduler:
+    """Start the in-process background refresh once."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = RefreshScheduler()
+                _scheduler.start()
+    return _scheduler
+
+
+def request_refresh():
+    """Ask the in-process scheduler (if running) to refresh as soon as possible."""
+    if _scheduler is not None:
+        _scheduler.request_refresh()
+
+
+def get_scheduler_stats() -> dict:
+    if _scheduler is None:
+        return {'running': False, 'market_open': is_market_open()}
+    return _scheduler.stats()
+
+
+if __name__ == "__main__":
+    # Standalone worker: set run_in_server = false in [refresh] when using this
+    print('Starting background price refresh worker...')
+    scheduler = RefreshScheduler()
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        scheduler.stop()
@@ -0,0 +1,104 @@
+-- Tables used next to Positions. Applied automatically (idempotently) when
+-- the connection pool is created; can also be run by hand with psql. Only
+-- additions belong here; changes to existing objects go in migrations.sql.
+
+-- Every row carries its account_id (added to older databases by
+-- migrations.sql). Stop with a clear message rather than half-applying
+-- this file when the migrations have not been run yet.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_attribute
+                   WHERE attrelid = 'positions'::regclass AND attname = 'account_id' AND NOT attisdropped) THEN
+        RAISE EXCEPTION 'Positions has no account_id column; run python migrate.py first.';
+    END IF;
+END $$;
+
+-- A symbol is unique per account. The same index serves every per-account
+-- lookup, trade and keyset page.
+CREATE UNIQUE INDEX IF NOT EXISTS positions_account_symbol_idx ON Positions (account_id, symbol);
+
+-- Append-only ledger of every executed trade. Positions is maintained
+-- from it incrementally and can be rebuilt from it at any time.
+CREATE TABLE IF NOT EXISTS trades (
+    id bigserial PRIMARY KEY,
+    executed_at timestamptz NOT NULL DEFAULT now(),
+    account_id varchar(50) NOT NULL DEFAULT 'default',
+    symbol varchar(20) NOT NULL,
+    action varchar(10) NOT NULL,  -- Entry, Exit, Add or Trim
+    quantity numeric NOT NULL,
+    price numeric NOT NULL
+);
+
+-- Rebuilds replay one account in execution order
+CREATE INDEX IF NOT EXISTS trades_account_symbol_executed_at_idx ON trades (account_id, symbol, executed_at, id);
+CREATE INDEX IF NOT EXISTS trades_account_executed_at_idx ON trades (account_id, executed_at, id);
+CREATE INDEX IF NOT EXISTS trades_executed_at_idx ON trades (executed_at);
+
+-- Start the ledger from the current holdings the first time it is created,
+-- so a rebuild reproduces positions that existed before the ledger did.
+-- CASH entries record the cash amount as quantity, like POST /api/positions.
+INSERT INTO trades (executed_at, account_id, symbol, action, quantity, price)
+SELECT COALESCE(open_date::timestamptz, now()), account_id, symbol, 'Entry',
+       CASE WHEN symbol = 'CASH' THEN COALESCE(value, 0) ELSE COALESCE(quantity, 0) END,
+       COALESCE(avg_cost, 0)
+FROM Positions
+WHERE NOT EXISTS (SELECT 1 FROM trades);
+
+-- Per-symbol snapshots appended by refresh_positions() for historical
+-- charts. Rows arrive in time order, so a BRIN index on taken_at keeps
+-- range scans cheap at a fraction of a btree's size.
+CREATE TABLE IF NOT EXISTS position_snapshots (
+    taken_at timestamptz NOT NULL,
+    account_id varchar(50) NOT NULL DEFAULT 'default',
+    symbol varchar(20) NOT NULL,
+    price double precision,
+    value double precision,
+    allocation real
+);
+
+CREATE INDEX IF NOT EXISTS position_snapshots_taken_at_brin ON position_snapshots USING brin (taken_at);
+
+-- Keyset pagination of GET /api/home walks an account's Positions by
+-- symbol through positions_account_symbol_idx above. Columns that every
+-- refresh rewrites are deliberately not indexed, so those updates stay HOT.
+
+-- GET /api/stream pushes changed rows to connected clients. Every statement
+-- that changes Positions (a refresh, a trade, a rebuild) notifies the
+-- account_id:symbol pairs it touched on channel positions_changed, delivered on commit to
+-- every listening server process. Payloads are limited to 8000 bytes;
+-- larger changes send '*' and listeners re-read the whole table.
+CREATE OR REPLACE FUNCTION notify_positions_changed() RETURNS trigger AS $$
+DECLARE
+    symbols text;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        SELECT string_agg(account_id || ':' || symbol, ',') INTO symbols FROM old_rows;
+    ELSE
+        SELECT string_agg(account_id || ':' || symbol, ',') INTO symbols FROM new_rows;
+    END IF;
+    IF symbols IS NOT NULL THEN
+        PERFORM pg_notify('positions_changed', CASE WHEN length(symbols) < 7900 THEN symbols ELSE '*' END);
+    END IF;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+-- Triggers are only created when missing: dropping and recreating them on
+-- every start would take an ACCESS EXCLUSIVE lock on Positions each time.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                   WHERE tgrelid = 'positions'::regclass AND tgname = 'positions_notify_insert') THEN
+        CREATE TRIGGER positions_notify_insert AFTER INSERT ON Positions
+            REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION notify_positions_changed();
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                   WHERE tgrelid = 'positions'::regclass AND tgname = 'positions_notify_update') THEN
+        CREATE TRIGGER positions_notify_update AFTER UPDATE ON Positions
+            REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION notify_positions_changed();
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                   WHERE tgrelid = 'positions'::regclass AND tgname = 'positions_notify_delete') THEN
+        CREATE TRIGGER positions_notify_delete AFTER DELETE ON Positions
+            REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION notify_positions_changed();
+    END IF;
+END $$;
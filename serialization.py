@@ -0,0 +1,133 @@
+import dataclasses
+import decimal
+import gzip
+import hashlib
+import json
+import math
+import sys
+import uuid
+from datetime import date
+from functools import lru_cache
+from flask import current_app, request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+# orjson and brotli are optional: without them the stdlib json encoder is
+# used and responses are only gzip-compressed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+# Positions share few distinct open dates, so formatted dates are reused
+_http_date = lru_cache(maxsize=4096)(http_date)
+
+
+def _default(value):
+    # Same representations as Flask's default provider, so the API contract
+    # does not change: Decimal as string, dates as HTTP dates
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, date):
+        return _http_date(value)
+    # A numpy value can only exist once numpy has been imported by someone else
+    np = sys.modules.get('numpy')
+    if np is not None:
+        if isinstance(value, np.integer):
+            return int(value)
+        if isinstance(value, np.floating):
+            value = float(value)
+            return None if math.isnan(value) else value
+        if isinstance(value, np.bool_):
+            return bool(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(obj) -> bytes:
+        """Encode obj as compact JSON with sorted keys."""
+        # OPT_SERIALIZE_NUMPY makes orjson import numpy, so only ask for it once numpy is loaded
+        options = _ORJSON_OPTIONS | orjson.OPT_SERIALIZE_NUMPY if 'numpy' in sys.modules else _ORJSON_OPTIONS
+        return orjson.dumps(obj, default=_default, option=options)
+else:
+    def dumps(obj) -> bytes:
+        """Encode obj as compact JSON with sorted keys."""
+        return json.dumps(obj, default=_default, sort_keys=True, separators=(',', ':')).encode()
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes with dumps() (orjson when available)."""
+
+    default = staticmethod(_default)
+
+    def dumps(self, obj, **kwargs) -> str:
+        if kwargs.get('indent') is not None:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj) + b'\n', mimetype=self.mimetype)
+
+
+def _choose_encoding(req, size: int):
+    if size < MIN_COMPRESS_SIZE:
+        return None
+    accepted = req.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def json_response(payload, status: int = 200, req=None, response_class=None):
+    """Encode payload as a JSON response with an ETag and content negotiation.
+
+    Answers 304 Not Modified when the client's If-None-Match already has the
+    same body. Otherwise compresses with brotli or gzip when the client
+    accepts it. req and response_class default to Flask's; the async
+    server passes Quart's.
+    """
+    req = req or request
+    response_class = response_class or current_app.response_class
+    body = dumps(payload) + b'\n'
+    encoding = _choose_encoding(req, len(body))
+
+    # Each encoding of the same body is a different representation
+    etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+    if encoding is not None:
+        etag = f'{etag}-{encoding}'
+
+    if req.if_none_match.contains(etag):
+        response = response_class(status=304)
+    else:
+        if encoding == 'br':
+            body = brotli.compress(body, quality=4)
+        elif encoding == 'gzip':
+            body = gzip.compress(body, compresslevel=5)
+        response = response_class(body, status=status, mimetype='application/json')
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    # Let browsers keep the body but revalidate it on every request
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
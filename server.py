@@ -1,24 +1,70 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-import pandas as pd
-from DataDealer import fetch_data, insert_data, update_current_stock_prices, delete_data_by_symbol, calculate_and_update_values, calculate_and_update_allocations, calculate_and_update_changes,update_average_price_and_quantity,decrease_quantity  # Assuming insert_data is a function to insert data into the database
+from serialization import FastJSONProvider, json_response
+from metrics import begin_request, end_request, log
+from streaming import get_hub
+from export import FORMATS, export_stream
+from scheduler import refresh_settings, start_scheduler, request_refresh
+from DataDealer import fetch_rows, fetch_page, refresh_positions, execute_trade, execute_trades, TradeBatchError, rebuild_positions_from_ledger, fetch_history
+import api
 
 # app instance
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
 
+# Prices are refreshed by a background scheduler unless sync_refresh is set
+REFRESH = refresh_settings()
+
+@app.before_request
+def start_background_refresh():
+    if not REFRESH['sync_refresh'] and REFRESH['run_in_server']:
+        start_scheduler()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = begin_request()
+
+@app.after_request
+def record_request(response):
+    if 'request_started' in g:
+        seconds, queries = end_request(g.request_started, request.method, request.endpoint or 'unknown',
+                                       response.status_code)
+        response.headers['Server-Timing'] = f'app;dur={seconds * 1000:.1f}, db;desc="{queries} queries"'
+    return response
+
+def get_account(data=None) -> str:
+    return api.get_account(request.args, data)
+
+def get_positions_page():
+    """Serve GET /api/home?limit=&cursor=&sort=&symbol=&fields= from fetch_page."""
+    query = api.page_query(request.args)
+    account_id = get_account()
+
+    if REFRESH['sync_refresh']:
+        refresh_positions(account_id)
+    data, next_cursor = fetch_page(**query, account_id=account_id)
+    return json_response({'status': 'success', 'data': data, 'next_cursor': next_cursor})
+
 # GET route to fetch all risk levels
 @app.route("/api/home", methods=['GET'])
 def get_positions_data():
     try:
-        
-        update_current_stock_prices()
-        calculate_and_update_values()
-        calculate_and_update_allocations()
-        calculate_and_update_changes()
-        df = fetch_data()
-        data = df.to_dict(orient='records')
-        return jsonify({'status': 'success', 'data': data})
+        if api.wants_page(request.args):
+            return get_positions_page()
+
+        account_id = get_account()
+        if REFRESH['sync_refresh']:
+            refresh_positions(account_id)
+        # Read the rows back even after a synchronous refresh, so numeric
+        # columns are always the stored Decimals and serialize as strings;
+        # the background refresh keeps them up to date otherwise
+        data = [row._asdict() for row in fetch_rows(account_id)]
+
+        # An unchanged portfolio is answered with 304 Not Modified
+        return json_response({'status': 'success', 'data': data})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -28,18 +74,11 @@ def add_position():
     try:
         # Get the JSON data from the request
         data = request.get_json()
-        print('Received Data:', data)  # Log incoming data for debugging
-        selected_option = data.get('selectedOption')
-        print(selected_option)
-
-        if selected_option == 'Entry':
-            insert_data(data)  # Assuming insert_data handles the actual database insertion
-        elif selected_option == 'Exit':
-            delete_data_by_symbol(data.get('symbol'), data.get('price'),data.get('quantity'))
-        elif selected_option == 'Add':
-            update_average_price_and_quantity(data.get('symbol'), data.get('price'),data.get('quantity'))
-        elif selected_option == 'Trim':
-            decrease_quantity(data.get("symbol"),data.get('price'),data.get('quantity'))
+        log('Received Data:', data)  # Log incoming data for debugging
+        execute_trade(data, get_account(data))
+
+        # Recompute value and allocation for the new holdings right away
+        request_refresh()
     
         return jsonify({'status': 'success', 'message': 'Data inserted successfully'})
     
@@ -50,5 +89,124 @@ def add_position():
     except Exception as e:
         return jsonify({'status': 'error', 'message': 'An unexpected error occurred'}), 500
 
+# POST route to execute many trades at once, all or nothing
+@app.route("/api/positions/batch", methods=['POST'])
+def add_positions_batch():
+    try:
+        data = request.get_json()
+        trades = api.batch_trades(data)
+        account_id = get_account(data)
+
+        # Validate every trade before touching the database
+        errors = api.invalid_trades(trades)
+        if errors:
+            return jsonify(errors), 400
+
+        results = execute_trades(trades, account_id)
+        request_refresh()
+        return jsonify({'status': 'success', 'results': results})
+
+    except TradeBatchError as e:
+        return jsonify(api.batch_error(e, len(trades))), 400
+
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': 'An unexpected error occurred'}), 500
+
+# POST route to rebuild Positions from the trades ledger ({"dry_run": true} only returns the result)
+@app.route("/api/positions/rebuild", methods=['POST'])
+def rebuild_positions():
+    try:
+        data = request.get_json(silent=True) or {}
+        dry_run = bool(data.get('dry_run', False))
+        df = rebuild_positions_from_ledger(apply=not dry_run, account_id=get_account(data))
+        if not dry_run:
+            request_refresh()
+        return jsonify({'status': 'success', 'dry_run': dry_run, 'data': df.to_dict(orient='records')})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+# GET route for downsampled snapshot history of a symbol (or the whole portfolio)
+@app.route("/api/history", methods=['GET'])
+def get_history():
+    try:
+        query = api.history_query(request.args)
+        times, values = fetch_history(query['field'], query['start'], query['end'], query['symbol'], get_account())
+        return json_response(api.history_body(times, values, query))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+# GET route for volatility, beta, correlations, drawdown and VaR of the current holdings
+@app.route("/api/risk", methods=['GET'])
+def get_risk():
+    # numpy is only needed here; importing it lazily keeps it out of startup
+    from risk import portfolio_risk
+
+    try:
+        report = portfolio_risk(get_account(), **api.risk_query(request.args))
+        return json_response({'status': 'success', **report})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+# POST route evaluating hypothetical trades, target allocations or scenario sweeps without writing anything
+@app.route("/api/simulate", methods=['POST'])
+def simulate_positions():
+    # pandas and numpy are only needed here; importing them lazily keeps them out of startup
+    from simulator import simulate
+
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'status': 'error', 'message': 'Expected a JSON object'}), 400
+        return json_response({'status': 'success', **simulate(data, get_account(data))})
+    except TradeBatchError as e:
+        return jsonify({'status': 'error', 'message': str(e), 'index': e.index}), 400
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+# GET route streaming a dataset (positions, history or trades) as CSV, Arrow or Parquet
+@app.route("/api/export", methods=['GET'])
+def export_data():
+    try:
+        export = api.export_request(request.args)
+        chunks = export_stream(account_id=get_account(), **export)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return Response(chunks, mimetype=FORMATS[export['export_format']],
+                    headers={'Content-Disposition': f'attachment; filename={api.export_filename(export)}'})
+
+# GET route streaming live position updates as server-sent events: a snapshot
+# event with every row, then update events with only the changed rows
+@app.route("/api/stream", methods=['GET'])
+def stream_positions():
+    try:
+        subscription = get_hub().subscribe(get_account())
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+    return Response(subscription.events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# GET route for runtime counters (connection pool and quote cache usage)
+@app.route("/api/stats", methods=['GET'])
+def get_stats():
+    return jsonify(api.stats_body())
+
+# GET route for Prometheus: stage and request histograms, SQL counters and the /api/stats numbers
+@app.route("/metrics", methods=['GET'])
+def get_metrics():
+    return Response(api.metrics_text(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == "__main__":
     app.run(debug=True, port=8080)
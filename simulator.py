@@ -0,0 +1,353 @@
+import math
+from datetime import date
+import numpy as np
+import pandas as pd
+from analytics import compute_position_metrics, round2, to_float
+from config import settings
+from metrics import span
+from DataDealer import API_COLUMNS, DEFAULT_ACCOUNT, TradeBatchError, fetch_rows, validate_trade
+
+# What-if simulation for POST /api/simulate. An account's positions are read
+# once into memory and hypothetical trades, target allocations or whole
+# sweeps of scenarios are evaluated against that snapshot. Nothing is
+# written to the database.
+#
+# The trade rules are those of POST /api/positions: Entry opens a position
+# at its price without drawing on CASH, Add moves avg_cost to the weighted
+# average and pays from CASH, Trim and Exit credit CASH with quantity *
+# price. Values, allocations and changes of the result are computed with
+# the same functions as the price refresh, at the snapshot's current
+# prices unless prices are given.
+#
+# Because an Entry adds its value to the portfolio without spending CASH,
+# rebalancing sizes every target from the total after the trades, so the
+# allocations reported afterwards match the targets (up to whole shares),
+# and pnl leaves out the value Entries add.
+SIMULATE_DEFAULTS = {
+    'max_scenarios': 10000,
+}
+
+
+class Snapshot:
+    """An account's positions as numpy columns, with CASH kept apart."""
+
+    def __init__(self, rows: list):
+        positions = [row for row in rows if row.symbol != 'CASH']
+        cash_rows = [row for row in rows if row.symbol == 'CASH']
+        self.cash_row = cash_rows[0]._asdict() if cash_rows else None
+        self.cash = float(self.cash_row['value'] or 0) if self.cash_row else None
+        self.symbols = [row.symbol for row in positions]
+        self.open_dates = [row.open_date for row in positions]
+        self.quantity = to_float([row.quantity for row in positions]).to_numpy()
+        self.avg_cost = to_float([row.avg_cost for row in positions]).to_numpy()
+        self.price = to_float([row.current_price for row in positions]).to_numpy()
+
+    def index(self, symbol: str):
+        try:
+            return self.symbols.index(symbol)
+        except ValueError:
+            return None
+
+    def set_prices(self, prices: dict):
+        """Value held symbols at the given prices instead of their current_price."""
+        for symbol, price in prices.items():
+            position = self.index(symbol)
+            if position is not None:
+                self.price[position] = price
+
+    def rows(self, quantity=None, avg_cost=None, price=None, cash=None, symbols=None, open_dates=None,
+             held=None) -> list:
+        """Positions rows (API_COLUMNS) of this snapshot or of a simulated state of it, refreshed.
+
+        held masks the positions that still exist; by default those with a
+        non-zero quantity.
+        """
+        quantity = self.quantity if quantity is None else quantity
+        avg_cost = self.avg_cost if avg_cost is None else avg_cost
+        price = self.price if price is None else price
+        symbols = self.symbols if symbols is None else symbols
+        open_dates = self.open_dates if open_dates is None else open_dates
+        held = quantity != 0 if held is None else held
+
+        df = pd.DataFrame({
+            'allocation': 0.0,
+            'symbol': np.array(symbols, dtype=object)[held],
+            'quantity': quantity[held],
+            'open_date': np.array(open_dates, dtype=object)[held],
+            'avg_cost': avg_cost[held],
+            'value': 0.0,
+            'current_price': price[held],
+            'change': 0.0,
+        }, columns=list(API_COLUMNS))
+        if self.cash_row is not None:
+            cash_row = dict(self.cash_row, value=self.cash if cash is None else round(cash, 2))
+            df = pd.concat([pd.DataFrame([cash_row], columns=list(API_COLUMNS)), df], ignore_index=True)
+        df = compute_position_metrics(df, {})
+        df['quantity'] = [int(value) if math.isfinite(value) else None for value in to_float(df['quantity'])]
+        return df.to_dict(orient='records')
+
+
+def _prices(prices) -> dict:
+    if prices is None:
+        return {}
+    if not isinstance(prices, dict):
+        raise ValueError("prices must be an object of symbol: price.")
+    for symbol, price in prices.items():
+        if isinstance(price, bool) or not isinstance(price, (int, float)) or not price > 0:
+            raise ValueError(f"Price of {symbol} must be a positive number.")
+    return {symbol: float(price) for symbol, price in prices.items()}
+
+
+def apply_trades(snapshot: Snapshot, trades: list) -> dict:
+    """Apply hypothetical trades in order; TradeBatchError for the first one that would fail."""
+    if not isinstance(trades, list) or not trades:
+        raise ValueError("trades must be a non-empty list.")
+    for index, trade in enumerate(trades):
+        message = validate_trade(trade)
+        if message:
+            raise TradeBatchError(index, message)
+
+    symbols = list(snapshot.symbols)
+    open_dates = list(snapshot.open_dates)
+    quantity = list(snapshot.quantity)
+    avg_cost = list(snapshot.avg_cost)
+    price = list(snapshot.price)
+    removed = [False] * len(symbols)
+    cash = snapshot.cash
+    has_cash = snapshot.cash_row is not None
+    results = []
+
+    for index, trade in enumerate(trades):
+        option = trade['selectedOption']
+        symbol = trade['symbol']
+        trade_price = trade['price']
+        trade_quantity = trade['quantity']
+        position = symbols.index(symbol) if symbol in symbols else None
+        held = position is not None and not removed[position]
+        result = {'index': index, 'selectedOption': option, 'symbol': symbol, 'status': 'success'}
+
+        if option == 'Entry':
+            if held or (symbol == 'CASH' and has_cash):
+                raise TradeBatchError(index, f"Symbol {symbol} already exists in the database.")
+            if symbol == 'CASH':
+                has_cash, cash = True, float(trade_quantity)
+            else:
+                if position is None:
+                    # A new symbol; an exited one reuses its slot
+                    position = len(symbols)
+                    symbols.append(symbol)
+                    open_dates.append(None)
+                    removed.append(False)
+                    quantity.append(0.0)
+                    avg_cost.append(0.0)
+                    price.append(0.0)
+                open_dates[position] = date.today()
+                removed[position] = False
+                quantity[position] = float(trade_quantity)
+                avg_cost[position] = price[position] = float(trade_price)
+            amount = 0
+        elif not held:
+            raise TradeBatchError(index, f"Symbol '{symbol}' not found in the database.")
+        elif option == 'Exit':
+            removed[position] = True
+            amount = trade_quantity * trade_price
+        elif option == 'Add':
+            total_quantity = quantity[position] + trade_quantity
+            total_value = avg_cost[position] * quantity[position] + trade_price * trade_quantity
+            avg_cost[position] = round(total_value / total_quantity if total_quantity != 0 else 0, 2)
+            quantity[position] = total_quantity
+            result['avg_cost'] = avg_cost[position]
+            result['quantity'] = int(total_quantity)
+            amount = -(trade_quantity * trade_price)
+        else:
+            if quantity[position] < trade_quantity:
+                raise TradeBatchError(index, f"Quantity to decrease ({trade_quantity}) exceeds current "
+                                             f"quantity ({int(quantity[position])}).")
+            quantity[position] -= trade_quantity
+            result['quantity'] = int(quantity[position])
+            amount = trade_quantity * trade_price
+
+        if amount:
+            if not has_cash:
+                raise TradeBatchError(index, "CASH position not found in the database.")
+            cash += amount
+        results.append(result)
+
+    rows = snapshot.rows(np.array(quantity, dtype=float), np.array(avg_cost, dtype=float),
+                         np.array(price, dtype=float), cash, symbols, open_dates, ~np.array(removed, dtype=bool))
+    return {'results': results, **_summary(rows)}
+
+
+def _summary(rows: list) -> dict:
+    cash = next((row['value'] for row in rows if row['symbol'] == 'CASH'), None)
+    return {'cash': None if cash is None else round(cash, 2), 'total': round(sum(row['value'] or 0 for row in rows), 2),
+            'positions': rows}
+
+
+def _scenario_matrices(snapshot: Snapshot, scenarios: list, prices: dict) -> tuple:
+    """Stack the targets (percent, NaN = keep) and prices of every scenario into scenarios x symbols arrays.
+
+    Symbols that are not held are priced from the scenario's prices, else from prices.
+    """
+    new_symbols = set()
+    for scenario in scenarios:
+        if not isinstance(scenario, dict):
+            raise ValueError("Every scenario must be an object with targets and/or prices.")
+        targets = scenario.get('targets') or {}
+        if not isinstance(targets, dict):
+            raise ValueError("targets must be an object of symbol: allocation.")
+        if 'CASH' in targets:
+            raise ValueError("CASH cannot have a target; it gets what is left.")
+        new_symbols.update(symbol for symbol in targets if snapshot.index(symbol) is None)
+    symbols = snapshot.symbols + sorted(new_symbols)
+    columns = {symbol: column for column, symbol in enumerate(symbols)}
+
+    target = np.full((len(scenarios), len(symbols)), np.nan)
+    new_prices = [prices.get(symbol, np.nan) for symbol in sorted(new_symbols)]
+    price = np.tile(np.r_[snapshot.price, new_prices], (len(scenarios), 1))
+    for row, scenario in enumerate(scenarios):
+        for symbol, scenario_price in _prices(scenario.get('prices')).items():
+            if symbol in columns:
+                price[row, columns[symbol]] = scenario_price
+        for symbol, allocation in (scenario.get('targets') or {}).items():
+            if isinstance(allocation, bool) or not isinstance(allocation, (int, float)) or allocation < 0:
+                raise ValueError(f"Target allocation of {symbol} must be a non-negative number.")
+            target[row, columns[symbol]] = allocation
+
+    if (np.nansum(target, axis=1) > 100 + 1e-9).any():
+        raise ValueError("Target allocations of a scenario add up to more than 100.")
+    unpriced = ~np.isnan(target) & ~(price > 0)
+    if unpriced.any():
+        symbol = symbols[np.argwhere(unpriced)[0][1]]
+        raise ValueError(f"No price for {symbol}; pass it in prices.")
+    return symbols, target, price
+
+
+def rebalance(quantity: np.ndarray, avg_cost: np.ndarray, price: np.ndarray, target: np.ndarray,
+              cash: float) -> dict:
+    """Trades that bring holdings to target allocations, for many scenarios at once.
+
+    quantity and avg_cost have one entry per symbol; price and target (in
+    percent of the portfolio total, NaN to keep the holding) have one row
+    per scenario. Targets are shares of the total after the trades: Entries
+    (targets for symbols not held) add their value without spending CASH,
+    so that total is the current one divided by 1 - their share. Target
+    quantities are rounded down to whole shares, so no scenario spends more
+    than its targets allow. Returns arrays with one row per scenario.
+    """
+    priced = np.isfinite(price)
+    values = np.where(priced, round2(np.where(priced, quantity * price, 0.0)), 0.0)
+    total = cash + values.sum(axis=1)
+
+    entry_share = np.nansum(np.where(quantity == 0, target, 0.0), axis=1) / 100
+    if (entry_share > 1 - 1e-9).any():
+        raise ValueError("Targets of symbols not held must add up to less than 100, "
+                         "as an Entry does not draw on CASH.")
+    with np.errstate(divide='ignore', invalid='ignore'):
+        target_quantity = np.floor(total[:, None] / (1 - entry_share[:, None]) * target / 100 / price + 1e-9)
+    new_quantity = np.where(np.isnan(target), quantity, target_quantity)
+    delta = new_quantity - quantity
+    traded = delta != 0
+
+    # As in the live API an Entry does not draw on CASH; every other trade moves it
+    entry = (delta > 0) & (quantity == 0)
+    amount = np.where(traded, -delta * np.where(priced, price, 0.0), 0.0)
+    new_cash = cash + np.where(entry, 0.0, amount).sum(axis=1)
+
+    bought = (delta > 0) & ~entry
+    with np.errstate(divide='ignore', invalid='ignore'):
+        added_cost = round2((avg_cost * quantity + price * delta) / new_quantity)
+    new_avg_cost = np.where(entry, price, np.where(bought, added_cost, avg_cost))
+
+    new_values = np.where(priced, round2(np.where(priced, new_quantity * price, 0.0)), 0.0)
+    return {
+        'quantity': new_quantity,
+        'delta': delta,
+        'avg_cost': new_avg_cost,
+        'cash': new_cash,
+        'total': new_cash + new_values.sum(axis=1),
+        'entry_value': np.where(entry, new_values, 0.0).sum(axis=1),
+        'turnover': np.abs(amount).sum(axis=1),
+        'trade_count': traded.sum(axis=1),
+    }
+
+
+def _trade_list(symbols: list, quantity: np.ndarray, delta: np.ndarray, price: np.ndarray) -> list:
+    """Trades of one scenario in POST /api/positions/batch format, sales first so their cash is available."""
+    trades = []
+    for column in np.flatnonzero(delta < 0):
+        option = 'Exit' if quantity[column] + delta[column] == 0 else 'Trim'
+        trades.append({'selectedOption': option, 'symbol': symbols[column], 'price': float(price[column]),
+                       'quantity': int(-delta[column])})
+    for column in np.flatnonzero(delta > 0):
+        option = 'Add' if quantity[column] > 0 else 'Entry'
+        trades.append({'selectedOption': option, 'symbol': symbols[column], 'price': float(price[column]),
+                       'quantity': int(delta[column])})
+    return trades
+
+
+def sweep(snapshot: Snapshot, scenarios: list, prices: dict = None, detail: bool = False) -> list:
+    """Evaluate scenarios of target allocations and/or prices; one summary per scenario.
+
+    pnl is the change from the snapshot's total value from price moves;
+    entry_value is what Entries add to the total without spending CASH.
+    """
+    if not isinstance(scenarios, list) or not scenarios:
+        raise ValueError("scenarios must be a non-empty list.")
+    max_scenarios = settings('simulate', SIMULATE_DEFAULTS)['max_scenarios']
+    if len(scenarios) > max_scenarios:
+        raise ValueError(f"At most {max_scenarios} scenarios can be simulated at once.")
+    symbols, target, price = _scenario_matrices(snapshot, scenarios, prices or {})
+    if snapshot.cash_row is None and not np.isnan(target).all():
+        raise ValueError("CASH position not found in the database.")
+
+    extra = len(symbols) - len(snapshot.symbols)
+    quantity = np.r_[snapshot.quantity, np.zeros(extra)]
+    quantity = np.where(np.isnan(quantity), 0.0, quantity)
+    avg_cost = np.r_[snapshot.avg_cost, np.zeros(extra)]
+    result = rebalance(quantity, avg_cost, price, target, snapshot.cash or 0.0)
+    base_total = (snapshot.cash or 0.0) + round2(np.nan_to_num(snapshot.quantity * snapshot.price)).sum()
+
+    summaries = []
+    for row in range(len(scenarios)):
+        summary = {
+            'total': round(float(result['total'][row]), 2),
+            'pnl': round(float(result['total'][row] - result['entry_value'][row] - base_total), 2),
+            'entry_value': round(float(result['entry_value'][row]), 2),
+            'cash': round(float(result['cash'][row]), 2),
+            'turnover': round(float(result['turnover'][row]), 2),
+            'trade_count': int(result['trade_count'][row]),
+        }
+        if detail:
+            exited = (result['delta'][row] < 0) & (result['quantity'][row] == 0)
+            held = (np.arange(len(symbols)) < len(snapshot.symbols)) & ~exited | (result['delta'][row] > 0)
+            summary['trades'] = _trade_list(symbols, quantity, result['delta'][row], price[row])
+            summary['positions'] = snapshot.rows(
+                result['quantity'][row], result['avg_cost'][row], price[row], float(result['cash'][row]), symbols,
+                snapshot.open_dates + [date.today()] * extra, held)
+        summaries.append(summary)
+    return summaries
+
+
+@span('simulate')
+def simulate(data: dict, account_id: str = DEFAULT_ACCOUNT) -> dict:
+    """Run the simulation described by a POST /api/simulate body against the account's positions.
+
+    The body holds exactly one of trades (applied in order), targets
+    (allocations to rebalance to) or scenarios (a list of targets and/or
+    prices to sweep), and optionally prices to use instead of the current
+    ones.
+    """
+    modes = [mode for mode in ('trades', 'targets', 'scenarios') if data.get(mode) is not None]
+    if len(modes) != 1:
+        raise ValueError("Pass exactly one of trades, targets or scenarios.")
+    snapshot = Snapshot(fetch_rows(account_id))
+    prices = _prices(data.get('prices'))
+    snapshot.set_prices(prices)
+
+    if modes[0] == 'trades':
+        return apply_trades(snapshot, data['trades'])
+    if modes[0] == 'targets':
+        result = sweep(snapshot, [{'targets': data['targets']}], prices, detail=True)[0]
+        return {**result, **_summary(result.pop('positions'))}
+    return {'results': sweep(snapshot, data['scenarios'], prices, detail=bool(data.get('detail', False)))}
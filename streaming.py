@@ -0,0 +1,278 @@
+import asyncio
+import queue
+import select
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+from config import config, settings
+from metrics import log
+from serialization import dumps
+from DataDealer import API_COLUMNS, fetch_page, fetch_rows
+
+# Live updates for GET /api/stream (server-sent events).
+#
+# One listener thread per server process LISTENs on the positions_changed
+# channel (see schema.sql), reads the changed rows of each account once and
+# fans the encoded event out to every client watching that account. Each
+# client has a bounded queue: a client that falls behind loses its queued
+# updates and gets a fresh snapshot instead, so a slow reader never holds
+# up the others.
+#
+# Under server.py every open stream holds a WSGI worker thread for as long
+# as the client stays, so those clients are capped by max_sync_clients,
+# which must stay below the threads of a gunicorn worker. async_server.py
+# awaits the events on its event loop instead and only max_clients applies.
+#
+# Settings come from the optional [stream] section of database.ini.
+STREAM_DEFAULTS = {
+    'queue_size': 64,  # updates buffered per client before it is resynced
+    'heartbeat': 15.0,  # seconds between keep-alive comments on an idle stream
+    'max_clients': 500,
+    'max_sync_clients': 2,  # streams served on server threads (server.py) per process
+    'coalesce': 0.2,  # seconds to collect notifications into one update
+    'retry': 5000,  # milliseconds browsers wait before reconnecting
+}
+
+# Queued in place of updates a slow client missed
+_RESYNC = object()
+
+
+def _frame(event: str, payload) -> bytes:
+    return b'event: ' + event.encode() + b'\ndata: ' + dumps(payload) + b'\n\n'
+
+
+def _snapshot_frame(account_id: str) -> bytes:
+    return _frame('snapshot', {'data': [row._asdict() for row in fetch_rows(account_id)]})
+
+
+class Subscription:
+    """One connected client of an account: a bounded queue of encoded events."""
+
+    holds_thread = True
+
+    def __init__(self, hub, account_id: str, queue_size: int):
+        self.hub = hub
+        self.account_id = account_id
+        self.queue = queue.Queue(maxsize=queue_size)
+
+    def offer(self, frame: bytes) -> bool:
+        """Queue an event; on overflow replace the backlog with a resync. Returns False if it overflowed."""
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except queue.Full:
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.queue.put_nowait(_RESYNC)
+            return False
+
+    def events(self):
+        """Yield the SSE stream: a snapshot first, then updates and heartbeats until the client leaves."""
+        stream_settings = self.hub.settings
+        try:
+            yield f"retry: {stream_settings['retry']}\n\n".encode()
+            yield _snapshot_frame(self.account_id)
+            while True:
+                try:
+                    frame = self.queue.get(timeout=stream_settings['heartbeat'])
+                except queue.Empty:
+                    yield b': heartbeat\n\n'
+                    continue
+                yield _snapshot_frame(self.account_id) if frame is _RESYNC else frame
+        finally:
+            self.hub.unsubscribe(self)
+
+
+class AsyncSubscription(Subscription):
+    """A client of the async server, awaiting its events on the event loop instead of holding a thread."""
+
+    holds_thread = False
+
+    def __init__(self, hub, account_id: str, queue_size: int):
+        self.hub = hub
+        self.account_id = account_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def offer(self, frame: bytes) -> bool:
+        """Queue an event from the listener thread; overflows are counted once the loop has handled them."""
+        try:
+            self.loop.call_soon_threadsafe(self._offer, frame)
+        except RuntimeError:
+            pass  # The event loop has closed
+        return True
+
+    def _offer(self, frame: bytes):
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(_RESYNC)
+            self.hub.count_resyncs(1)
+
+    async def events(self):
+        """Async counterpart of Subscription.events; snapshots are read on a worker thread."""
+        stream_settings = self.hub.settings
+        try:
+            yield f"retry: {stream_settings['retry']}\n\n".encode()
+            yield await asyncio.to_thread(_snapshot_frame, self.account_id)
+            while True:
+                try:
+                    frame = await asyncio.wait_for(self.queue.get(), stream_settings['heartbeat'])
+                except asyncio.TimeoutError:
+                    yield b': heartbeat\n\n'
+                    continue
+                if frame is _RESYNC:
+                    frame = await asyncio.to_thread(_snapshot_frame, self.account_id)
+                yield frame
+        finally:
+            self.hub.unsubscribe(self)
+
+
+class UpdateHub:
+    """Fans position updates out to every subscribed client."""
+
+    def __init__(self):
+        self.settings = settings('stream', STREAM_DEFAULTS)
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._listener = None
+        self._stats = {'events': 0, 'resyncs': 0, 'listener_errors': 0}
+
+    def subscribe(self, account_id: str, asynchronous: bool = False) -> Subscription:
+        """Register a client of an account, an AsyncSubscription when asynchronous.
+
+        Raises RuntimeError when max_clients are already connected, or when
+        a client served on a server thread would exceed max_sync_clients.
+        """
+        with self._lock:
+            if self._client_count() >= self.settings['max_clients']:
+                raise RuntimeError('Too many stream clients.')
+            if not asynchronous and self._client_count(holding_threads=True) >= self.settings['max_sync_clients']:
+                raise RuntimeError('Too many stream clients for the server threads; serve the stream from '
+                                   'async_server.py.')
+            subscription_class = AsyncSubscription if asynchronous else Subscription
+            subscription = subscription_class(self, account_id, self.settings['queue_size'])
+            self._subscribers.setdefault(account_id, set()).add(subscription)
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='positions-listener', daemon=True)
+                self._listener.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.account_id, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self._subscribers.pop(subscription.account_id, None)
+
+    def _client_count(self, holding_threads: bool = False) -> int:
+        return sum(1 for subscribers in self._subscribers.values() for subscription in subscribers
+                   if subscription.holds_thread or not holding_threads)
+
+    def count_resyncs(self, count: int):
+        with self._lock:
+            self._stats['resyncs'] += count
+
+    def accounts(self) -> list:
+        """Accounts with at least one connected client."""
+        with self._lock:
+            return list(self._subscribers)
+
+    def publish(self, frame: bytes, account_id: str = None):
+        """Queue one encoded event for every client of the account (of every account without one)."""
+        with self._lock:
+            if account_id is None:
+                subscribers = [subscription for group in self._subscribers.values() for subscription in group]
+            else:
+                subscribers = list(self._subscribers.get(account_id, ()))
+            self._stats['events'] += 1
+        resyncs = sum(not subscription.offer(frame) for subscription in subscribers)
+        if resyncs:
+            self.count_resyncs(resyncs)
+
+    def publish_changes(self, changes):
+        """Read the changed symbols of each watched account once and publish them as one event per account.
+
+        changes maps account_id to a set of symbols; None means everything changed.
+        """
+        for account_id in self.accounts():
+            if changes is None:
+                self.publish(_snapshot_frame(account_id), account_id)
+                continue
+            symbols = changes.get(account_id)
+            if not symbols:
+                continue
+            rows, _ = fetch_page(symbols=sorted(symbols), fields=list(API_COLUMNS), account_id=account_id)
+            removed = sorted(symbols - {row['symbol'] for row in rows})
+            self.publish(_frame('update', {'rows': rows, 'removed': removed}), account_id)
+
+    def _listen(self):
+        """LISTEN for Positions changes and publish them, reconnecting after errors."""
+        while True:
+            connection = None
+            try:
+                connection = psycopg2.connect(**config())
+                connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with connection.cursor() as crsr:
+                    crsr.execute("LISTEN positions_changed;")
+                log('Listening for position changes...')
+                while True:
+                    if select.select([connection], [], [], 60) == ([], [], []):
+                        continue
+                    # Collect a burst of notifications (e.g. a trade and the
+                    # refresh it triggers) into one update
+                    time.sleep(self.settings['coalesce'])
+                    connection.poll()
+                    changes = {}
+                    for notification in connection.notifies:
+                        if notification.payload == '*':
+                            changes = None
+                            break
+                        for key in notification.payload.split(','):
+                            account_id, symbol = key.split(':', 1)
+                            changes.setdefault(account_id, set()).add(symbol)
+                    connection.notifies.clear()
+                    self.publish_changes(changes)
+            except (Exception, psycopg2.DatabaseError) as error:
+                print(f"Error in position listener: {error}")
+                with self._lock:
+                    self._stats['listener_errors'] += 1
+                time.sleep(5)
+                # Updates may have been missed while disconnected
+                self.publish(_RESYNC)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['clients'] = self._client_count()
+            stats['sync_clients'] = self._client_count(holding_threads=True)
+            stats['accounts'] = len(self._subscribers)
+        return stats
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub() -> UpdateHub:
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                _hub = UpdateHub()
+    return _hub
+
+
+def get_stream_stats() -> dict:
+    if _hub is None:
+        return {'clients': 0}
+    return _hub.stats()
@@ -0,0 +1,118 @@
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from analytics import (changed_mask, compute_allocations, compute_changes, compute_position_metrics,
+                       compute_values, replay_trades, round2)
+
+
+def decimals(rng, low: int, high: int, rows: int) -> list:
+    return [Decimal(cents) / 100 for cents in rng.integers(low * 100, high * 100, rows).tolist()]
+
+
+def test_round2_matches_round():
+    values = [0.125, 0.135, 2.675, -1.005, 1234.5650000001, float('nan')]
+    expected = [round(value, 2) for value in values]
+    np.testing.assert_array_equal(round2(values), expected)
+
+
+def test_change_of_a_decimal_tie_rounds_half_even():
+    # (7.04 - 373.78) / 7.04 * 100 is exactly -5209.375
+    expected = round((Decimal('7.04') - Decimal('373.78')) / Decimal('7.04') * 100, 2)
+    assert expected == Decimal('-5209.38')
+    changes = compute_changes([Decimal('7.04')], [Decimal('373.78')], [None])
+    assert changes.tolist() == [float(expected)]
+    # A fetched price arrives as a float and is stored as its repr
+    assert compute_changes([7.04], [Decimal('373.78')], [None]).tolist() == [float(expected)]
+
+
+def test_value_of_a_decimal_tie_rounds_half_even():
+    # The float nearest 2.675 is below it, the Decimal is not
+    values = compute_values(['X', 'CASH'], [1, None], [Decimal('2.675'), None], [None, Decimal('100')])
+    assert values.tolist() == [2.68, 100.0]
+
+
+def test_matches_decimal_formulas():
+    rng = np.random.default_rng(1)
+    rows = 5000
+    quantity = rng.integers(1, 1000, rows).tolist()
+    price = decimals(rng, 1, 50, rows)
+    avg_cost = decimals(rng, 1, 500, rows)
+    value = decimals(rng, 0, 1000, rows)
+
+    values = compute_values([f'S{i}' for i in range(rows)], quantity, price, [None] * rows)
+    assert values.tolist() == [float(round(q * p, 2)) for q, p in zip(quantity, price)]
+
+    total = sum(value)
+    allocations = compute_allocations(value, [None] * rows)
+    assert allocations.tolist() == [float(round(v / total * 100, 2)) for v in value]
+
+    changes = compute_changes(price, avg_cost, [None] * rows)
+    assert changes.tolist() == [float(round((p - c) / p * 100, 2)) for p, c in zip(price, avg_cost)]
+
+
+def test_allocations_per_account():
+    allocations = compute_allocations([Decimal(1), Decimal(3), Decimal(5), None], [0, 0, 0, 7], ['a', 'a', 'b', 'b'])
+    assert allocations.tolist() == [25.0, 75.0, 100.0, 7.0]
+
+
+def test_allocations_keep_old_values_without_a_positive_total():
+    assert compute_allocations([0, 0], [1.5, 2.5]).tolist() == [1.5, 2.5]
+
+
+def test_changes_skip_missing_and_zero_prices():
+    changes = compute_changes([None, Decimal(0), Decimal(10)], [Decimal(5), Decimal(5), None], [1.0, 2.0, 3.0])
+    assert changes.tolist() == [1.0, 2.0, 3.0]
+
+
+def test_changed_mask():
+    mask = changed_mask([Decimal('1.00'), None, Decimal('2.5'), None], [1.001, None, 2.51, 0.0])
+    assert mask.tolist() == [False, False, True, True]
+
+
+def test_compute_position_metrics():
+    df = pd.DataFrame({
+        'account_id': ['a', 'a', 'a'],
+        'symbol': ['CASH', 'AAPL', 'MSFT'],
+        'quantity': [None, 10, 5],
+        'avg_cost': [None, Decimal('100'), Decimal('200')],
+        'current_price': [None, Decimal('100'), Decimal('250')],
+        'value': [Decimal('750'), None, None],
+        'allocation': [None, None, None],
+        'change': [None, None, None],
+    })
+    result = compute_position_metrics(df, {'AAPL': 125.0})
+    assert result['current_price'].tolist() == [None, 125.0, 250.0]
+    assert result['value'].tolist() == [750.0, 1250.0, 1250.0]
+    assert result['allocation'].tolist() == [23.08, 38.46, 38.46]
+    assert result['change'].tolist() == [None, 20.0, 20.0]
+    assert df['value'].tolist() == [Decimal('750'), None, None]
+
+
+def test_replay_trades():
+    ledger = [
+        ('CASH', 'Entry', 10000, 1),
+        ('AAPL', 'Entry', 10, 100),
+        ('AAPL', 'Add', 10, 110),
+        ('AAPL', 'Trim', 5, 120),
+        ('MSFT', 'Entry', 5, 200),
+        ('MSFT', 'Exit', 5, 210),
+        ('NVDA', 'Entry', 1, 50),
+        ('NVDA', 'Exit', 1, 55),
+        ('NVDA', 'Entry', 2, 60),
+        ('AMD', 'Entry', 10, 10),
+        ('AMD', 'Trim', 10, 12),
+        ('AMD', 'Add', 5, 20),
+    ]
+    trades = pd.DataFrame(ledger, columns=['symbol', 'action', 'quantity', 'price'])
+    trades['executed_at'] = pd.date_range('2024-01-01', periods=len(ledger), freq='D')
+
+    positions = replay_trades(trades).set_index('symbol')
+    assert sorted(positions.index) == ['AAPL', 'AMD', 'CASH', 'NVDA']
+    assert positions.loc['CASH', 'value'] == 10000 - 1100 + 600 + 1050 + 55 + 120 - 100
+    assert (positions.loc['AAPL', 'quantity'], positions.loc['AAPL', 'avg_cost']) == (15, 105)
+    # A Trim down to zero wipes the cost basis, an Exit starts a new lot
+    assert (positions.loc['AMD', 'quantity'], positions.loc['AMD', 'avg_cost']) == (5, 20)
+    assert (positions.loc['NVDA', 'quantity'], positions.loc['NVDA', 'avg_cost']) == (2, 60)
+    assert positions.loc['NVDA', 'open_date'] == pd.Timestamp('2024-01-09')
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import api
+from DataDealer import TradeBatchError
+
+
+def test_get_account_prefers_the_query_then_the_body():
+    assert api.get_account(MultiDict({'account': 'a1'}), {'account': 'b2'}) == 'a1'
+    assert api.get_account(MultiDict(), {'account': 'b2'}) == 'b2'
+    assert api.get_account(MultiDict()) == 'default'
+    with pytest.raises(ValueError):
+        api.get_account(MultiDict({'account': 'bad!'}))
+
+
+def test_page_query():
+    args = MultiDict({'limit': '10', 'sort': '-value', 'symbol': 'AAPL,,MSFT', 'fields': 'symbol,value'})
+    assert api.wants_page(args)
+    assert api.page_query(args) == {'limit': 10, 'cursor': None, 'sort': 'value', 'descending': True,
+                                    'symbols': ['AAPL', 'MSFT'], 'fields': ['symbol', 'value']}
+    assert not api.wants_page(MultiDict({'account': 'a1'}))
+
+
+@pytest.mark.parametrize('limit', ['abc', '', '0', '-3', '1.5', str(api.MAX_PAGE_SIZE + 1)])
+def test_page_query_rejects_bad_limits(limit):
+    with pytest.raises(ValueError, match='limit must be an integer'):
+        api.page_query(MultiDict({'limit': limit}))
+
+
+def test_batch_helpers():
+    trades = [{'selectedOption': 'Add', 'symbol': 'AAPL', 'price': 10, 'quantity': 1}, {'selectedOption': 'Nope'}]
+    assert api.batch_trades({'trades': trades}) == api.batch_trades(trades) == trades
+    with pytest.raises(ValueError):
+        api.batch_trades({'trades': []})
+    assert [error['index'] for error in api.invalid_trades(trades)['results']] == [1]
+    assert api.invalid_trades(trades[:1]) is None
+
+    body = api.batch_error(TradeBatchError(1, 'too many'), 3)
+    assert body['results'] == [{'index': 0, 'status': 'rolled_back'},
+                               {'index': 1, 'status': 'error', 'message': 'too many'},
+                               {'index': 2, 'status': 'rolled_back'}]
+
+
+def test_history_query_defaults_and_utc():
+    query = api.history_query(MultiDict({'end': '2024-03-01T12:00', 'points': '50'}))
+    assert query['end'] == datetime(2024, 3, 1, 12, tzinfo=timezone.utc)
+    assert query['start'] == query['end'] - timedelta(days=30)
+    assert (query['method'], query['points'], query['field']) == ('lttb', 50, 'value')
+
+
+@pytest.mark.parametrize('args, message', [
+    ({'points': 'abc'}, 'points must be a whole number'),
+    ({'points': '2'}, 'points at least 3'),
+    ({'method': 'x'}, 'method must be'),
+    ({'start': 'garbage'}, 'start must be an ISO 8601 timestamp'),
+    ({'end': '2024-13-01'}, 'end must be an ISO 8601 timestamp'),
+])
+def test_history_query_rejects_bad_parameters(args, message):
+    with pytest.raises(ValueError, match=message):
+        api.history_query(MultiDict(args))
+
+
+def test_export_request_parses_times_as_utc():
+    export = api.export_request(MultiDict({'dataset': 'trades', 'format': 'arrow', 'start': '2024-01-01'}))
+    assert export['start'] == datetime(2024, 1, 1, tzinfo=timezone.utc) and export['end'] is None
+    assert api.export_filename(export) == 'trades.arrows'
+    with pytest.raises(ValueError, match='end must be an ISO 8601 timestamp'):
+        api.export_request(MultiDict({'end': 'yesterday'}))
+
+
+def test_risk_query():
+    assert api.risk_query(MultiDict({'lookback': '60', 'confidence': '0.99'})) == \
+        {'lookback': 60, 'confidence': 0.99, 'benchmark': None}
+    with pytest.raises(ValueError, match='lookback must be a whole number'):
+        api.risk_query(MultiDict({'lookback': '6o'}))
+    with pytest.raises(ValueError, match='confidence must be a number'):
+        api.risk_query(MultiDict({'confidence': 'high'}))
@@ -0,0 +1,114 @@
+import threading
+import time
+from decimal import Decimal
+
+import psycopg2
+import pytest
+
+import DataDealer
+import quotes
+from config import config
+
+# These tests need the PostgreSQL database of database.ini in the working
+# directory and are skipped without one. They work on an account of their
+# own, which is removed afterwards.
+ACCOUNT = 'test-concurrency'
+
+
+@pytest.fixture
+def account(monkeypatch):
+    try:
+        connection = psycopg2.connect(**config())
+    except Exception as error:
+        pytest.skip(f"no database: {error}")
+    connection.autocommit = True
+    DataDealer.release_db(DataDealer.connect_db())  # applies schema.sql
+
+    def clean():
+        with connection.cursor() as crsr:
+            for table in ('Positions', 'trades', 'position_snapshots'):
+                crsr.execute(f"DELETE FROM {table} WHERE account_id = %s;", (ACCOUNT,))
+
+    clean()
+    with connection.cursor() as crsr:
+        crsr.execute("""
+            INSERT INTO Positions (account_id, symbol, quantity, open_date, avg_cost, value, current_price,
+                                   allocation, change)
+            VALUES (%s, 'CASH', 0, '2024-01-01', 1, 1000, 0, 0, 0),
+                   (%s, 'RACEA', 10, '2024-01-01', 100, 1000, 100, 0, 0),
+                   (%s, 'RACEB', 10, '2024-01-01', 100, 1000, 100, 0, 0);
+        """, (ACCOUNT, ACCOUNT, ACCOUNT))
+    # A fresh quote cache, so every refresh asks the provider
+    monkeypatch.setattr(quotes, '_cache', None)
+    yield connection
+    clean()
+    connection.close()
+
+
+def cash(connection) -> Decimal:
+    with connection.cursor() as crsr:
+        crsr.execute("SELECT value FROM Positions WHERE account_id = %s AND symbol = 'CASH';", (ACCOUNT,))
+        return crsr.fetchone()[0]
+
+
+def start_refresh() -> tuple:
+    errors = []
+
+    def run():
+        try:
+            DataDealer.refresh_positions(ACCOUNT)
+        except Exception as error:
+            errors.append(error)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, errors
+
+
+def test_trade_committed_during_a_refresh_keeps_its_cash(account, monkeypatch):
+    fetching, release = threading.Event(), threading.Event()
+
+    def provider(ticker):
+        fetching.set()
+        release.wait(10)
+        return 120.0
+
+    monkeypatch.setattr(quotes, '_provider', provider)
+    refresh, errors = start_refresh()
+    # The refresh has read CASH and waits for prices when the trade commits
+    assert fetching.wait(10)
+    DataDealer.execute_trade({'selectedOption': 'Add', 'symbol': 'RACEA', 'price': 100, 'quantity': 2}, ACCOUNT)
+    release.set()
+    refresh.join(10)
+
+    assert not refresh.is_alive() and errors == []
+    assert cash(account) == Decimal('800')
+
+
+def test_refresh_waits_for_a_trade_without_deadlocking(account, monkeypatch):
+    monkeypatch.setattr(quotes, '_provider', lambda ticker: 130.0)
+    trade = psycopg2.connect(**config())
+    try:
+        with trade.cursor() as crsr:
+            crsr.execute("SET lock_timeout = '10s';")
+            # A trade's transaction locks its symbol first, then CASH
+            crsr.execute("SELECT 1 FROM Positions WHERE account_id = %s AND symbol = 'RACEB' FOR UPDATE;", (ACCOUNT,))
+            refresh, errors = start_refresh()
+            deadline = time.monotonic() + 10
+            while not _waiting_for_lock(account) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            crsr.execute("UPDATE Positions SET value = value - 10 WHERE account_id = %s AND symbol = 'CASH';",
+                         (ACCOUNT,))
+        trade.commit()
+    finally:
+        trade.close()
+    refresh.join(10)
+
+    assert not refresh.is_alive() and errors == []
+    assert cash(account) == Decimal('990')
+
+
+def _waiting_for_lock(connection) -> bool:
+    with connection.cursor() as crsr:
+        crsr.execute("SELECT count(*) FROM pg_stat_activity WHERE wait_event_type = 'Lock';")
+        return crsr.fetchone()[0] > 0
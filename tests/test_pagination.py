@@ -0,0 +1,84 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+import DataDealer
+from DataDealer import _decode_cursor, _encode_cursor, fetch_page
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def execute(self, query, params=None):
+        self.queries.append((query, params))
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.crsr = FakeCursor(rows)
+
+    def cursor(self):
+        return self.crsr
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    connection = FakeConnection([])
+    monkeypatch.setattr(DataDealer, 'connect_db', lambda: connection)
+    monkeypatch.setattr(DataDealer, 'release_db', lambda connection: None)
+    return connection
+
+
+def test_cursor_round_trip():
+    assert _decode_cursor(_encode_cursor([Decimal('12.50'), 'AAPL'])) == ('12.50', 'AAPL')
+    assert _decode_cursor(_encode_cursor([None, 'MSFT'])) == (None, 'MSFT')
+    assert _decode_cursor(_encode_cursor([date(2024, 1, 2), 'NVDA'])) == ('2024-01-02', 'NVDA')
+
+
+@pytest.mark.parametrize('cursor', ['not base64!', _encode_cursor(['only one value']), _encode_cursor(42)])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        _decode_cursor(cursor)
+
+
+def test_first_page_sets_next_cursor(connection):
+    connection.crsr.rows = [(Decimal('30'), 'A'), (Decimal('20'), 'B'), (Decimal('10'), 'C')]
+    data, next_cursor = fetch_page(2, sort='value', descending=True, fields=['value'], account_id='acct')
+
+    query, params = connection.crsr.queries[0]
+    assert query.endswith("ORDER BY value IS NULL, value DESC, symbol DESC LIMIT %s;")
+    assert params == ['acct', 3]
+    assert data == [{'value': Decimal('30')}, {'value': Decimal('20')}]
+    assert _decode_cursor(next_cursor) == ('20', 'B')
+
+
+def test_next_page_continues_after_the_cursor(connection):
+    connection.crsr.rows = [(Decimal('10'), 'C')]
+    data, next_cursor = fetch_page(2, _encode_cursor(['20', 'B']), 'value', True, ['C', 'D'], ['value'], 'acct')
+
+    query, params = connection.crsr.queries[0]
+    assert "symbol = ANY(%s)" in query
+    assert "(value IS NULL OR (value, symbol) < (%s, %s))" in query
+    assert params == ['acct', ['C', 'D'], '20', 'B', 3]
+    assert data == [{'value': Decimal('10')}]
+    assert next_cursor is None
+
+
+def test_cursor_into_null_sort_values(connection):
+    fetch_page(2, _encode_cursor([None, 'B']), 'change', account_id='acct')
+    query, params = connection.crsr.queries[0]
+    assert "change IS NULL AND symbol > %s" in query
+    assert params == ['acct', 'B', 3]
+
+
+def test_unknown_sort_or_field():
+    with pytest.raises(ValueError):
+        fetch_page(sort='account_id')
+    with pytest.raises(ValueError):
+        fetch_page(fields=['symbol', 'password'])
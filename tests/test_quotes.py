@@ -0,0 +1,147 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import quotes
+from quotes import QUOTE_DEFAULTS, QuoteCache
+
+
+@pytest.fixture
+def quote_settings(monkeypatch):
+    # Short timeouts and a fresh cache; every test passes its own stub provider
+    quote_settings = dict(QUOTE_DEFAULTS, ticker_timeout=0.1, total_timeout=1.0)
+    monkeypatch.setattr(quotes, '_settings', quote_settings)
+    monkeypatch.setattr(quotes, '_cache', None)
+    monkeypatch.setattr(quotes, '_threads_skipped', 0)
+    return quote_settings
+
+
+class Clock:
+    """Stand-in for time.monotonic that only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(quotes, 'time', SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_hung_calls_are_capped(quote_settings):
+    quote_settings.update(max_workers=2, max_threads=2)
+    release = threading.Event()
+    calls = []
+
+    def hung(ticker):
+        calls.append(ticker)
+        release.wait(5)
+        return 1.0
+
+    try:
+        assert quotes.fetch_prices(['A', 'B'], hung) == {'A': None, 'B': None}
+        # Both calls are still running: C gets its last known price without a call
+        assert quotes.fetch_prices(['C'], hung) == {'C': None}
+        assert calls == ['A', 'B']
+        stats = quotes.get_cache_stats()
+        assert (stats['threads_running'], stats['threads_skipped']) == (2, 1)
+    finally:
+        release.set()
+    wait_for(lambda: quotes.get_cache_stats()['threads_running'] == 0)
+    # The abandoned calls still refreshed the cache when they returned
+    assert quotes._get_cache().last_known('A') == 1.0
+    assert quotes.fetch_prices(['C'], lambda ticker: 3.0) == {'C': 3.0}
+
+
+def test_cache_entries_go_from_fresh_to_stale_to_missing(clock):
+    cache = QuoteCache(ttl=10, stale_ttl=20, max_size=10)
+    cache.store('A', 1.0)
+    clock.now += 5
+    assert cache.lookup(['A', 'B']) == ({'A': 1.0}, {}, ['B'])
+    clock.now += 10
+    assert cache.lookup(['A']) == ({}, {'A': 1.0}, [])
+    clock.now += 20
+    assert cache.lookup(['A']) == ({}, {}, ['A'])
+    # Too old to serve, still good enough as a fallback
+    assert cache.last_known('A') == 1.0
+    stats = cache.stats()
+    assert (stats['hits'], stats['stale_hits'], stats['misses']) == (1, 1, 2)
+
+
+def test_cache_evicts_the_least_recently_used_ticker(clock):
+    cache = QuoteCache(ttl=10, stale_ttl=20, max_size=2)
+    cache.store('A', 1.0)
+    cache.store('B', 2.0)
+    cache.lookup(['A'])
+    cache.store('C', 3.0)
+    assert (cache.last_known('A'), cache.last_known('B'), cache.last_known('C')) == (1.0, None, 3.0)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_get_prices_serves_stale_prices_while_one_refresh_runs(quote_settings, clock, monkeypatch):
+    quote_settings.update(cache_ttl=10, stale_ttl=100, ticker_timeout=5.0, total_timeout=5.0)
+    release = threading.Event()
+    calls = []
+
+    def provider(ticker):
+        calls.append(ticker)
+        if len(calls) > 1:
+            release.wait(5)
+        return float(len(calls))
+
+    monkeypatch.setattr(quotes, '_provider', provider)
+    assert quotes.get_prices(['A', 'CASH']) == {'A': 1.0}
+    assert quotes.get_prices(['A']) == {'A': 1.0} and calls == ['A']
+
+    clock.now += 20
+    try:
+        # Stale: served at once, refreshed in the background, and only once
+        assert quotes.get_prices(['A']) == {'A': 1.0}
+        assert quotes.get_prices(['A']) == {'A': 1.0}
+        wait_for(lambda: calls == ['A', 'A'])
+        assert quotes._refreshing == {'A'}
+    finally:
+        release.set()
+    wait_for(lambda: not quotes._refreshing)
+    assert quotes.get_prices(['A']) == {'A': 2.0} and calls == ['A', 'A']
+    assert quotes.get_cache_stats()['refreshes'] == 1
+
+
+def test_timeouts_fall_back_to_the_last_known_price(quote_settings):
+    quotes._get_cache().store('A', 5.0)
+    release = threading.Event()
+
+    def provider(ticker):
+        if ticker == 'C':
+            raise RuntimeError('no quote')
+        release.wait(5)
+        return 6.0
+
+    try:
+        # A and B time out, C fails
+        assert quotes.fetch_prices(['A', 'B', 'C'], provider) == {'A': 5.0, 'B': None, 'C': None}
+    finally:
+        release.set()
+
+
+def test_cache_ttl_zero_always_fetches(quote_settings, monkeypatch):
+    quote_settings.update(cache_ttl=0)
+    calls = []
+    monkeypatch.setattr(quotes, '_provider', lambda ticker: calls.append(ticker) or 1.0)
+    quotes.get_prices(['A'])
+    quotes.get_prices(['A'])
+    assert calls == ['A', 'A']
@@ -0,0 +1,95 @@
+import math
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from risk import BAR_DTYPE, PriceHistoryCache, StubHistoryProvider, align_closes, compute_risk
+
+
+class RecordingProvider(StubHistoryProvider):
+    """StubHistoryProvider that also records every requested range."""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    def __call__(self, symbol, start, end):
+        self.requests.append((symbol, start, end))
+        return super().__call__(symbol, start, end)
+
+
+def make_bars(days: list, closes: list) -> np.ndarray:
+    bars = np.zeros(len(days), dtype=BAR_DTYPE)
+    bars['day'] = np.array(days, dtype='datetime64[D]')
+    bars['close'] = closes
+    bars['adjclose'] = np.nan
+    return bars
+
+
+def test_cache_only_fetches_missing_days(tmp_path):
+    provider = RecordingProvider()
+    cache = PriceHistoryCache(str(tmp_path), provider)
+    start, end = date(2024, 1, 1), date(2024, 3, 29)
+
+    first, errors = cache.bars(['AAA', 'SPY'], start, end, today=end + timedelta(days=1))
+    assert errors == {} and provider.calls == 2
+
+    # A warm cache makes no provider calls
+    second, _ = cache.bars(['AAA', 'SPY'], start, end, today=end + timedelta(days=1))
+    assert provider.calls == 2
+    assert all(np.array_equal(first[symbol], second[symbol]) for symbol in first)
+
+    # A later day only fetches the days after the cached ones
+    later = end + timedelta(days=7)
+    third, _ = cache.bars(['AAA'], start + timedelta(days=7), later, today=later + timedelta(days=1))
+    assert provider.requests[2:] == [('AAA', end + timedelta(days=1), later)]
+
+    # ... and agrees with a cold fetch of the whole range
+    cold, _ = PriceHistoryCache(str(tmp_path / 'cold'), StubHistoryProvider()).bars(
+        ['AAA'], start + timedelta(days=7), later, today=later + timedelta(days=1))
+    assert np.array_equal(third['AAA'], cold['AAA'])
+
+
+def test_today_is_fetched_again(tmp_path):
+    provider = RecordingProvider()
+    cache = PriceHistoryCache(str(tmp_path), provider)
+    today = date(2024, 3, 29)
+    cache.bars(['AAA'], date(2024, 3, 1), today, today=today)
+    cache.bars(['AAA'], date(2024, 3, 1), today, today=today)
+    # Today's bar is not final, so only it is requested again
+    assert provider.requests[1:] == [('AAA', today, today)]
+
+
+def test_align_closes_forward_fills_and_drops_incomplete_days():
+    days = ['2024-01-01', '2024-01-02', '2024-01-03', '2024-01-04']
+    bars = {
+        'A': make_bars(days, [10.0, 11.0, 12.0, 13.0]),
+        'B': make_bars([days[0], days[2], days[3]], [20.0, 22.0, 23.0]),
+        'C': make_bars(days[1:], [30.0, np.nan, 33.0]),
+    }
+    bars['A']['adjclose'] = [5.0, 5.5, 6.0, 6.5]
+
+    aligned_days, closes = align_closes(bars, ['A', 'B', 'C'])
+
+    # C has no price on the first day; B's missing day and C's NaN carry the last price forward
+    assert aligned_days.tolist() == np.array(days[1:], dtype='datetime64[D]').tolist()
+    assert closes.tolist() == [[5.5, 20.0, 30.0], [6.0, 22.0, 30.0], [6.5, 23.0, 33.0]]
+
+
+def test_compute_risk_on_a_known_matrix():
+    closes = np.array([[100.0, 50.0], [110.0, 50.0], [99.0, 55.0]])
+    benchmark = closes[:, 0]
+    risk = compute_risk(closes, benchmark, np.array([1000.0, 500.0]), 2000.0, 0.5)
+
+    assert risk['weight'].tolist() == [0.5, 0.25]
+    assert risk['volatility'] == pytest.approx([math.sqrt(0.02) * math.sqrt(252), math.sqrt(0.005) * math.sqrt(252)])
+    assert risk['beta'] == pytest.approx([1.0, -0.5])
+    assert risk['max_drawdown'] == pytest.approx([-0.1, 0.0])
+    assert risk['correlation'] == pytest.approx(np.array([[1.0, -1.0], [-1.0, 1.0]]))
+    # Portfolio returns are 0.05 and -0.025
+    portfolio = risk['portfolio']
+    assert portfolio['beta'] == pytest.approx(0.375)
+    assert portfolio['max_drawdown'] == pytest.approx(1.02375 / 1.05 - 1)
+    assert portfolio['var'] == pytest.approx(-0.0125)
+    assert portfolio['var_amount'] == pytest.approx(-25.0)
@@ -0,0 +1,89 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from DataDealer import Position, TradeBatchError
+from simulator import Snapshot, apply_trades, sweep
+
+
+def make_snapshot() -> Snapshot:
+    return Snapshot([
+        Position(None, 'CASH', None, date(2024, 1, 1), None, Decimal('1000'), None, None),
+        Position(None, 'AAPL', 10, date(2024, 1, 1), Decimal('100'), None, Decimal('150'), None),
+        Position(None, 'MSFT', 5, date(2024, 1, 1), Decimal('200'), None, Decimal('200'), None),
+    ])
+
+
+def by_symbol(positions: list) -> dict:
+    return {row['symbol']: row for row in positions}
+
+
+def test_apply_trades_follows_the_trade_rules():
+    result = apply_trades(make_snapshot(), [
+        {'selectedOption': 'Trim', 'symbol': 'MSFT', 'price': 210, 'quantity': 2},
+        {'selectedOption': 'Add', 'symbol': 'AAPL', 'price': 150, 'quantity': 5},
+        {'selectedOption': 'Entry', 'symbol': 'NVDA', 'price': 100, 'quantity': 3},
+    ])
+    positions = by_symbol(result['positions'])
+
+    assert [trade['status'] for trade in result['results']] == ['success'] * 3
+    # Trim credits CASH, Add pays from it, Entry does not touch it
+    assert result['cash'] == 1000 + 420 - 750
+    assert (positions['AAPL']['quantity'], positions['AAPL']['avg_cost']) == (15, 116.67)
+    assert positions['MSFT']['quantity'] == 3
+    assert (positions['NVDA']['quantity'], positions['NVDA']['value']) == (3, 300.0)
+    assert result['total'] == 670 + 2250 + 600 + 300
+    assert sum(row['allocation'] for row in result['positions']) == pytest.approx(100, abs=0.05)
+
+
+def test_apply_trades_exit_removes_the_position():
+    result = apply_trades(make_snapshot(), [{'selectedOption': 'Exit', 'symbol': 'MSFT', 'price': 200, 'quantity': 5}])
+    assert sorted(by_symbol(result['positions'])) == ['AAPL', 'CASH']
+    assert result['cash'] == 2000
+
+
+@pytest.mark.parametrize('trades, index', [
+    ([{'selectedOption': 'Trim', 'symbol': 'AAPL', 'price': 150, 'quantity': 11}], 0),
+    ([{'selectedOption': 'Exit', 'symbol': 'MSFT', 'price': 200, 'quantity': 5},
+      {'selectedOption': 'Add', 'symbol': 'MSFT', 'price': 200, 'quantity': 1}], 1),
+    ([{'selectedOption': 'Entry', 'symbol': 'AAPL', 'price': 150, 'quantity': 1}], 0),
+    ([{'selectedOption': 'Add', 'symbol': 'AAPL', 'price': 150, 'quantity': 1.5}], 0),
+])
+def test_apply_trades_reports_the_failing_trade(trades, index):
+    with pytest.raises(TradeBatchError) as error:
+        apply_trades(make_snapshot(), trades)
+    assert error.value.index == index
+
+
+def test_sweep_price_scenario():
+    [summary] = sweep(make_snapshot(), [{'prices': {'AAPL': 160}}])
+    assert summary == {'total': 3600.0, 'pnl': 100.0, 'entry_value': 0.0, 'cash': 1000.0, 'turnover': 0.0,
+                       'trade_count': 0}
+
+
+def test_sweep_targets_buy_whole_shares_from_cash():
+    [summary] = sweep(make_snapshot(), [{'targets': {'AAPL': 50}}], detail=True)
+    # 50% of 3500 is 1750, or 11 whole shares at 150
+    assert summary['trades'] == [{'selectedOption': 'Add', 'symbol': 'AAPL', 'price': 150.0, 'quantity': 1}]
+    assert (summary['cash'], summary['total'], summary['pnl']) == (850.0, 3500.0, 0.0)
+    assert by_symbol(summary['positions'])['AAPL']['allocation'] == 47.14
+
+
+def test_sweep_rejects_targets_over_100():
+    with pytest.raises(ValueError, match='more than 100'):
+        sweep(make_snapshot(), [{'targets': {'AAPL': 60, 'MSFT': 50}}])
+
+
+def test_sweep_targets_with_an_entry_match_the_allocations():
+    [summary] = sweep(make_snapshot(), [{'targets': {'MSFT': 20, 'NVDA': 30}, 'prices': {'NVDA': 100}}], detail=True)
+    # The Entry adds 1500 without spending CASH, so 3500 becomes 5000
+    assert summary['trades'] == [{'selectedOption': 'Entry', 'symbol': 'NVDA', 'price': 100.0, 'quantity': 15}]
+    assert (summary['total'], summary['pnl'], summary['entry_value']) == (5000.0, 0.0, 1500.0)
+    positions = by_symbol(summary['positions'])
+    assert (positions['MSFT']['allocation'], positions['NVDA']['allocation']) == (20.0, 30.0)
+
+
+def test_sweep_rejects_entries_of_100():
+    with pytest.raises(ValueError, match='symbols not held'):
+        sweep(make_snapshot(), [{'targets': {'NVDA': 100}, 'prices': {'NVDA': 100}}])
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+import streaming
+from streaming import _RESYNC, AsyncSubscription, Subscription, UpdateHub
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    # No LISTEN connection: events are published by hand
+    monkeypatch.setattr(UpdateHub, '_listen', lambda self: None)
+    hub = UpdateHub()
+    hub.settings = dict(hub.settings, max_clients=3, max_sync_clients=1, queue_size=2)
+    return hub
+
+
+def test_thread_clients_are_capped_separately(hub):
+    async def main():
+        assert isinstance(hub.subscribe('a'), Subscription)
+        with pytest.raises(RuntimeError, match='async_server'):
+            hub.subscribe('a')
+        assert isinstance(hub.subscribe('a', asynchronous=True), AsyncSubscription)
+        hub.subscribe('b', asynchronous=True)
+        with pytest.raises(RuntimeError, match='Too many stream clients.'):
+            hub.subscribe('b', asynchronous=True)
+        assert (hub.stats()['clients'], hub.stats()['sync_clients']) == (3, 1)
+
+    asyncio.run(main())
+
+
+def test_async_client_is_resynced_when_it_falls_behind(hub):
+    async def main():
+        subscription = hub.subscribe('a', asynchronous=True)
+        for frame in (b'1', b'2', b'3'):
+            hub.publish(frame, 'a')
+        await asyncio.sleep(0)
+        assert subscription.queue.qsize() == 1 and subscription.queue.get_nowait() is _RESYNC
+        assert hub.stats()['resyncs'] == 1
+
+    asyncio.run(main())
+
+
+def test_async_events(hub, monkeypatch):
+    monkeypatch.setattr(streaming, '_snapshot_frame', lambda account_id: b'snapshot ' + account_id.encode())
+
+    async def main():
+        subscription = hub.subscribe('a', asynchronous=True)
+        events = subscription.events()
+        assert (await events.__anext__()).startswith(b'retry:')
+        assert await events.__anext__() == b'snapshot a'
+        hub.publish(b'update', 'a')
+        hub.publish(b'other account', 'b')
+        assert await events.__anext__() == b'update'
+        await events.aclose()
+        assert hub.stats()['clients'] == 0
+
+    asyncio.run(main())
@@ -0,0 +1,41 @@
+import numpy as np
+
+from timeseries import lttb, ohlc
+
+
+def test_lttb_keeps_ends_and_peaks():
+    times = np.arange(1000)
+    values = np.zeros(1000)
+    values[377] = 50.0
+    values[800] = -20.0
+    sampled_times, sampled_values = lttb(times, values, 20)
+
+    assert len(sampled_times) == 20
+    assert (sampled_times[0], sampled_times[-1]) == (0, 999)
+    assert np.all(np.diff(sampled_times) > 0)
+    assert 377 in sampled_times and 800 in sampled_times
+    np.testing.assert_array_equal(sampled_values, values[sampled_times.astype(int)])
+
+
+def test_lttb_returns_short_series_unchanged():
+    times, values = lttb([1, 2, 3], [4, 5, 6], 10)
+    assert times.tolist() == [1, 2, 3] and values.tolist() == [4, 5, 6]
+
+
+def test_ohlc():
+    times = np.arange(10)
+    values = np.array([5, 7, 3, 4, 6, 2, 8, 9, 1, 4], dtype=float)
+    starts, opens, highs, lows, closes = ohlc(times, values, 2)
+
+    assert starts.tolist() == [0, 4.5]
+    assert opens.tolist() == [5, 2]
+    assert highs.tolist() == [7, 9]
+    assert lows.tolist() == [3, 1]
+    assert closes.tolist() == [6, 4]
+
+
+def test_ohlc_leaves_out_empty_buckets():
+    starts, opens, highs, lows, closes = ohlc([0, 1, 10], [1, 2, 3], 5)
+    assert starts.tolist() == [0, 8]
+    assert closes.tolist() == [2, 3]
+    assert all(len(column) == 0 for column in ohlc([], [], 5))
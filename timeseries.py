@@ -0,0 +1,68 @@
+import numpy as np
+
+# Downsampling of (time, value) series for charting. Times are numbers
+# (e.g. epoch milliseconds) sorted ascending; nothing here touches the
+# database.
+
+
+def lttb(times, values, threshold: int):
+    """Largest-Triangle-Three-Buckets downsampling to at most threshold points.
+
+    Keeps the first and last points and, from each bucket in between, the
+    point forming the largest triangle with the previously kept point and
+    the average of the next bucket. Returns (times, values) arrays.
+    """
+    times = np.asarray(times, dtype=float)
+    values = np.asarray(values, dtype=float)
+    count = len(times)
+    if threshold >= count or threshold < 3:
+        return times, values
+
+    # Bucket boundaries for the points between the first and the last one
+    edges = np.linspace(1, count - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = count - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start, next_end = edges[bucket + 1], edges[bucket + 2] if bucket + 2 < len(edges) else count
+        next_end = max(next_end, next_start + 1)
+        average_time = times[next_start:next_end].mean()
+        average_value = values[next_start:next_end].mean()
+
+        bucket_times = times[start:end]
+        bucket_values = values[start:end]
+        areas = np.abs((times[previous] - average_time) * (bucket_values - values[previous])
+                       - (times[previous] - bucket_times) * (average_value - values[previous]))
+        previous = start + int(np.argmax(areas)) if len(areas) else start
+        selected[bucket + 1] = previous
+
+    return times[selected], values[selected]
+
+
+def ohlc(times, values, buckets: int):
+    """Aggregate a series into at most buckets equal-width time buckets.
+
+    Returns (bucket_start, open, high, low, close) arrays; empty buckets
+    are left out.
+    """
+    times = np.asarray(times, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if len(times) == 0:
+        empty = np.array([], dtype=float)
+        return empty, empty, empty, empty, empty
+
+    first, last = times[0], times[-1]
+    width = (last - first) / buckets if last > first else 1.0
+    index = np.minimum(((times - first) // width).astype(int), buckets - 1)
+
+    # Times are sorted, so every bucket is a contiguous run of points
+    starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+    ends = np.r_[starts[1:], len(times)] - 1
+    return (first + index[starts] * width,
+            values[starts],
+            np.maximum.reduceat(values, starts),
+            np.minimum.reduceat(values, starts),
+            values[ends])